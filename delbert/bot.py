@@ -1,45 +1,109 @@
+import base64
+import fnmatch
 import functools
 import getopt
-import inspect
 import os
 import stat
 import sys
 import time
-import types
 
 import yaml
 
 from twisted.words.protocols import irc
 from twisted.internet import (
+    defer,
     protocol,
     reactor,
     threads,
 )
-from twisted.python import log
+from twisted.python import (
+    context,
+    failure,
+    log,
+)
 from twisted.protocols.policies import TrafficLoggingFactory
 
+import bus
 import channels
+import httpclient
+import loader
+import metrics
+import outbound
 import plugin
+import profiler
+import reloader
+import router
+import supervisor
+import text
+import trace
+import workqueues
 
 DEFAULT_CONFIG = os.path.join(
     os.environ['HOME'], '.config', 'delbert', 'bot.conf')
 
 
 class BotProtocol(irc.IRCClient):
-    lineRate = 0.5
+    # Outgoing lines are rate limited by the outbound scheduler instead.
+    lineRate = None
+
+    # Run every passive matching a message in a single worker job rather
+    # than deferring each one to its own thread.
+    batch_passives = True
+
+    # Passives running longer than this many seconds get logged.
+    slow_passive = 1.0
+
+    # Authenticate with SASL while registering rather than messaging nickserv
+    # once signed on.  Servers without SASL fall back to nickserv.
+    sasl = True
+
+    # Account to authenticate as, the nickname when None.
+    account = None
+
+    # Name of the network the bot is connected to.
+    network = None
+
+    # metrics.HandlerMetrics recording handler calls, None to not record.
+    metrics = None
+
+    # trace.Tracer recording spans of a sample of messages, None to not
+    # trace them.
+    tracer = None
 
-    def __init__(self, nickname, pw, channels):
+    # profiler.SamplingProfiler counting handler calls while it runs.
+    profiler = None
+
+    # workqueues.WorkQueues bounding the handlers queued for threads, None
+    # to not bound them.
+    queues = None
+
+    def __init__(self, nickname, pw, channels, scheduler=None,
+                 handoff=None):
         """
         Create an irc bot.
 
-        @param nickname - nickname of the bot.
-        @param pw       - password for the bot.
-        @param channels - list of channels the bot should join.
+        @param nickname     - nickname of the bot.
+        @param pw           - password for the bot.
+        @param channels     - list of channels the bot should join.
+        @param scheduler    - outbound.OutboundScheduler rate limiting lines
+                              sent to the server.
+        @param handoff      - outbound.Handoff moving lines sent from worker
+                              threads to the reactor.
         """
         self._nickname = nickname
         self._pw = pw
         self._channels = channels
         self._command_char = '!'
+        self._authenticated = False
+        self._outbound = scheduler
+        if self._outbound is None:
+            self._outbound = outbound.OutboundScheduler()
+        self._handoff = handoff
+        if self._handoff is None:
+            self._handoff = outbound.Handoff()
+
+        # Replaced once connected, needed before then to size lines.
+        self.supported = irc.ServerSupportedFeatures()
 
     @property
     def nickname(self):
@@ -48,6 +112,14 @@ class BotProtocol(irc.IRCClient):
         """
         return self._nickname
 
+    def has_channel(self, channel):
+        """
+        Check if a channel is configured for this bot.
+
+        @param channel  - name of the channel.
+        """
+        return channel != self._nickname and channel in self._channels
+
     def _log_callback(self, *args, **kwds):
         if hasattr(args[1], 'printTraceback'):
             args[1].printTraceback()
@@ -55,47 +127,241 @@ class BotProtocol(irc.IRCClient):
             args[0],
             system=kwds['system'] if 'system' in kwds else 'BotProtocol')
 
+    def connectionLost(self, reason):
+        self._outbound.stop()
+        irc.IRCClient.connectionLost(self, reason)
+
+    def _write_line(self, line):
+        irc.IRCClient.sendLine(self, line)
+
+    def sendLine(self, line):
+        """
+        Queue a line with the outbound scheduler.  Messages and notices are
+        queued per target, with the priority of the handler sending them.
+        Every other line is a control line sent ahead of them.  Control lines
+        sent before sign on are written straight away so registration is not
+        stuck behind lines queued by a previous connection.
+        """
+        target = None
+        priority = outbound.CONTROL
+
+        parts = line.split(' ', 2)
+        if parts[0] in ('PRIVMSG', 'NOTICE') and len(parts) > 1:
+            target = parts[1]
+            priority = context.get(outbound.PRIORITY, outbound.DEFAULT)
+
+        sent = None
+        traced = trace.current()
+        if traced is not None and self.tracer is not None:
+            sent = functools.partial(
+                self.tracer.span,
+                traced,
+                'outbound %s' % (parts[0],),
+                time.time(),
+                target=target)
+
+        if priority == outbound.CONTROL and not self._registered:
+            self._write_line(line)
+        else:
+            self._handoff.call(
+                self._outbound.push, line, target, priority, sent)
+
+    def register(self, nickname, hostname='foo', servername='bar'):
+        if self.sasl:
+            # Registration is suspended until CAP END is sent.
+            self.sendLine('CAP REQ :sasl')
+        irc.IRCClient.register(self, nickname, hostname, servername)
+
+    def irc_CAP(self, prefix, params):
+        if len(params) < 3:
+            return
+
+        subcommand, caps = params[1], params[-1].split()
+        if subcommand == 'ACK' and 'sasl' in caps:
+            self.sendLine('AUTHENTICATE PLAIN')
+        elif subcommand in ('ACK', 'NAK'):
+            log.msg('SASL not supported by server')
+            self.sendLine('CAP END')
+
+    def irc_AUTHENTICATE(self, prefix, params):
+        if not params or params[0] != '+':
+            return
+
+        token = base64.b64encode('\0'.join(
+            (self.account or self._nickname,) * 2 + (self._pw,)))
+
+        # Responses are sent in chunks of 400 bytes, a full last chunk is
+        # followed by an empty one.
+        for i in range(0, len(token), 400):
+            self.sendLine('AUTHENTICATE %s' % (token[i:i + 400],))
+        if len(token) % 400 == 0:
+            self.sendLine('AUTHENTICATE +')
+
+    def irc_RPL_SASLSUCCESS(self, prefix, params):
+        log.msg('SASL authentication succeeded')
+        self._authenticated = True
+        self.sendLine('CAP END')
+
+    def irc_ERR_SASLFAIL(self, prefix, params):
+        log.err('SASL authentication failed: %s' % (params[-1],))
+        self.sendLine('CAP END')
+
+    irc_903 = irc_RPL_SASLSUCCESS
+    irc_904 = irc_ERR_SASLFAIL
+    irc_905 = irc_ERR_SASLFAIL
+    irc_906 = irc_ERR_SASLFAIL
+    irc_907 = irc_ERR_SASLFAIL
+
     def signedOn(self):
         log.msg("Signed on")
-        self.msg('nickserv', 'identify %s %s' % (self._nickname, self._pw))
-        for c in (c for c in self._channels.keys() if not c == self._nickname):
-            self.join(c)
+        factory = getattr(self, 'factory', None)
+        if factory is not None and hasattr(factory, 'resetDelay'):
+            factory.resetDelay()
+
+        if not self._authenticated:
+            # Identify ahead of the joins in case channels need it.
+            context.call(
+                {outbound.PRIORITY: outbound.CONTROL},
+                self.msg,
+                'nickserv',
+                'identify %s %s' % (self.account or self._nickname, self._pw))
+
+        # Lines are held from here on, until the scheduler is started, so
+        # start it now rather than waiting for a motd that may never end.
+        self._outbound.start(self._write_line)
+
+    def receivedMOTD(self, motd):
+        # The server has sent its limits by the end of the motd.
+        self.join_channels(
+            [c for c in self._channels.keys() if not c == self._nickname])
+
+    def irc_ERR_NOMOTD(self, prefix, params):
+        self.receivedMOTD(None)
+
+    def join_channels(self, channels):
+        """
+        Join several channels with as few JOIN lines as the server allows.
+
+        @param channels - names of the channels to join.
+        """
+        if not len(channels):
+            return
+
+        targets = self.supported.getFeature('TARGMAX', {}).get('JOIN')
+        if not targets:
+            targets = len(channels)
+
+        limit = irc.MAX_COMMAND_LENGTH - len('JOIN \r\n')
+        for i in range(0, len(channels), targets):
+            for line in text.pack_lines(channels[i:i + targets], limit, ','):
+                self.sendLine('JOIN %s' % (line,))
+
+    def _max_payload(self, command, target):
+        """
+        Get the number of bytes that fit in a single message or notice to a
+        target once the server has added our prefix.
+
+        @param command  - PRIVMSG or NOTICE.
+        @param target   - user or channel the line is sent to.
+        @return         - maximum length of the message in bytes.
+        """
+        fmt = '%s %s :' % (command, target)
+        return self._safeMaximumLineLength(fmt) - len(fmt) - 2
 
     def send_msg(self, target, msg):
         """
-        Send a message to a user or a channel
+        Send a message to a user or a channel.  Messages too long for a single
+        line are split without breaking up multibyte characters.  Messages
+        sent from a worker thread are handed off to the reactor.
 
         @param target   - user or channel to send a message to.
         @param msg      - message to send.
         """
-        if isinstance(msg, types.UnicodeType):
-            msg = msg.encode('utf-8')
-        self.msg(target, msg)
+        if not outbound.in_reactor_thread():
+            self._handoff.call(self.send_msg, target, msg)
+            return
+
+        self._trace_send('send_msg', target)
+        limit = self._max_payload('PRIVMSG', target)
+        for line in text.split_message(msg, limit):
+            self.msg(target, line)
 
-    def send_notice(self, channel, msg):
+    def send_notice(self, target, msg):
         """
-        Send a notice to a user or a channel
+        Send a notice to a user or a channel.  Notices too long for a single
+        line are split without breaking up multibyte characters.
 
         @param target   - user or channel to send a notice to.
         @param msg      - notice to send.
         """
-        if isinstance(msg, types.UnicodeType):
-            msg = msg.encode('utf-8')
-        self.notice(channel, msg)
+        if not outbound.in_reactor_thread():
+            self._handoff.call(self.send_notice, target, msg)
+            return
+
+        self._trace_send('send_notice', target)
+        limit = self._max_payload('NOTICE', target)
+        for line in text.split_message(msg, limit):
+            self.notice(target, line)
+
+    def _trace_send(self, name, target):
+        traced = trace.current()
+        if traced is not None and self.tracer is not None:
+            self.tracer.instant(traced, name, target=target)
+
+    def send_lines(self, target, lines, notice=False, sep=' | '):
+        """
+        Send several short messages to a user or a channel, packed into as
+        few lines as the server allows.
+
+        @param target   - user or channel to send the messages to.
+        @param lines    - messages to send, in order.
+        @param notice   - send notices rather than messages.
+        @param sep      - separator placed between packed messages.
+        """
+        if not outbound.in_reactor_thread():
+            self._handoff.call(
+                self.send_lines, target, list(lines), notice, sep)
+            return
+
+        if notice:
+            command, send = 'NOTICE', self.send_notice
+        else:
+            command, send = 'PRIVMSG', self.send_msg
+
+        limit = self._max_payload(command, target)
+        for line in text.pack_lines(lines, limit, sep):
+            send(target, line)
 
     def _call(self, *args, **kwds):
         """
-        Defer a method to a thread.  All arguments and keywords are passed to
-        the method aside from the following:
+        Defer a method to a thread.  Methods marked as returning a Deferred
+        are instead called directly on the reactor.  All arguments and
+        keywords are passed to the method aside from the following:
 
         Keywords:
-            @param cb   - callback when method finishes with success.
-            @param eb   - callback when method finishes with error.
+            @param cb       - callback when method finishes with success.
+            @param eb       - callback when method finishes with error.
+            @param priority - outbound priority of lines sent by the method.
+            @param release  - function called with the result once the
+                              method finishes, see _admit().
+
+        @return - Deferred firing when the method finishes.
         """
         cb = kwds.pop('cb', None)
         eb = kwds.pop('eb', None)
+        release = kwds.pop('release', None)
+        ctx = {
+            outbound.PRIORITY: kwds.pop('priority', outbound.DEFAULT),
+            router.PROTOCOL: self,
+        }
+
+        if getattr(args[0], 'is_deferred', False):
+            th = context.call(ctx, defer.maybeDeferred, *args, **kwds)
+        else:
+            th = context.call(ctx, threads.deferToThread, *args, **kwds)
 
-        th = threads.deferToThread(*args, **kwds)
+        if release is not None:
+            th.addBoth(release)
 
         if cb is not None:
             th.addCallback(cb)
@@ -103,6 +369,74 @@ class BotProtocol(irc.IRCClient):
         if eb is not None:
             th.addErrback(eb)
 
+        return th
+
+    def _admit(self, kind, handlers, key=None):
+        """
+        Admit a job running some handlers before it is queued.  Jobs run in a
+        thread or in a plugin worker are bounded by the work queues, see
+        workqueues.WorkQueues.  Other handlers returning a Deferred run on
+        the reactor straight away and are always admitted.  Admitted jobs
+        count as running handlers of their plugins, see
+        plugin.Plugin.drain(), and the profiler counts them once they finish.
+
+        @param kind     - kind of the handlers: command, passive or
+                          user_join.
+        @param handlers - handlers run by the job.
+        @param key      - identity of the job, see WorkQueues.admit().
+        @return         - function to call with the result of the job once
+                          it finishes, see _call(), or None if the job was
+                          shed.
+        """
+        queued = any(
+            getattr(f, 'is_remote', False) or
+            not getattr(f, 'is_deferred', False) for f in handlers)
+        release = None
+        if queued and self.queues is not None:
+            release = self.queues.admit(kind, key)
+            if release is None:
+                return None
+
+        # Plugins being replaced wait for the jobs queued for them.
+        owners = set(plugin.owner(f) for f in handlers)
+        leaves = [p.queued() for p in owners if p is not None]
+
+        # Only jobs that ran count towards a profile of N calls.
+        profiler = self.profiler
+
+        def finished(result):
+            for leave in leaves:
+                leave()
+            if profiler is not None:
+                profiler.handled(len(handlers))
+            if release is not None:
+                return release(result)
+            return result
+
+        return finished
+
+    def _timed(self, f, kind, name, traced=None):
+        """
+        Record the calls and latency of a handler if metrics are enabled,
+        see metrics.HandlerMetrics, and its spans if the message it handles
+        is traced, see trace.Tracer.wrap().
+        """
+        if self.metrics is not None:
+            f = self.metrics.wrap(f, kind, name)
+        if traced is not None:
+            f = self.tracer.wrap(f, traced, '%s %s' % (kind, name))
+        return f
+
+    def _trace(self, name, channel):
+        """
+        Start tracing a message if tracing is enabled and it is sampled.
+
+        @return - id of the trace or None.
+        """
+        if self.tracer is None:
+            return None
+        return self.tracer.start(name, channel=channel, network=self.network)
+
     def joined(self, channel):
         log.msg("Joined %s" % (channel,))
 
@@ -110,18 +444,32 @@ class BotProtocol(irc.IRCClient):
         log.msg('%s joined %s' % (user, channel))
 
         nick = plugin.get_nick(user)
+        traced = self._trace('userJoined', channel)
 
         for name, f in self._channels[channel].user_joins.items():
+            release = self._admit('user_join', [f], (name, channel, nick))
+            if release is None:
+                continue
+
             eb = functools.partial(
                 self._log_callback,
                 '<%s> error' % (name,),
                 system=channel)
-            self._call(f, nick, channel, eb=eb)
+            self._call(
+                self._timed(f, 'user_join', name, traced), nick, channel,
+                eb=eb,
+                priority=outbound.PASSIVE,
+                release=release)
 
     def privmsg(self, user, channel, msg):
+        if channel == self._nickname and self._admin(user, msg):
+            return
+
         if channel not in self._channels:
             return
 
+        traced = self._trace('privmsg', channel)
+
         if msg.startswith(self._command_char):
             cmd = msg[1:]
             try:
@@ -136,26 +484,120 @@ class BotProtocol(irc.IRCClient):
             elif cmd == 'user_joins':
                 self._help(channel, args, 'user_joins')
             else:
-                self._cmd(user, channel, cmd, args)
+                self._cmd(user, channel, cmd, args, traced)
 
         elif not channel == self._nickname:
-            for name, f in self._channels[channel].passives.items():
+            passives = self._channels[channel].match_passives(msg)
+            if self.batch_passives:
+                batch = [
+                    (name, f) for name, f in passives
+                    if not getattr(f, 'is_deferred', False)]
+
+                if len(batch) > 1:
+                    passives = [p for p in passives if p not in batch]
+                    release = self._admit('passive', [f for _, f in batch])
+                    if release is not None:
+                        eb = functools.partial(
+                                self._log_callback,
+                                'passives failed',
+                                system=channel)
+                        self._call(
+                            self._run_passives, user, channel, msg,
+                            [
+                                (n, self._timed(f, 'passive', n, traced))
+                                for n, f in batch],
+                            eb=eb,
+                            priority=outbound.PASSIVE,
+                            release=release)
+
+            for name, f in passives:
+                release = self._admit('passive', [f])
+                if release is None:
+                    continue
+
                 eb = functools.partial(
                         self._log_callback,
                         'passive %s failed' % (name,),
                         system=channel)
-                self._call(f, user, channel, msg, eb=eb)
+                self._call(
+                    self._timed(f, 'passive', name, traced),
+                    user, channel, msg,
+                    eb=eb,
+                    priority=outbound.PASSIVE,
+                    release=release)
+
+    def _run_passives(self, user, channel, msg, passives):
+        """
+        Run several passives for the same message one after another.  A
+        failing passive is logged and does not prevent the others from
+        running.
+
+        @param user     - user sending the message.
+        @param channel  - channel the message was sent to.
+        @param msg      - message.
+        @param passives - list of (name, method) tuples to run.
+        """
+        for name, f in passives:
+            start = time.time()
+            try:
+                f(user, channel, msg)
+            except Exception:
+                self._log_callback(
+                    'passive %s failed after %.3fs' % (
+                        name, time.time() - start),
+                    failure.Failure(),
+                    system=channel)
+                continue
+
+            elapsed = time.time() - start
+            if elapsed > self.slow_passive:
+                log.msg(
+                    'passive %s took %.3fs' % (name, elapsed),
+                    system=channel)
+
+    def _admin(self, user, msg):
+        """
+        Run an admin command sent in a private message.  Admin commands are
+        registered with the factory and only answer users matching one of
+        its admin masks.
+
+        @param user - user sending the message.
+        @param msg  - message sent.
+        @return     - True if the message was an admin command.
+        """
+        factory = getattr(self, 'factory', None)
+        if factory is None or not msg.startswith(self._command_char):
+            return False
+
+        cmd, _, args = msg[1:].partition(' ')
+        f = factory.admin_commands.get(cmd)
+        if f is None or not factory.is_admin(user):
+            return False
+
+        log.msg('Admin command from %s: %s' % (user, msg))
+        nick = plugin.get_nick(user)
 
-    def _cmd(self, user, channel, cmd, args):
+        def failed(reason):
+            log.err(reason, 'Admin command %s failed' % (cmd,))
+            return ['%s failed: %s' % (cmd, reason.getErrorMessage())]
+
+        d = defer.maybeDeferred(f, user, args)
+        d.addErrback(failed)
+        d.addCallback(lambda lines: self.send_lines(nick, lines, notice=True))
+        return True
+
+    def _cmd(self, user, channel, cmd, args, traced=None):
         """
         Respond to an irc command.
 
         @param user     - user calling command.
         @param channel  - channel user is calling command from.
         @param args     - command arguments.
+        @param traced   - id of the trace of the message, see trace.Tracer.
         """
         f = self._channels[channel].commands.get(cmd, None)
         if f is not None:
+            release = self._admit('command', [f])
             cb = functools.partial(
                 self._log_callback,
                 '!%s completed' % (cmd,),
@@ -164,7 +606,12 @@ class BotProtocol(irc.IRCClient):
                 self._log_callback,
                 '!%s error' % (cmd,),
                 system=channel)
-            self._call(f, user, channel, args, cb=cb, eb=eb)
+            self._call(
+                self._timed(f, 'command', cmd, traced), user, channel, args,
+                cb=cb,
+                eb=eb,
+                priority=outbound.COMMAND,
+                release=release)
 
     def _help(self, channel, search, type='commands'):
         """
@@ -182,13 +629,35 @@ class BotProtocol(irc.IRCClient):
         search = search.split(' ')[0]
         mapping = getattr(self._channels[channel], type, {})
         names = sorted(mapping.keys())
-        for name in [n for n in names if n.startswith(search)]:
-            self.send_notice(channel, '%s:  %s' % (name, mapping[name].help))
+        self.send_lines(
+            channel,
+            ['%s:  %s' % (n, mapping[n].help) for n in names
+                if n.startswith(search)],
+            notice=True)
 
 
-class BotFactory(protocol.ClientFactory):
-    def __init__(self, config):
+class BotFactory(protocol.ReconnectingClientFactory):
+    def __init__(self, config, clock=None, plugins=None, http=None,
+                 proto_router=None, registry=None, tracer=None):
+        """
+        Create a factory for connections to a single network.  Factories for
+        several networks in one process share plugins, the http client and
+        a protocol router.
+
+        @param config       - network configuration.
+        @param clock        - reactor used for scheduling.
+        @param plugins      - plugins shared with other networks, loaded
+                              from the plugins directory if None.
+        @param http         - shared httpclient.HTTPClient.
+        @param proto_router - shared router.ProtocolRouter.
+        @param registry     - metrics.Registry to record metrics in, None to
+                              not record them.
+        @param tracer       - trace.Tracer recording a sample of messages,
+                              None to not trace them.
+        """
         self._config = config
+        self.tracer = tracer
+        self.name = config.get('name', config.get('server'))
         self.nickname = config['nick']
         self.pw = config['pass']
         self.dbdir = config['dbdir']
@@ -204,50 +673,150 @@ class BotFactory(protocol.ClientFactory):
                     channel,
                     config if config is not None else {})
 
-        self._plugins = []
-        self._load_plugins()
+        self.http = http
+        if self.http is None:
+            self.http = httpclient.HTTPClient(self._config.get('http', {}))
+
+        self.router = proto_router
+        if self.router is None:
+            self.router = router.ProtocolRouter()
+
+        self.metrics = None
+        delays = None
+        if registry is not None:
+            self.metrics = metrics.HandlerMetrics(registry)
+            waited = registry.histogram(
+                'delbert_outbound_delay_seconds',
+                'Time lines waited for the flood limit.',
+                ('network',))
+
+            def delays(seconds):
+                waited.observe(seconds, self.name)
+
+        # The scheduler outlives connections so lines queued while the bot
+        # is disconnected are sent once it is back.
+        flood = self._config.get('flood', {})
+        self.outbound = outbound.OutboundScheduler(
+            flood.get('rate', 2.0),
+            flood.get('burst', 5),
+            clock,
+            delays)
+
+        if registry is not None:
+            registry.gauge(
+                'delbert_outbound_queue_lines',
+                'Lines waiting for the flood limit.',
+                ('network',)).set_function(
+                    functools.partial(len, self.outbound),
+                    self.name)
+
+        # Lines sent from worker threads reach the scheduler through the
+        # reactor, one wakeup per batch of lines.
+        self.handoff = outbound.Handoff(clock)
+
+        # Handlers beyond the limits are shed rather than queued for threads.
+        queues = dict(self._config.get('queues') or {})
+        shed = None
+        if registry is not None:
+            shed_total = registry.counter(
+                'delbert_handler_shed_total',
+                'Handlers not run because their work queue was full.',
+                ('network', 'kind', 'reason'))
+
+            def shed(kind, reason):
+                shed_total.inc(self.name, kind, reason)
+
+        self.queues = workqueues.WorkQueues(
+            queues,
+            queues.pop('report_interval', 60),
+            clock,
+            shed)
+
+        if registry is not None:
+            pending = registry.gauge(
+                'delbert_handler_pending_jobs',
+                'Handlers queued for a thread or running.',
+                ('network', 'kind'))
+            for kind in ('command', 'passive', 'user_join'):
+                pending.set_function(
+                    functools.partial(self.queues.pending, kind),
+                    self.name,
+                    kind)
+
+        # Reconnect with exponential backoff, see ReconnectingClientFactory.
+        self.clock = clock
+        reconnect = self._config.get('reconnect', {})
+        self.initialDelay = reconnect.get('initial_delay', 1.0)
+        self.delay = self.initialDelay
+        self.maxDelay = reconnect.get('max_delay', 300)
+        self.factor = reconnect.get('factor', 2.0)
+        self.jitter = reconnect.get('jitter', 0.1)
+
+        # Users allowed to run admin commands, as nick!user@host masks.
+        self.admins = self._config.get('admins', [])
+        self.admin_commands = {}
+        self.profiler = None
+
+        self._plugins = plugins
+        if self._plugins is None:
+            self._plugins = self._load_plugins()
 
-    def buildProtocol(self, address):
-        proto = BotProtocol(self.nickname, self.pw, self.channels)
         for p in self._plugins:
-            p.initialize(self.nickname, proto)
+            p.initialize(self.nickname, self.router, self.http)
+
+        for channel in self.channels.values():
+            channel.set_plugins(self._plugins)
+
+    @property
+    def plugins(self):
+        """
+        List of loaded plugins.
+        """
+        return self._plugins
+
+    def is_admin(self, user):
+        """
+        Check if a user may run admin commands.
+
+        @param user - nick!user@host of the user.
+        """
+        return any(fnmatch.fnmatchcase(user, mask) for mask in self.admins)
+
+    def buildProtocol(self, address):
+        proto = BotProtocol(
+            self.nickname,
+            self.pw,
+            self.channels,
+            self.outbound,
+            self.handoff)
+        proto.factory = self
+        proto.batch_passives = self._config.get('batch_passives', True)
+        proto.sasl = self._config.get('sasl', True)
+        proto.account = self._config.get('account')
+        proto.network = self.name
+        proto.metrics = self.metrics
+        proto.tracer = self.tracer
+        proto.profiler = self.profiler
+        proto.queues = self.queues
+        self.router.attach(self.name, proto)
         return proto
 
     def clientConnectionLost(self, connector, reason):
         log.err("Lost connection: %s" % (reason,))
-        time.sleep(1)
-        connector.connect()
+        protocol.ReconnectingClientFactory.clientConnectionLost(
+            self, connector, reason)
 
     def clientConnectionFailed(self, connector, reason):
         log.err("Connection failed: %s" % (reason,))
-        time.sleep(1)
-        connector.connect()
+        protocol.ReconnectingClientFactory.clientConnectionFailed(
+            self, connector, reason)
 
     def _load_plugins(self, path='plugins'):
-        def is_plugin(obj):
-            return (type(obj) == type
-                    and obj != plugin.Plugin
-                    and plugin.Plugin in inspect.getmro(obj))
-
-        for pfile in os.listdir(path):
-            if pfile.endswith('.py') and not pfile.startswith('__'):
-                pname = pfile[:-3]
-                env = {}
-
-                try:
-                    execfile(os.path.join(path, pfile), env)
-
-                except ImportError, e:
-                    log.err("Failed to log plugin '%s': %s" % (pname, e))
-                    continue
-
-                for obj in [obj for obj in env.values() if is_plugin(obj)]:
-                    log.msg("Loaded %s.%s" % (pname, obj.__name__))
-                    self._plugins.append(obj(self._config.get(pname, {})))
-
-        for channel in self.channels.values():
-            for p in self._plugins:
-                channel.register_plugin(p)
+        return loader.load_plugins(
+            self._config,
+            path,
+            lazy=self._config.get('lazy_plugins', True),
+            cache=os.path.join(self.dbdir, 'plugins.manifest'))
 
 
 def parse_config(path):
@@ -258,14 +827,29 @@ def parse_config(path):
     with open(path) as f:
         config = yaml.load(f.read())
 
-    missing = []
-    for key in ('server', 'port', 'nick', 'pass'):
-        if key not in config:
-            missing.append(key)
+    # Every network inherits the top level configuration, a configuration
+    # without networks is a single network.
+    networks = config.pop('networks', None)
+    if networks is None:
+        networks = [{}]
+
+    config['networks'] = []
+    for network in networks:
+        network = dict(config, **network)
+        del network['networks']
 
-    if len(missing):
-        raise KeyError("Missing required configuration keys: %s" % (
-            ' '.join(missing),))
+        missing = []
+        for key in ('server', 'port', 'nick', 'pass'):
+            if key not in network:
+                missing.append(key)
+
+        if len(missing):
+            raise KeyError("Missing required configuration keys: %s" % (
+                ' '.join(missing),))
+
+        network.setdefault('name', network['server'])
+        network.setdefault('channels', {})
+        config['networks'].append(network)
 
     if 'dbdir' in config:
         config['dbdir'] = os.path.expanduser(config['dbdir'])
@@ -282,9 +866,146 @@ def parse_config(path):
         raise OSError("dbdir '%s' exists but is not a directory" % (
             config['dbdir'],))
 
+    for network in config['networks']:
+        network['dbdir'] = config['dbdir']
+
     return config
 
 
+def bus_socket(config, shard=None):
+    """
+    Get the path of the unix socket plugin workers connect to.
+
+    @param config   - configuration.
+    @param shard    - index of the bot when channels are sharded.
+    """
+    path = config['bus'].get(
+        'socket',
+        os.path.join(config['dbdir'], 'bus.sock'))
+    if shard is not None:
+        path = '%s-%d' % (path, shard)
+    return path
+
+
+def make_tracer(config, shard=None):
+    """
+    Create the tracer described by the trace section of the configuration.
+
+    @param config   - configuration.
+    @param shard    - index of the bot when channels are sharded, each shard
+                      writes its own file.
+    @return         - trace.Tracer.
+    """
+    settings = config['trace'] or {}
+    path = settings.get(
+        'path',
+        os.path.join(config['dbdir'], 'trace.json'))
+    if shard is not None:
+        path = '%s-%d' % (path, shard)
+
+    return trace.Tracer(
+        path,
+        settings.get('sample', 0.01),
+        settings.get('rotate_length', 10 * 1024 * 1024),
+        settings.get('max_files', 5))
+
+
+def connect(config, plugins, http, proto_router, traffic_log=None,
+            registry=None, tracer=None):
+    """
+    Connect to every configured network.
+
+    @param config       - configuration.
+    @param plugins      - plugins shared by the networks, loaded if None.
+    @param http         - shared httpclient.HTTPClient.
+    @param proto_router - shared router.ProtocolRouter.
+    @param traffic_log  - path traffic is logged to, None to not log.
+    @param registry     - metrics.Registry, None to not record metrics.
+    @param tracer       - trace.Tracer, None to not trace messages.
+    """
+    plugin_reloader = None
+    if plugins is None:
+        network = config['networks'][0]
+        plugin_reloader = reloader.Reloader(
+            network,
+            lazy=network.get('lazy_plugins', True),
+            cache=os.path.join(network['dbdir'], 'plugins.manifest'))
+        plugins = plugin_reloader.load()
+
+    # Samples every thread, so a single profiler serves every network.
+    settings = config.get('profiler', {})
+    sampling = profiler.SamplingProfiler(
+        config['dbdir'],
+        settings.get('interval', 0.005),
+        settings.get('max_duration', 300),
+        settings.get('top', 10))
+    reactor.addSystemEventTrigger('before', 'shutdown', sampling.stop)
+
+    for network in config['networks']:
+        bot = BotFactory(
+            network,
+            plugins=plugins,
+            http=http,
+            proto_router=proto_router,
+            registry=registry,
+            tracer=tracer)
+        plugins = bot.plugins
+        reactor.addSystemEventTrigger('before', 'shutdown', bot.stopTrying)
+
+        bot.profiler = sampling
+        bot.admin_commands['profile'] = sampling.command
+
+        if plugin_reloader is not None:
+            plugin_reloader.attach(
+                bot.channels.values(),
+                bot.nickname,
+                bot.router,
+                bot.http)
+            bot.admin_commands['reload'] = plugin_reloader.command
+
+        factory = bot
+        if traffic_log is not None:
+            path = traffic_log
+            if len(config['networks']) > 1:
+                path = '%s-%s' % (traffic_log, bot.name)
+            factory = TrafficLoggingFactory(bot, path)
+        reactor.connectTCP(network['server'], network['port'], factory)
+
+    watch = config.get('reload', {})
+    if plugin_reloader is not None and watch.get('watch', False):
+        plugin_reloader.watch(watch.get('interval', 2.0))
+
+
+def run_plugin_worker(config, index, shard=None):
+    """
+    Run plugins for a connection front-end.
+
+    @param config   - configuration.
+    @param index    - index of the plugin worker.
+    @param shard    - index of the bot when channels are sharded.
+    """
+    network = config['networks'][0]
+    if index:
+        # Only the first worker listens for github webhooks.
+        network.get('github', {}).pop('listen_port', None)
+
+    http = httpclient.HTTPClient(config.get('http', {}))
+    reactor.addSystemEventTrigger('before', 'shutdown', http.close)
+
+    proto = bus.BusProto(network['nick'])
+    plugins = loader.load_plugins(
+        network,
+        lazy=network.get('lazy_plugins', True),
+        cache=os.path.join(network['dbdir'], 'plugins.manifest'))
+    for p in plugins:
+        p.initialize(network['nick'], proto, http)
+
+    reactor.connectUNIX(
+        bus_socket(config, shard),
+        bus.WorkerFactory(plugins, proto))
+    reactor.run()
+
+
 def usage():
     print """%s [ARGUMENTS]
 
@@ -292,6 +1013,10 @@ ARGUMENTS:
     -h, --help              This screen
     -c, --config [FILE]     Path to config file [%s]
     -t, --traffic [FILE]    Log traffic to specified file
+    -w, --workers [N]       Split channels between N worker processes
+    -s, --shard [I/N]       Run as worker I of N
+    -p, --plugin-worker [I/N]
+                            Run as plugin worker I of N
 """
 
 
@@ -299,8 +1024,15 @@ def main():
     try:
         opts, args = getopt.getopt(
             sys.argv[1:],
-            'hc:t:',
-            ['help', 'config=', 'traffic='],
+            'hc:t:w:s:p:',
+            [
+                'help',
+                'config=',
+                'traffic=',
+                'workers=',
+                'shard=',
+                'plugin-worker=',
+            ],
         )
     except getopt.GetoptError, e:
         print (str(e))
@@ -308,6 +1040,9 @@ def main():
 
     config_path = DEFAULT_CONFIG
     traffic_log = None
+    workers = None
+    shard = None
+    plugin_worker = None
 
     for o, a in opts:
         if o in ('-h', '--help'):
@@ -317,8 +1052,16 @@ def main():
             config_path = a
         elif o in ('-t', '--traffic'):
             traffic_log = a
+        elif o in ('-w', '--workers'):
+            workers = int(a)
+        elif o in ('-s', '--shard'):
+            shard, workers = [int(v) for v in a.split('/')]
+        elif o in ('-p', '--plugin-worker'):
+            plugin_worker = int(a.split('/')[0])
 
     config = parse_config(config_path)
+    if workers is None:
+        workers = config.get('workers', 1)
 
     if 'logfile' in config:
         if config['logfile'] == 'stdout':
@@ -326,13 +1069,68 @@ def main():
         else:
             log.startLogging(config['logfile'])
 
-    bot = BotFactory(config)
-
-    if traffic_log is not None:
-        lf = TrafficLoggingFactory(bot, traffic_log)
-        reactor.connectTCP(config['server'], config['port'], lf)
+    if workers > 1 and shard is None:
+        boss = supervisor.Supervisor(supervisor.worker_args(), workers)
+        reactor.callWhenRunning(boss.start)
+        reactor.addSystemEventTrigger('before', 'shutdown', boss.stop)
+        reactor.run()
+        return
+
+    if shard is not None:
+        config = supervisor.shard_config(config, shard, workers)
+        if traffic_log is not None:
+            traffic_log = '%s-%d' % (traffic_log, shard)
+
+    if plugin_worker is not None:
+        run_plugin_worker(config, plugin_worker, shard)
+        return
+
+    registry = None
+    if 'metrics' in config:
+        # Shards serve their metrics on consecutive ports.
+        registry = metrics.Registry()
+        metrics.watch_thread_pool(registry)
+        metrics.listen(
+            registry,
+            config['metrics']['port'] + (shard or 0),
+            config['metrics'].get('interface', '127.0.0.1'))
+
+    tracer = None
+    if 'trace' in config:
+        tracer = make_tracer(config, shard)
+        reactor.addSystemEventTrigger('after', 'shutdown', tracer.close)
+
+    # Plugins, the http client and its cache are shared by every network.
+    http = httpclient.HTTPClient(
+        config.get('http', {}),
+        metrics=registry,
+        tracer=tracer)
+    proto_router = router.ProtocolRouter()
+    reactor.addSystemEventTrigger('before', 'shutdown', http.close)
+
+    if config.get('bus', {}).get('workers'):
+        # Plugins run in worker processes, the bot connects once they have
+        # described them.
+        front_end = bus.Bus(proto_router)
+        front_end.listen(bus_socket(config, shard))
+        pool = supervisor.Supervisor(
+            supervisor.worker_args(),
+            config['bus']['workers'],
+            option='--plugin-worker')
+        reactor.callWhenRunning(pool.start)
+        reactor.addSystemEventTrigger('before', 'shutdown', pool.stop)
+
+        front_end.ready.addCallback(lambda _: connect(
+            config,
+            front_end.plugins(),
+            http,
+            proto_router,
+            traffic_log,
+            registry,
+            tracer))
     else:
-        reactor.connectTCP(config['server'], config['port'], bot)
+        connect(
+            config, None, http, proto_router, traffic_log, registry, tracer)
 
     reactor.run()
 
@@ -0,0 +1,397 @@
+import json
+import os
+
+from twisted.internet import defer, protocol, reactor, threads
+from twisted.protocols import amp
+from twisted.python import context, log
+
+import outbound
+import plugin
+import router
+import text
+
+# Context keys holding the network and bot nickname a handler running in a
+# plugin worker was called for.
+NETWORK = 'delbert.bus.network'
+NICKNAME = 'delbert.bus.nickname'
+
+
+class HandlerError(Exception):
+    pass
+
+
+class NoWorkersError(Exception):
+    pass
+
+
+class Describe(amp.Command):
+    """
+    Ask a plugin worker for the plugins it runs.  The manifest is a json
+    mapping of plugin name to its commands, passives and user joins.
+    """
+    arguments = []
+    response = [('manifest', amp.String())]
+
+
+class Dispatch(amp.Command):
+    """
+    Run a plugin handler in a plugin worker.
+    """
+    arguments = [
+        ('plugin', amp.String()),
+        ('handler', amp.String()),
+        ('args', amp.ListOf(amp.String())),
+        ('network', amp.String(optional=True)),
+        ('nickname', amp.String()),
+        ('priority', amp.Integer()),
+    ]
+    response = []
+    errors = {HandlerError: 'HANDLER_ERROR'}
+
+
+class Send(amp.Command):
+    """
+    Send lines from a plugin worker through the front-end's connection.
+    """
+    arguments = [
+        ('method', amp.String()),
+        ('network', amp.String(optional=True)),
+        ('target', amp.String()),
+        ('lines', amp.ListOf(amp.String())),
+        ('notice', amp.Boolean()),
+        ('sep', amp.String()),
+        ('priority', amp.Integer()),
+    ]
+    requiresAnswer = False
+
+
+def manifest(plugins):
+    """
+    Describe the handlers of some plugins.
+
+    @param plugins  - list of plugins.
+    @return         - mapping of plugin name to a mapping with the help text
+                      of its commands, passives and user joins.  Passives
+                      also include their triggers.
+    """
+    ret = {}
+    for p in plugins:
+        ret[p.name] = {
+            'commands': dict(
+                (name, f.help) for name, f in p.commands.items()),
+            'passives': dict(
+                (name, {'help': f.help, 'triggers': p.triggers.get(name)})
+                for name, f in p.passives.items()),
+            'user_joins': dict(
+                (name, f.help) for name, f in p.user_joins.items()),
+        }
+    return ret
+
+
+class RemoteHandler(object):
+    """
+    Stand-in for a plugin handler running in a plugin worker.  Calls return
+    straight away but queue work in the worker, so they are bounded by the
+    work queues like threaded handlers, see BotProtocol._admit().
+    """
+    is_deferred = True
+    is_remote = True
+
+    def __init__(self, bus, plugin_name, name, help):
+        self._bus = bus
+        self._plugin = text.encode(plugin_name)
+        self.__name__ = text.encode(name)
+        self.help = help
+
+    def __call__(self, *args):
+        proto = context.get(router.PROTOCOL)
+        return self._bus.call(
+            self._plugin,
+            self.__name__,
+            args,
+            getattr(proto, 'network', None),
+            getattr(proto, 'nickname', ''),
+            context.get(outbound.PRIORITY, outbound.DEFAULT))
+
+
+class RemotePlugin(plugin.Plugin):
+    """
+    Stand-in for a plugin running in plugin workers, registered with channels
+    like any other plugin.
+    """
+    def __init__(self, bus, name, description):
+        """
+        @param bus          - Bus used to reach the plugin workers.
+        @param name         - name of the plugin.
+        @param description  - description of the plugin, see manifest().
+        """
+        super(RemotePlugin, self).__init__(name)
+
+        for handler, help in description['commands'].items():
+            self._commands[handler] = RemoteHandler(bus, name, handler, help)
+
+        for handler, info in description['passives'].items():
+            self._passives[handler] = RemoteHandler(
+                bus, name, handler, info['help'])
+            self._triggers[handler] = info['triggers']
+
+        for handler, help in description['user_joins'].items():
+            self._user_joins[handler] = RemoteHandler(
+                bus, name, handler, help)
+
+
+class FrontEndProtocol(amp.AMP):
+    """
+    Front-end side of the connection to a plugin worker.
+    """
+    def __init__(self, bus):
+        amp.AMP.__init__(self)
+        self._bus = bus
+
+    def connectionMade(self):
+        amp.AMP.connectionMade(self)
+        self._bus.worker_connected(self)
+
+    def connectionLost(self, reason):
+        amp.AMP.connectionLost(self, reason)
+        self._bus.worker_lost(self)
+
+    @Send.responder
+    def send(self, method, network, target, lines, notice, sep, priority):
+        self._bus.send(
+            method, network, target, lines, notice, sep, priority)
+        return {}
+
+
+class Bus(protocol.ServerFactory):
+    """
+    Connection front-end's end of the bus to plugin workers.  Handlers are
+    dispatched round-robin between the connected workers, and lines the
+    workers send are sent with the front-end's protocols.
+    """
+    def __init__(self, proto_router):
+        """
+        @param proto_router - router.ProtocolRouter of the front-end.
+        """
+        self._router = proto_router
+        self._workers = []
+        self._next = 0
+        self._manifest = None
+        self.ready = defer.Deferred()
+
+    @property
+    def workers(self):
+        """
+        List of connected plugin workers.
+        """
+        return list(self._workers)
+
+    def buildProtocol(self, addr):
+        return FrontEndProtocol(self)
+
+    def listen(self, path):
+        """
+        Listen for plugin workers on a unix socket.
+
+        @param path - path of the socket.
+        """
+        if os.path.exists(path):
+            os.unlink(path)
+        return reactor.listenUNIX(path, self)
+
+    def plugins(self):
+        """
+        Get stand-ins for the plugins run by the workers.  Only valid once
+        ready has fired.
+
+        @return - list of RemotePlugin.
+        """
+        return [
+            RemotePlugin(self, name, description)
+            for name, description in sorted(self._manifest.items())]
+
+    def worker_connected(self, worker):
+        log.msg('Plugin worker connected')
+        self._workers.append(worker)
+
+        if self._manifest is None:
+            d = worker.callRemote(Describe)
+            d.addCallback(self._described)
+            d.addErrback(log.err, 'Failed to describe plugins')
+
+    def _described(self, response):
+        if self._manifest is None:
+            self._manifest = json.loads(response['manifest'])
+            self.ready.callback(self._manifest)
+
+    def worker_lost(self, worker):
+        log.msg('Plugin worker disconnected')
+        if worker in self._workers:
+            self._workers.remove(worker)
+
+    def call(self, plugin_name, handler, args, network, nickname, priority):
+        """
+        Run a handler in the next plugin worker.
+
+        @return - Deferred firing once the handler has finished.
+        """
+        if not len(self._workers):
+            return defer.fail(NoWorkersError('No plugin workers connected'))
+
+        self._next = (self._next + 1) % len(self._workers)
+        worker = self._workers[self._next]
+        return worker.callRemote(
+            Dispatch,
+            plugin=plugin_name,
+            handler=handler,
+            args=[text.encode(a) for a in args],
+            network=network,
+            nickname=nickname,
+            priority=priority)
+
+    def send(self, method, network, target, lines, notice, sep, priority):
+        """
+        Send lines for a plugin worker.  Lines for a network go to its
+        protocol, others are routed like lines sent outside of a handler.
+        """
+        proto = self._router
+        if network is not None and self._router.get(network) is not None:
+            proto = self._router.get(network)
+
+        ctx = {outbound.PRIORITY: priority}
+        if method == 'send_lines':
+            context.call(
+                ctx, proto.send_lines, target, lines, notice, sep)
+        elif method == 'send_notice':
+            for line in lines:
+                context.call(ctx, proto.send_notice, target, line)
+        else:
+            for line in lines:
+                context.call(ctx, proto.send_msg, target, line)
+
+
+class BusProto(object):
+    """
+    Protocol given to plugins running in a plugin worker.  Lines are sent to
+    the front-end to be sent from its connection.
+    """
+    def __init__(self, nickname=None):
+        """
+        @param nickname - configured nickname of the bot, used outside of
+                          handlers.
+        """
+        self._nickname = nickname
+        self._front_end = None
+        self._handoff = outbound.Handoff()
+
+    def attach(self, front_end):
+        """
+        @param front_end    - connection to the front-end.
+        """
+        self._front_end = front_end
+
+    @property
+    def nickname(self):
+        """
+        Nickname of the bot on the network of the running handler, or the
+        configured nickname outside of a handler.
+        """
+        nickname = context.get(NICKNAME)
+        return nickname if nickname is not None else self._nickname
+
+    def _send(self, method, target, lines, notice=False, sep=' | '):
+        kwds = {
+            'method': method,
+            'network': context.get(NETWORK),
+            'target': text.encode(target),
+            'lines': [text.encode(line) for line in lines],
+            'notice': notice,
+            'sep': text.encode(sep),
+            'priority': context.get(outbound.PRIORITY, outbound.DEFAULT),
+        }
+
+        if self._front_end is None:
+            log.err('Not connected to the front-end, dropping %r' % (kwds,))
+        else:
+            self._handoff.call(self._front_end.callRemote, Send, **kwds)
+
+    def send_msg(self, target, msg):
+        self._send('send_msg', target, [msg])
+
+    def send_notice(self, target, msg):
+        self._send('send_notice', target, [msg])
+
+    def send_lines(self, target, lines, notice=False, sep=' | '):
+        self._send('send_lines', target, list(lines), notice, sep)
+
+
+class WorkerProtocol(amp.AMP):
+    """
+    Plugin worker side of the connection to the front-end.
+    """
+    def __init__(self, plugins, proto):
+        """
+        @param plugins  - plugins run by the worker.
+        @param proto    - BusProto the plugins were initialized with.
+        """
+        amp.AMP.__init__(self)
+        self._plugins = dict((p.name, p) for p in plugins)
+        self._proto = proto
+
+    def connectionMade(self):
+        amp.AMP.connectionMade(self)
+        self._proto.attach(self)
+
+    @Describe.responder
+    def describe(self):
+        return {'manifest': json.dumps(manifest(self._plugins.values()))}
+
+    @Dispatch.responder
+    def dispatch(self, plugin, handler, args, network, nickname, priority):
+        p = self._plugins.get(plugin)
+        f = None
+        if p is not None:
+            f = (p.commands.get(handler)
+                 or p.passives.get(handler)
+                 or p.user_joins.get(handler))
+        if f is None:
+            raise HandlerError('Unknown handler %s.%s' % (plugin, handler))
+
+        ctx = {
+            NETWORK: network,
+            NICKNAME: nickname,
+            outbound.PRIORITY: priority,
+        }
+
+        if getattr(f, 'is_deferred', False):
+            d = context.call(ctx, defer.maybeDeferred, f, *args)
+        else:
+            d = context.call(ctx, threads.deferToThread, f, *args)
+
+        def failed(reason):
+            log.err(reason, '%s.%s failed' % (plugin, handler))
+            raise HandlerError(reason.getErrorMessage())
+
+        d.addCallbacks(lambda _: {}, failed)
+        return d
+
+
+class WorkerFactory(protocol.ClientFactory):
+    """
+    Connect a plugin worker to the front-end.  The worker stops when the
+    connection goes away, it is restarted by the front-end.
+    """
+    def __init__(self, plugins, proto):
+        self._plugins = plugins
+        self._proto = proto
+
+    def buildProtocol(self, addr):
+        return WorkerProtocol(self._plugins, self._proto)
+
+    def clientConnectionLost(self, connector, reason):
+        log.msg('Lost connection to the front-end: %s' % (reason.value,))
+        reactor.stop()
+
+    def clientConnectionFailed(self, connector, reason):
+        log.err('Failed to connect to the front-end: %s' % (reason.value,))
+        reactor.stop()
@@ -0,0 +1,111 @@
+import collections
+
+from twisted.internet import reactor
+
+
+class ResponseCache(object):
+    """
+    In-memory cache with a time to live for every entry.  The total size of
+    the cache is bounded, least recently used entries are evicted first once
+    the bound is reached.
+    """
+    def __init__(self, max_bytes=4 * 1024 * 1024, clock=None):
+        """
+        @param max_bytes    - maximum combined size of every cached entry.
+        @param clock        - reactor used to get the current time.
+        """
+        self._max_bytes = max_bytes
+        self._clock = clock if clock is not None else reactor
+        self._entries = collections.OrderedDict()
+        self._size = 0
+        self._stats = {
+            'hits': 0,
+            'misses': 0,
+            'expired': 0,
+            'evictions': 0,
+        }
+
+    @property
+    def size(self):
+        """
+        Combined size of every cached entry.
+        """
+        return self._size
+
+    @property
+    def stats(self):
+        """
+        Mapping of counter names to values.  Counters are hits, misses,
+        expired and evictions, the current number of entries and their
+        combined size are included as entries and bytes.
+        """
+        ret = dict(self._stats)
+        ret['entries'] = len(self._entries)
+        ret['bytes'] = self._size
+        return ret
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key, default=None):
+        """
+        Get a cached value.
+
+        @param key      - key the value was cached under.
+        @param default  - returned if the value is not cached.
+        @return         - the cached value.
+        """
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            self._stats['misses'] += 1
+            return default
+
+        expires, size, value = entry
+        if expires <= self._clock.seconds():
+            self._size -= size
+            self._stats['expired'] += 1
+            self._stats['misses'] += 1
+            return default
+
+        self._entries[key] = entry
+        self._stats['hits'] += 1
+        return value
+
+    def set(self, key, value, ttl, size):
+        """
+        Cache a value.  Values larger than the cache are not stored.
+
+        @param key      - key to cache the value under.
+        @param value    - value to cache.
+        @param ttl      - seconds the value stays valid.
+        @param size     - size of the value in bytes.
+        """
+        self.remove(key)
+
+        if ttl <= 0 or size > self._max_bytes:
+            return
+
+        self._entries[key] = (self._clock.seconds() + ttl, size, value)
+        self._size += size
+
+        while self._size > self._max_bytes:
+            _, (_, evicted, _) = self._entries.popitem(last=False)
+            self._size -= evicted
+            self._stats['evictions'] += 1
+
+    def remove(self, key):
+        """
+        Remove a value from the cache.
+
+        @param key  - key the value was cached under.
+        """
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._size -= entry[1]
+
+    def clear(self):
+        """
+        Remove every value from the cache.
+        """
+        self._entries.clear()
+        self._size = 0
@@ -1,8 +1,179 @@
 import functools
+import json
+import re
+import weakref
 
 from twisted.python import log
 
 
+class FrozenDict(dict):
+    """
+    Dictionary that cannot be changed once created.
+    """
+    def _frozen(self, *args, **kwds):
+        raise TypeError('%s is read-only' % (type(self).__name__,))
+
+    __setitem__ = __delitem__ = _frozen
+    clear = pop = popitem = setdefault = update = _frozen
+
+
+def fingerprint(config, plugins):
+    """
+    Get a key identifying the handlers a channel with a configuration loads
+    from some plugins.  Only the parts of the configuration that affect the
+    handlers are used, so channels configuring other things still share it.
+
+    @param config   - configuration of the channel.
+    @param plugins  - list of plugins.
+    @return         - hashable key.
+    """
+    names = set(p.name for p in plugins)
+    effective = dict(
+        (k, v) for k, v in config.items()
+        if k in names or k in ('load_commands', 'load_passives',
+                               'load_user_joins'))
+    return (
+        json.dumps(effective, sort_keys=True, default=repr),
+        tuple(id(p) for p in plugins))
+
+
+# Dispatch tables by fingerprint.  Tables are dropped once no channel uses
+# them.
+_tables = weakref.WeakValueDictionary()
+
+
+def dispatch_table(name, config, plugins):
+    """
+    Get the dispatch table for a channel configuration.  Channels with the
+    same configuration share a single table.
+
+    @param name     - name of the channel, used for logging.
+    @param config   - configuration of the channel.
+    @param plugins  - list of plugins.
+    @return         - DispatchTable.
+    """
+    key = fingerprint(config, plugins)
+    table = _tables.get(key)
+    if table is None:
+        table = DispatchTable(name, config, plugins)
+        _tables[key] = table
+    return table
+
+
+class DispatchTable(object):
+    """
+    Handlers a channel loads from some plugins.  Tables are not changed once
+    built, channels replace their table as a whole so readers never see a
+    partly updated one.
+    """
+    def __init__(self, name, config, plugins):
+        """
+        @param name     - name of the channel the table is built for, used
+                          for logging.
+        @param config   - configuration of the channel, see Channel.
+        @param plugins  - list of plugins.
+        """
+        self._name = name
+        self._config = config
+
+        commands = {}
+        passives = {}
+        user_joins = {}
+        triggers = {}
+
+        for plugin in plugins:
+            self._register(plugin, commands, passives, user_joins, triggers)
+
+        self.commands = FrozenDict(commands)
+        self.passives = FrozenDict(passives)
+        self.user_joins = FrozenDict(user_joins)
+        self._compile_triggers(passives, triggers)
+
+    def _register(self, plugin, commands, passives, user_joins, triggers):
+        """
+        Add the handlers of a plugin to the table.  The channel configuration
+        is used to decide which methods should be used from the plugin.
+        """
+        info = functools.partial(log.msg, system=self._name)
+        err = functools.partial(log.err, system=self._name)
+
+        pc = self._config.get(plugin.name, {})
+        if not pc.get('load', True):
+            info('Skipping plugin %s' % (plugin.name,))
+            return
+
+        cmds = pc.get('commands', plugin.commands.keys())
+        passive_names = pc.get('passives', plugin.passives.keys())
+        user_join_names = pc.get('user_joins', plugin.user_joins.keys())
+
+        if self._config.get('load_commands', True):
+            for f in cmds:
+                if f in commands:
+                    err('Duplicate command %s' % (f,))
+                commands[f] = plugin.commands[f]
+
+            if len(cmds):
+                info('%s commands:  %s' % (plugin.name, cmds))
+
+        if self._config.get('load_passives', True):
+            for f in passive_names:
+                if f in passives:
+                    err('Duplicate passive command %s' % (f,))
+                passives[f] = plugin.passives[f]
+                triggers[f] = plugin.triggers.get(f)
+
+            if len(passive_names):
+                info('%s passives:  %s' % (plugin.name, passive_names))
+
+        if self._config.get('load_user_joins', True):
+            for f in user_join_names:
+                if f in user_joins:
+                    err('Duplicate user_join command %s' % (f,))
+                user_joins[f] = plugin.user_joins[f]
+
+            if len(user_join_names):
+                info('%s user joins:  %s' % (plugin.name, user_join_names))
+
+    def _compile_triggers(self, passives, triggers):
+        """
+        Combine the triggers of every passive into one regular expression.
+        Each trigger is placed in a named group inside an optional lookahead,
+        so a single match against a message reports every passive with a
+        trigger anywhere in it.
+        """
+        lookaheads = []
+        dispatch = []
+
+        for i, name in enumerate(sorted(passives.keys())):
+            pattern = triggers.get(name)
+            group = None
+            if pattern is not None:
+                group = 't%d' % (i,)
+                lookaheads.append('(?=(?:.*?(?P<%s>%s))?)' % (group, pattern))
+            dispatch.append((name, group, passives[name]))
+
+        self._dispatch = tuple(dispatch)
+        self._matcher = None
+        if len(lookaheads):
+            self._matcher = re.compile(''.join(lookaheads), re.DOTALL)
+
+    def match_passives(self, msg):
+        """
+        Find the passives that should be run for a message.  Passives without
+        triggers always match.
+
+        @param msg  - message sent to the channel.
+        @return     - list of (name, method) tuples sorted by name.
+        """
+        if self._matcher is None:
+            return [(name, f) for name, _, f in self._dispatch]
+
+        m = self._matcher.match(msg)
+        return [
+            (name, f) for name, group, f in self._dispatch
+            if group is None or m.group(group) is not None]
+
+
 class Channel(object):
     def __init__(self, name, config):
         """
@@ -17,9 +188,8 @@ class Channel(object):
         """
         self._name = name
         self._config = config
-        self._commands = {}
-        self._passives = {}
-        self._user_joins = {}
+        self._plugins = []
+        self._table = dispatch_table(name, config, [])
 
     @property
     def name(self):
@@ -28,69 +198,82 @@ class Channel(object):
         """
         return self._name
 
+    @property
+    def plugins(self):
+        """
+        List of plugins registered with this channel.
+        """
+        return list(self._plugins)
+
+    @property
+    def table(self):
+        """
+        DispatchTable of the channel, shared with channels configured alike.
+        """
+        return self._table
+
     @property
     def commands(self):
         """
         Mapping of command name to command method.
         """
-        return self._commands
+        return self._table.commands
 
     @property
     def passives(self):
         """
         Mapping of passive name to passive method.
         """
-        return self._passives
+        return self._table.passives
 
     @property
     def user_joins(self):
         """
         Mapping of user join callback name to method.
         """
-        return self._user_joins
+        return self._table.user_joins
 
-    def register_plugin(self, plugin):
+    def set_plugins(self, plugins):
         """
-        Register a plugin with this channel.  The channel configuration will
-        be used to decide which methods should be used from the plugin.
+        Set the plugins of this channel.  The handlers of the channel are
+        swapped in one go, messages are dispatched either to the previous
+        plugins or the new ones.
 
-        @param plugin   - plugin to load.
+        @param plugins  - list of plugins.
         """
-        info = functools.partial(log.msg, system=self.name)
-        err = functools.partial(log.err, system=self.name)
+        plugins = list(plugins)
+        self._plugins, self._table = (
+            plugins,
+            dispatch_table(self._name, self._config, plugins))
 
-        pc = self._config.get(plugin.name, {})
-        if not pc.get('load', True):
-            info('Skipping plugin %s' % (plugin.name,))
-            return
-
-        cmds = pc.get('commands', plugin.commands.keys())
-        passives = pc.get('passives', plugin.passives.keys())
-        user_joins = pc.get('user_joins', plugin.user_joins.keys())
-
-        if self._config.get('load_commands', True):
-            for f in cmds:
-                if f in self._commands:
-                    err('Duplicate command %s' % (f,))
-                self._commands[f] = plugin.commands[f]
-
-            if len(cmds):
-                info('%s commands:  %s' % (plugin.name, cmds))
+    def register_plugin(self, plugin):
+        """
+        Register a plugin with this channel.  Prefer set_plugins() to
+        register several plugins.
 
-        if self._config.get('load_passives', True):
-            for f in passives:
-                if f in self._passives:
-                    err('Duplicate passive command %s' % (f,))
-                self._passives[f] = plugin.passives[f]
+        @param plugin   - plugin to load.
+        """
+        self.set_plugins(self._plugins + [plugin])
 
-            if len(passives):
-                info('%s passives:  %s' % (plugin.name, passives))
+    def replace_plugins(self, old, new):
+        """
+        Replace plugins registered with this channel, for instance with newer
+        versions of them.
 
-        if self._config.get('load_user_joins', True):
-            for f in user_joins:
-                if f in self._user_joins:
-                    err('Duplicate user_join command %s' % (f,))
-                self._user_joins[f] = plugin.user_joins[f]
+        @param old  - list of registered plugins to remove.
+        @param new  - list of plugins to register instead.
+        """
+        self.set_plugins(
+            [p for p in self._plugins if p not in old] + list(new))
+        log.msg(
+            'Replaced plugins %s with %s' % (
+                [p.name for p in old],
+                [p.name for p in new]),
+            system=self.name)
 
-            if len(user_joins):
-                info('%s user joins:  %s' % (plugin.name, user_joins))
+    def match_passives(self, msg):
+        """
+        Find the passives that should be run for a message, see
+        DispatchTable.match_passives().
+        """
+        return self._table.match_passives(msg)
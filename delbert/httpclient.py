@@ -0,0 +1,662 @@
+import cgi
+import copy
+import json
+import time
+import urllib
+import urlparse
+
+from cStringIO import StringIO
+
+from twisted.internet import (
+    defer,
+    protocol,
+    reactor,
+    threads,
+)
+from twisted.python import context, failure
+from twisted.web import client
+from twisted.web.http import PotentialDataLoss
+from twisted.web.http_headers import Headers
+from twisted.web.iweb import IPolicyForHTTPS, UNKNOWN_LENGTH
+from zope.interface import implementer
+
+import trace
+
+from cache import ResponseCache
+
+
+class RequestError(IOError):
+    """
+    Base class for errors raised by the HTTPClient.
+    """
+    pass
+
+
+class HTTPError(RequestError):
+    """
+    The server replied with an error status.
+    """
+    def __init__(self, msg, response=None):
+        super(HTTPError, self).__init__(msg)
+        self.response = response
+
+
+class Timeout(RequestError):
+    """
+    The request took longer than the allowed timeout.
+    """
+    pass
+
+
+class ResponseTooLarge(RequestError):
+    """
+    The response body was larger than the allowed size.
+    """
+    pass
+
+
+class Response(object):
+    """
+    Result of an HTTP request.  Mirrors the parts of requests.Response that
+    plugins rely upon.
+    """
+    def __init__(self, url, status_code, headers, content):
+        """
+        @param url          - url the response was returned from.
+        @param status_code  - HTTP status code.
+        @param headers      - mapping of lower case header names to values.
+        @param content      - response body.
+        """
+        self._url = url
+        self._status_code = status_code
+        self._headers = headers
+        self._content = content
+
+    @property
+    def url(self):
+        """
+        Url the response was returned from.
+        """
+        return self._url
+
+    @property
+    def status_code(self):
+        """
+        HTTP status code.
+        """
+        return self._status_code
+
+    @property
+    def headers(self):
+        """
+        Mapping of lower case header names to values.
+        """
+        return self._headers
+
+    @property
+    def content(self):
+        """
+        Response body as a byte string.
+        """
+        return self._content
+
+    @property
+    def text(self):
+        """
+        Response body decoded using the charset from the content type,
+        defaulting to utf-8.
+        """
+        _, params = cgi.parse_header(self._headers.get('content-type', ''))
+        try:
+            return self._content.decode(params.get('charset', 'utf-8'),
+                                        'replace')
+        except LookupError:
+            return self._content.decode('utf-8', 'replace')
+
+    @property
+    def ok(self):
+        """
+        True unless the status code signals an error.
+        """
+        return self._status_code < 400
+
+    def json(self):
+        """
+        Parse the response body as json.
+        """
+        return json.loads(self.text)
+
+    def raise_for_status(self):
+        """
+        Raise an HTTPError if the status code signals an error.
+        """
+        if not self.ok:
+            raise HTTPError(
+                '%d error for url %s' % (self._status_code, self._url),
+                response=self)
+
+
+@implementer(IPolicyForHTTPS)
+class _NoVerifyPolicy(object):
+    """
+    TLS policy accepting any certificate, for requests made with
+    verify=False.
+    """
+    def creatorForNetloc(self, hostname, port):
+        # Only needed for https urls, which need the tls extras anyway.
+        from twisted.internet import ssl
+        return ssl.CertificateOptions(verify=False)
+
+
+class _BodyCollector(protocol.Protocol):
+    """
+    Collect a response body, giving up once it grows past a maximum size.
+    """
+    def __init__(self, max_size):
+        """
+        @param max_size - maximum body size in bytes.
+        """
+        self._finished = defer.Deferred(self._cancel)
+        self._max_size = max_size
+        self._size = 0
+        self._data = []
+
+    @property
+    def finished(self):
+        """
+        Deferred firing with the body.
+        """
+        return self._finished
+
+    def _cancel(self, _):
+        if self.transport is not None:
+            self.transport.stopProducing()
+
+    def dataReceived(self, data):
+        if self._finished.called:
+            return
+
+        self._size += len(data)
+        if self._size > self._max_size:
+            self.transport.stopProducing()
+            self._finished.errback(ResponseTooLarge(
+                'Response exceeds %d bytes' % (self._max_size,)))
+            return
+
+        self._data.append(data)
+
+    def connectionLost(self, reason):
+        if self._finished.called:
+            return
+
+        if reason.check(client.ResponseDone, PotentialDataLoss):
+            self._finished.callback(''.join(self._data))
+        else:
+            self._finished.errback(reason)
+
+
+class HTTPClient(object):
+    """
+    Non-blocking HTTP client shared by every plugin.
+
+    Requests are made with a twisted Agent using a persistent connection pool
+    so connections to a host are kept alive between requests.  Every request
+    has a timeout and a cap on the response size, and the number of
+    concurrent requests to a single host is limited.  All methods return a
+    Deferred firing with a Response, or failing with a RequestError.
+
+    GET responses can be cached by passing a cache_ttl to request().  The
+    cache is shared by every caller of the client.
+
+    Concurrent GET requests for the same url, with the same headers and
+    limits, are coalesced: only the first one is sent, the others wait for
+    and receive its response.
+
+    HTTPS urls need the twisted tls extras to be installed.  Certificates
+    are verified unless a request is made with verify=False, such requests
+    use their own connections.
+    """
+    def __init__(self, config=None, clock=None, agent=None, cache=None,
+                 metrics=None, tracer=None):
+        """
+        @param config   - configuration.
+                            timeout: seconds before a request is abandoned.
+                            connect_timeout: seconds to wait for a connection.
+                            max_size: maximum response size in bytes.
+                            max_per_host: maximum concurrent requests and
+                                          cached connections per host.
+                            keepalive: seconds to keep idle connections open.
+                            redirects: maximum number of redirects to follow.
+                            user_agent: User-Agent header to send.
+                            cache: response cache configuration.
+                                max_bytes: maximum size of the cache.
+                                ttls: mapping of url prefixes to the time to
+                                      live of their cached responses,
+                                      overriding the one asked for by
+                                      plugins.
+        @param clock    - reactor used for scheduling timeouts.
+        @param agent    - agent used to make requests, by default an Agent
+                          backed by a persistent connection pool.
+        @param cache    - response cache, by default one is created from the
+                          configuration.
+        @param metrics  - metrics.Registry recording the latency of requests
+                          per host.
+        @param tracer   - trace.Tracer recording the requests made while
+                          handling traced messages.
+        """
+        config = config if config is not None else {}
+        cache_config = config.get('cache', {})
+        self._clock = clock if clock is not None else reactor
+        self._timeout = config.get('timeout', 10)
+        self._max_size = config.get('max_size', 1024 * 1024)
+        self._max_per_host = config.get('max_per_host', 4)
+        self._user_agent = config.get('user_agent', 'delbert')
+        self._semaphores = {}
+        self._inflight = {}
+        self._stats = {
+            'requests': 0,
+            'coalesced': 0,
+        }
+        self._pool = None
+        self._insecure_pool = None
+        self._insecure_agent = None
+        self._tracer = tracer
+
+        self._latency = None
+        self._responses = None
+        if metrics is not None:
+            self._latency = metrics.histogram(
+                'delbert_http_request_seconds',
+                'Time taken by upstream http requests.',
+                ('host',))
+            self._responses = metrics.counter(
+                'delbert_http_responses_total',
+                'Upstream http requests by outcome.',
+                ('host', 'outcome'))
+
+        if cache is None:
+            cache = ResponseCache(
+                cache_config.get('max_bytes', 4 * 1024 * 1024),
+                self._clock)
+        self._cache = cache
+
+        # Longest prefixes first so the most specific one wins.
+        self._ttls = sorted(
+            cache_config.get('ttls', {}).items(),
+            key=lambda item: -len(item[0]))
+
+        self._config = config
+        if agent is None:
+            self._pool = self._make_pool()
+            agent = self._make_agent(self._pool)
+        else:
+            self._insecure_agent = agent
+
+        self._agent = agent
+
+    def _make_pool(self):
+        pool = client.HTTPConnectionPool(self._clock)
+        pool.maxPersistentPerHost = self._max_per_host
+        pool.cachedConnectionTimeout = self._config.get('keepalive', 240)
+        return pool
+
+    def _make_agent(self, pool, policy=None):
+        kwds = {}
+        if policy is not None:
+            kwds['contextFactory'] = policy
+
+        agent = client.Agent(
+            self._clock,
+            connectTimeout=self._config.get('connect_timeout', 5),
+            pool=pool,
+            **kwds)
+        agent = client.RedirectAgent(agent, self._config.get('redirects', 5))
+        return client.ContentDecoderAgent(
+            agent,
+            [('gzip', client.GzipDecoder)])
+
+    @property
+    def cache(self):
+        """
+        Response cache shared by every request.
+        """
+        return self._cache
+
+    @property
+    def stats(self):
+        """
+        Mapping of counter names to values.  Counters are requests, the
+        number of requests sent, and coalesced, the number of requests which
+        waited on an identical one already in flight.
+        """
+        return dict(self._stats)
+
+    @staticmethod
+    def build_url(url, params=None):
+        """
+        Append query parameters to a url.
+
+        @param url      - base url.
+        @param params   - mapping or list of tuples of query parameters.
+        @return         - url including the parameters.
+        """
+        if not params:
+            return url
+
+        if isinstance(params, dict):
+            params = sorted(params.items())
+
+        query = urllib.urlencode([
+            (k, v.encode('utf-8') if isinstance(v, unicode) else v)
+            for k, v in params])
+
+        return '%s%s%s' % (url, '&' if '?' in url else '?', query)
+
+    def request(self, method, url, params=None, data=None, headers=None,
+                timeout=None, max_size=None, cache_ttl=None,
+                negative_ttl=None, negative=None, verify=True):
+        """
+        Make an HTTP request.
+
+        @param method       - HTTP method.
+        @param url          - url to request.
+        @param params       - query parameters to append to the url.
+        @param data         - request body, mappings are form encoded.
+        @param headers      - mapping of extra headers to send.
+        @param timeout      - override the default timeout.
+        @param max_size     - override the default maximum response size.
+        @param cache_ttl    - seconds to cache a successful GET response
+                              for.  Responses are not cached by default.
+        @param negative_ttl - seconds to cache negative responses for,
+                              defaults to cache_ttl.  A 404 is always
+                              negative.
+        @param negative     - function called with a successful response,
+                              returning True if it should be treated as
+                              negative, i.e. "no results".  Exceptions it
+                              raises fail the request with a RequestError.
+        @param verify       - False to accept any certificate from an https
+                              url.
+
+        @return - Deferred firing with a Response.
+        """
+        url = self.build_url(url, params)
+        if isinstance(url, unicode):
+            url = url.encode('utf-8')
+
+        traced = trace.current()
+        if traced is not None and self._tracer is not None:
+            d = self._request_cached(
+                method, url, data, headers, timeout, max_size, cache_ttl,
+                negative_ttl, negative, verify)
+            d.addBoth(self._trace, traced, method, url, time.time())
+            return d
+
+        return self._request_cached(
+            method, url, data, headers, timeout, max_size, cache_ttl,
+            negative_ttl, negative, verify)
+
+    def _request_cached(self, method, url, data, headers, timeout,
+                        max_size, cache_ttl, negative_ttl, negative, verify):
+        caching = cache_ttl is not None and method == 'GET'
+        if caching:
+            resp = self._cache.get(url)
+            if resp is not None:
+                return defer.succeed(resp)
+
+        args = (
+            method,
+            url,
+            data,
+            headers if headers is not None else {},
+            timeout if timeout is not None else self._timeout,
+            max_size if max_size is not None else self._max_size,
+            verify)
+
+        if method == 'GET':
+            d = self._coalesce(*args)
+        else:
+            d = self._limit(*args)
+
+        if caching:
+            d.addCallback(
+                self._store,
+                self._ttl_for(url, cache_ttl),
+                negative_ttl,
+                negative)
+
+        return d
+
+    def get(self, url, **kwds):
+        """
+        Make a GET request, see request() for the arguments.
+        """
+        return self.request('GET', url, **kwds)
+
+    def blocking_get(self, url, **kwds):
+        """
+        Make a GET request from a thread other than the reactor thread and
+        wait for the response.  Lets plugins running in threads share the
+        connections, cache and in flight requests of the client.
+
+        See request() for the arguments.
+
+        @return - the Response.
+        """
+        return self._blocking('GET', url, **kwds)
+
+    def post(self, url, **kwds):
+        """
+        Make a POST request, see request() for the arguments.
+        """
+        return self.request('POST', url, **kwds)
+
+    def blocking_post(self, url, **kwds):
+        """
+        Make a POST request from a thread other than the reactor thread and
+        wait for the response, see blocking_get().
+
+        @return - the Response.
+        """
+        return self._blocking('POST', url, **kwds)
+
+    def _blocking(self, method, url, **kwds):
+        # The context of the calling thread is not carried over to the
+        # reactor thread, keep the trace of the running handler.
+        return threads.blockingCallFromThread(
+            self._clock,
+            context.call,
+            {trace.TRACE: trace.current()},
+            self.request,
+            method,
+            url,
+            **kwds)
+
+    def close(self):
+        """
+        Close every cached connection.
+
+        @return - Deferred firing once the connections are closed.
+        """
+        pools = [p for p in (self._pool, self._insecure_pool) if p is not None]
+        return defer.gatherResults(
+            [p.closeCachedConnections() for p in pools])
+
+    def _coalesce(self, method, url, data, headers, timeout, max_size,
+                  verify):
+        # Requests differing in anything but the url could get a different
+        # response, or fail differently.
+        key = (
+            url,
+            tuple(sorted(headers.items())),
+            timeout,
+            max_size,
+            verify)
+        if key in self._inflight:
+            self._stats['coalesced'] += 1
+            d = defer.Deferred()
+            self._inflight[key].append(d)
+            return d
+
+        waiters = self._inflight[key] = []
+
+        def land(result):
+            del self._inflight[key]
+            for d in waiters:
+                # Each waiter may trap or handle a failure, so gets its own.
+                if isinstance(result, failure.Failure):
+                    d.errback(copy.copy(result))
+                else:
+                    d.callback(result)
+            return result
+
+        d = self._limit(
+            method, url, data, headers, timeout, max_size, verify)
+        d.addBoth(land)
+        return d
+
+    def _limit(self, method, url, *args):
+        host = urlparse.urlsplit(url).netloc
+        if host not in self._semaphores:
+            self._semaphores[host] = defer.DeferredSemaphore(
+                self._max_per_host)
+
+        return self._semaphores[host].run(self._request, method, url, *args)
+
+    def _ttl_for(self, url, ttl):
+        for prefix, prefix_ttl in self._ttls:
+            if url.startswith(prefix):
+                return prefix_ttl
+        return ttl
+
+    def _store(self, resp, ttl, negative_ttl, negative):
+        try:
+            is_negative = resp.ok and negative is not None and negative(resp)
+        except Exception as e:
+            raise RequestError('Failed to check the response from %s: %s' % (
+                resp.url, e))
+
+        if resp.status_code == 404 or is_negative:
+            if negative_ttl is not None:
+                ttl = negative_ttl
+        elif not resp.ok:
+            return resp
+
+        size = len(resp.url) + len(resp.content) + sum(
+            len(k) + len(v) for k, v in resp.headers.items())
+        self._cache.set(resp.url, resp, ttl, size)
+        return resp
+
+    def _request(self, method, url, data, headers, timeout, max_size,
+                 verify):
+        self._stats['requests'] += 1
+        headers = dict(headers)
+        headers.setdefault('User-Agent', self._user_agent)
+
+        body = None
+        if data is not None:
+            if isinstance(data, dict):
+                data = urllib.urlencode(data)
+                headers.setdefault(
+                    'Content-Type',
+                    'application/x-www-form-urlencoded')
+            body = client.FileBodyProducer(StringIO(data))
+
+        if verify:
+            agent = self._agent
+        else:
+            if self._insecure_agent is None:
+                # Connections made without verifying certificates are never
+                # reused for requests that verify them.
+                self._insecure_pool = self._make_pool()
+                self._insecure_agent = self._make_agent(
+                    self._insecure_pool, _NoVerifyPolicy())
+            agent = self._insecure_agent
+
+        d = agent.request(
+            method,
+            url,
+            Headers(dict((k, [v]) for k, v in headers.items())),
+            body)
+        d.addCallback(self._read, url, max_size)
+
+        timed_out = []
+        start = self._clock.seconds()
+
+        def on_timeout():
+            timed_out.append(True)
+            d.cancel()
+
+        delayed = self._clock.callLater(timeout, on_timeout)
+
+        def finished(result):
+            if delayed.active():
+                delayed.cancel()
+
+            if self._latency is not None:
+                self._observe(url, start, result, timed_out)
+
+            if timed_out:
+                raise Timeout('Timed out after %ds fetching %s' % (
+                    timeout, url))
+            elif (isinstance(result, failure.Failure)
+                    and not result.check(RequestError)):
+                raise RequestError('Failed to fetch %s: %s' % (
+                    url, result.getErrorMessage()))
+
+            return result
+
+        d.addBoth(finished)
+        return d
+
+    def _trace(self, result, traced, method, url, start):
+        if isinstance(result, failure.Failure):
+            outcome = result.getErrorMessage()
+        else:
+            outcome = result.status_code
+        self._tracer.span(
+            traced,
+            'http %s %s' % (method, urlparse.urlsplit(url).netloc),
+            start,
+            url=url,
+            outcome=outcome)
+        return result
+
+    def _observe(self, url, start, result, timed_out):
+        host = urlparse.urlsplit(url).netloc
+        self._latency.observe(self._clock.seconds() - start, host)
+
+        if timed_out:
+            outcome = 'timeout'
+        elif isinstance(result, failure.Failure):
+            outcome = 'error'
+        else:
+            outcome = str(result.status_code)
+        self._responses.inc(host, outcome)
+
+    @staticmethod
+    def _read(response, url, max_size):
+        length = response.length
+        if length is not UNKNOWN_LENGTH and length > max_size:
+            response.deliverBody(_Discard())
+            raise ResponseTooLarge('Response from %s is %d bytes' % (
+                url, length))
+
+        collector = _BodyCollector(max_size)
+        response.deliverBody(collector)
+
+        headers = dict(
+            (k.lower(), v[-1])
+            for k, v in response.headers.getAllRawHeaders())
+
+        d = collector.finished
+        d.addCallback(
+            lambda content: Response(url, response.code, headers, content))
+        return d
+
+
+class _Discard(protocol.Protocol):
+    """
+    Throw away a response body.
+    """
+    def connectionMade(self):
+        self.transport.stopProducing()
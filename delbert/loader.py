@@ -0,0 +1,460 @@
+import ast
+import imp
+import inspect
+import json
+import os
+import sys
+import threading
+
+from twisted.python import log
+
+import plugin
+
+# Decorators declaring handlers, mapped to the kind of handler.
+_DECORATORS = {
+    'irc_command': 'commands',
+    'irc_passive': 'passives',
+    'irc_user_join': 'user_joins',
+}
+
+# Loaded plugin modules by path, and the lock protecting them.
+_modules = {}
+_modules_lock = threading.Lock()
+
+# Modules replaced by a reload.  Python 2 clears the globals of a module once
+# it is freed, so they are kept for the plugins still using them.
+_replaced = []
+
+
+class NotLazyError(Exception):
+    """
+    Raised when a plugin cannot be described without running it.
+    """
+    pass
+
+
+def _name(node):
+    """
+    Get the dotted name of a name or attribute node.
+    """
+    if isinstance(node, ast.Name):
+        return node.id
+    if isinstance(node, ast.Attribute):
+        return '%s.%s' % (_name(node.value), node.attr)
+    return ''
+
+
+def _literal(node):
+    try:
+        return ast.literal_eval(node)
+    except ValueError:
+        raise NotLazyError('%s is not a literal' % (ast.dump(node),))
+
+
+def _is_generator(func):
+    """
+    Check if a function node is a generator, ignoring nested functions.
+    """
+    nodes = list(func.body)
+    while len(nodes):
+        node = nodes.pop()
+        if isinstance(node, ast.Yield):
+            return True
+        if isinstance(node, (ast.FunctionDef, ast.Lambda, ast.ClassDef)):
+            continue
+        nodes.extend(ast.iter_child_nodes(node))
+    return False
+
+
+def _describe_handler(func, decorator, others):
+    """
+    Describe a handler from its decorator.  See plugin.irc_command(),
+    plugin.irc_passive() and plugin.irc_user_join().
+    """
+    args = [_literal(a) for a in decorator.args]
+    kwds = dict((k.arg, _literal(k.value)) for k in decorator.keywords)
+    if decorator.starargs is not None or decorator.kwargs is not None:
+        raise NotLazyError('%s uses variable arguments' % (func.name,))
+
+    kind = _DECORATORS[_name(decorator.func).split('.')[-1]]
+    names = ['text'] + (
+        ['substrings', 'keywords', 'regex'] if kind == 'passives' else [])
+    kwds.update(zip(names + ['deferred'], args))
+
+    deferred = (
+        kwds.get('deferred', False)
+        or _is_generator(func)
+        or any(_name(d).endswith('inlineCallbacks') for d in others))
+
+    info = {'help': kwds['text'], 'deferred': bool(deferred)}
+    if kind == 'passives':
+        info['triggers'] = plugin.compile_triggers(
+            kwds.get('substrings'),
+            kwds.get('keywords'),
+            kwds.get('regex'))
+
+    return kind, info
+
+
+def _describe_class(cls):
+    """
+    Describe a plugin class.  Plugins are not lazy if they say so with a
+    lazy class attribute, or if they change their triggers at runtime.
+    Plugins that only need to run from startup with some configuration, say
+    to listen on a port, list the configuration keys in eager_config.
+    """
+    description = {
+        'class': cls.name,
+        'name': None,
+        'eager_config': [],
+        'commands': {},
+        'passives': {},
+        'user_joins': {},
+    }
+
+    for node in cls.body:
+        if isinstance(node, ast.Assign):
+            names = [_name(t) for t in node.targets]
+            if 'lazy' in names and not _literal(node.value):
+                raise NotLazyError('%s is not lazy' % (cls.name,))
+            if 'eager_config' in names:
+                description['eager_config'] = list(_literal(node.value))
+
+        if not isinstance(node, ast.FunctionDef):
+            continue
+
+        for child in ast.walk(node):
+            if (isinstance(child, ast.Call)
+                    and _name(child.func) == 'self.set_triggers'):
+                raise NotLazyError('%s sets triggers' % (cls.name,))
+
+        if node.name == '__init__':
+            for child in ast.walk(node):
+                if (isinstance(child, ast.Call)
+                        and isinstance(child.func, ast.Attribute)
+                        and child.func.attr == '__init__'
+                        and len(child.args)
+                        and isinstance(child.args[0], ast.Str)):
+                    description['name'] = child.args[0].s
+
+        decorators = [
+            d for d in node.decorator_list
+            if isinstance(d, ast.Call)
+            and _name(d.func).split('.')[-1] in _DECORATORS]
+        if not len(decorators):
+            continue
+
+        others = [d for d in node.decorator_list if d not in decorators]
+        kind, info = _describe_handler(node, decorators[0], others)
+        description[kind][node.name] = info
+
+    if description['name'] is None:
+        raise NotLazyError('Cannot find the name of %s' % (cls.name,))
+
+    return description
+
+
+def describe(path):
+    """
+    Describe the plugins in a file without running it.
+
+    @param path - path of the plugin file.
+    @return     - list of plugin descriptions, each a mapping of the class,
+                  the plugin name, the configuration keys making it eager,
+                  and its commands, passives and user joins
+                  to their help text, whether they return a Deferred and for
+                  passives their triggers.  None if the plugins cannot be
+                  loaded lazily.
+    """
+    with open(path) as f:
+        tree = ast.parse(f.read(), path)
+
+    plugins = []
+    try:
+        for node in tree.body:
+            if not isinstance(node, ast.ClassDef):
+                continue
+            if any(_name(b).split('.')[-1] == 'Plugin' for b in node.bases):
+                plugins.append(_describe_class(node))
+    except NotLazyError, e:
+        log.msg('Loading %s at startup: %s' % (path, e))
+        return None
+
+    return plugins
+
+
+class Manifest(object):
+    """
+    Descriptions of every plugin in a directory, cached in a file.  Plugin
+    files are only described again when their modification time or size
+    changes.
+    """
+    def __init__(self, path, cache=None):
+        """
+        @param path     - directory containing the plugins.
+        @param cache    - file the descriptions are cached in, None to not
+                          cache them.
+        """
+        self._path = path
+        self._cache = cache
+        self._entries = {}
+        self.described = 0
+
+        if self._cache is not None and os.path.exists(self._cache):
+            try:
+                with open(self._cache) as f:
+                    self._entries = json.load(f)
+            except (IOError, ValueError), e:
+                log.err('Ignoring plugin manifest %s: %s' % (self._cache, e))
+
+    def files(self):
+        """
+        Get the plugin files in the directory.
+
+        @return - sorted list of plugin file names.
+        """
+        return sorted(
+            f for f in os.listdir(self._path)
+            if f.endswith('.py') and not f.startswith('__'))
+
+    def get(self, pfile):
+        """
+        Get the descriptions of the plugins in a file.
+
+        @param pfile    - name of the plugin file.
+        @return         - see describe().
+        """
+        st = os.stat(os.path.join(self._path, pfile))
+        entry = self._entries.get(pfile)
+        if (entry is not None
+                and entry['mtime'] == st.st_mtime
+                and entry['size'] == st.st_size):
+            return entry['plugins']
+
+        self.described += 1
+        self._entries[pfile] = {
+            'mtime': st.st_mtime,
+            'size': st.st_size,
+            'plugins': describe(os.path.join(self._path, pfile)),
+        }
+        return self._entries[pfile]['plugins']
+
+    def save(self):
+        """
+        Write the descriptions to the cache file.
+        """
+        if self._cache is None:
+            return
+
+        files = set(self.files())
+        entries = dict(
+            (k, v) for k, v in self._entries.items() if k in files)
+
+        tmp = '%s.tmp' % (self._cache,)
+        try:
+            with open(tmp, 'w') as f:
+                json.dump(entries, f)
+            os.rename(tmp, self._cache)
+        except (IOError, OSError), e:
+            log.err('Failed to save plugin manifest %s: %s' % (self._cache, e))
+
+
+def load_module(path, reload=False):
+    """
+    Import a plugin file as a module.  Modules are imported once and their
+    bytecode is cached next to the file.
+
+    @param path     - path of the plugin file.
+    @param reload   - import the file again into a new module.  Plugins
+                      created from the previous module keep using it.
+    @return         - the module.
+    """
+    path = os.path.abspath(path)
+    with _modules_lock:
+        if reload or path not in _modules:
+            name = 'delbert_plugin_%s' % (
+                os.path.splitext(os.path.basename(path))[0],)
+            previous = sys.modules.pop(name, None)
+            try:
+                module = imp.load_source(name, path)
+            except Exception:
+                if previous is not None:
+                    sys.modules[name] = previous
+                raise
+
+            if previous is not None:
+                _replaced.append(previous)
+            _modules[path] = module
+        return _modules[path]
+
+
+class LazyHandler(object):
+    """
+    Stand-in for a handler of a plugin that has not been loaded yet.  The
+    plugin is loaded when the handler is first called.
+    """
+    def __init__(self, lazy_plugin, kind, name, info):
+        self._plugin = lazy_plugin
+        self._kind = kind
+        self.__name__ = str(name)
+        self.help = info['help']
+        self.is_deferred = info['deferred']
+
+    @property
+    def plugin(self):
+        """
+        LazyPlugin the handler belongs to.
+        """
+        return self._plugin
+
+    def __call__(self, *args, **kwds):
+        p = self._plugin.activate()
+        return getattr(p, self._kind)[self.__name__](*args, **kwds)
+
+
+class LazyPlugin(plugin.Plugin):
+    """
+    Stand-in for a plugin registered with channels from its description.  The
+    plugin module is imported and the plugin created on first use.
+    """
+    def __init__(self, path, description, config):
+        """
+        @param path         - path of the plugin file.
+        @param description  - description of the plugin, see describe().
+        @param config       - configuration passed to the plugin.
+        """
+        super(LazyPlugin, self).__init__(str(description['name']))
+        self._path = path
+        self._class = str(description['class'])
+        self._plugin_config = config
+        self._plugin = None
+        self._initialized = None
+        self._lock = threading.Lock()
+
+        for kind in ('commands', 'passives', 'user_joins'):
+            handlers = getattr(self, '_%s' % (kind,))
+            for name, info in description[kind].items():
+                handlers[str(name)] = LazyHandler(self, kind, name, info)
+                if kind == 'passives':
+                    self._triggers[str(name)] = info['triggers']
+
+    @property
+    def active(self):
+        """
+        True once the plugin has been loaded.
+        """
+        return self._plugin is not None
+
+    def initialize(self, nickname, proto, http=None):
+        super(LazyPlugin, self).initialize(nickname, proto, http)
+        with self._lock:
+            self._initialized = (nickname, proto, http)
+            if self._plugin is not None:
+                self._plugin.initialize(nickname, proto, http)
+
+    def drain(self):
+        # Jobs are queued for the stand-in, the plugin may have been loaded
+        # by then.
+        d = super(LazyPlugin, self).drain()
+        d.addCallback(
+            lambda _: self._plugin.drain() if self._plugin is not None
+            else None)
+        return d
+
+    def shutdown(self):
+        if self._plugin is not None:
+            self._plugin.shutdown()
+
+    def activate(self):
+        """
+        Load the plugin if it has not been loaded yet.
+
+        @return - the plugin.
+        """
+        with self._lock:
+            if self._plugin is None:
+                module = load_module(self._path)
+                p = getattr(module, self._class)(self._plugin_config)
+                if self._initialized is not None:
+                    p.initialize(*self._initialized)
+                log.msg('Activated %s.%s' % (self.name, self._class))
+                self._plugin = p
+            return self._plugin
+
+
+def is_plugin(obj):
+    return (type(obj) == type
+            and obj not in (plugin.Plugin, LazyPlugin)
+            and plugin.Plugin in inspect.getmro(obj))
+
+
+def load_file(config, path, manifest=None, reload=False):
+    """
+    Load the plugins in a file.
+
+    @param config   - configuration, the section named after the file is
+                      passed to the plugins in it.
+    @param path     - path of the plugin file.
+    @param manifest - Manifest of the plugin directory, used to register the
+                      plugins lazily.  None to load them straight away.
+    @param reload   - import the file again, see load_module().
+    @return         - list of plugin instances.
+    """
+    pfile = os.path.basename(path)
+    pname = pfile[:-3]
+    pconfig = config.get(pname, {})
+
+    descriptions = manifest.get(pfile) if manifest is not None else None
+    if descriptions is not None:
+        if reload:
+            # Lazy plugins import the file again when first used.
+            with _modules_lock:
+                _modules.pop(os.path.abspath(path), None)
+
+        plugins = []
+        for description in descriptions:
+            log.msg('Registered %s.%s' % (pname, description['class']))
+            p = LazyPlugin(path, description, pconfig)
+            if any(k in pconfig for k in description['eager_config']):
+                p.activate()
+            plugins.append(p)
+        return plugins
+
+    module = load_module(path, reload)
+
+    plugins = []
+    for obj in [o for o in vars(module).values() if is_plugin(o)]:
+        log.msg("Loaded %s.%s" % (pname, obj.__name__))
+        plugins.append(obj(pconfig))
+    return plugins
+
+
+def load_plugins(config, path='plugins', lazy=False, cache=None):
+    """
+    Load every plugin in a directory.
+
+    @param config   - configuration, the section named after each plugin
+                      file is passed to the plugins in it.
+    @param path     - directory containing the plugins.
+    @param lazy     - register plugins from their description and only load
+                      them when first used.  Plugins that cannot be
+                      described are loaded straight away.
+    @param cache    - file plugin descriptions are cached in.
+    @return         - list of plugin instances.
+    """
+    plugins = []
+    manifest = Manifest(path, cache)
+
+    for pfile in manifest.files():
+        try:
+            plugins.extend(load_file(
+                config,
+                os.path.join(path, pfile),
+                manifest if lazy else None))
+        except ImportError, e:
+            log.err("Failed to log plugin '%s': %s" % (pfile[:-3], e))
+
+    if lazy:
+        manifest.save()
+
+    return plugins
@@ -0,0 +1,353 @@
+import bisect
+import threading
+import time
+
+from twisted.internet import defer, reactor
+from twisted.web import resource, server
+
+# Upper bounds in seconds of the buckets of latency histograms.
+DEFAULT_BUCKETS = (
+    0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not len(pairs):
+        return ''
+
+    def escape(value):
+        value = unicode(value) if isinstance(value, unicode) else str(value)
+        return value.replace('\\', r'\\').replace('"', r'\"').replace(
+            '\n', r'\n')
+
+    return '{%s}' % (','.join(
+        '%s="%s"' % (name, escape(value)) for name, value in pairs),)
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value))
+
+
+class _Metric(object):
+    kind = None
+
+    def __init__(self, name, help, labels, lock):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._lock = lock
+        self._values = {}
+
+    def _key(self, values):
+        if len(values) != len(self.labels):
+            raise ValueError('%s takes labels %s' % (self.name, self.labels))
+        return tuple(values)
+
+    def render(self):
+        lines = [
+            '# HELP %s %s' % (self.name, self.help),
+            '# TYPE %s %s' % (self.name, self.kind),
+        ]
+        lines.extend(self._samples())
+        return lines
+
+
+class Counter(_Metric):
+    """
+    Value that only goes up, such as a number of calls.
+    """
+    kind = 'counter'
+
+    def inc(self, *values, **kwds):
+        """
+        Increment the counter.
+
+        @param values   - values of the labels.
+        @param amount   - amount to add, 1 by default.
+        """
+        key = self._key(values)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + kwds.get(
+                'amount', 1)
+
+    def value(self, *values):
+        return self._values.get(self._key(values), 0)
+
+    def _samples(self):
+        with self._lock:
+            items = sorted(self._values.items())
+        return [
+            '%s%s %s' % (
+                self.name,
+                _format_labels(self.labels, k),
+                _format_value(v))
+            for k, v in items]
+
+
+class Gauge(_Metric):
+    """
+    Value that goes up and down, such as the length of a queue.  Gauges are
+    either set or read from a function when rendered.
+    """
+    kind = 'gauge'
+
+    def set(self, value, *values):
+        with self._lock:
+            self._values[self._key(values)] = value
+
+    def set_function(self, func, *values):
+        """
+        Read the value of the gauge from a function.
+
+        @param func     - function returning the value.
+        @param values   - values of the labels.
+        """
+        self.set(func, *values)
+
+    def value(self, *values):
+        value = self._values.get(self._key(values), 0)
+        return value() if callable(value) else value
+
+    def _samples(self):
+        with self._lock:
+            items = sorted(self._values.items())
+        return [
+            '%s%s %s' % (
+                self.name,
+                _format_labels(self.labels, k),
+                _format_value(v() if callable(v) else v))
+            for k, v in items]
+
+
+class Histogram(_Metric):
+    """
+    Distribution of values, such as latencies, counted in buckets.
+    """
+    kind = 'histogram'
+
+    def __init__(self, name, help, labels, lock, buckets=DEFAULT_BUCKETS):
+        super(Histogram, self).__init__(name, help, labels, lock)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, *values):
+        """
+        Record a value.
+
+        @param value    - value to record.
+        @param values   - values of the labels.
+        """
+        key = self._key(values)
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts = self._values.get(key)
+            if counts is None:
+                counts = self._values[key] = [
+                    [0] * (len(self.buckets) + 1), 0.0]
+            counts[0][i] += 1
+            counts[1] += value
+
+    def count(self, *values):
+        counts = self._values.get(self._key(values))
+        return sum(counts[0]) if counts is not None else 0
+
+    def _samples(self):
+        with self._lock:
+            items = sorted(
+                (k, (list(v[0]), v[1])) for k, v in self._values.items())
+
+        lines = []
+        for key, (counts, total) in items:
+            cumulative = 0
+            for bound, count in zip(
+                    self.buckets + (float('inf'),), counts):
+                cumulative += count
+                lines.append('%s_bucket%s %d' % (
+                    self.name,
+                    _format_labels(
+                        self.labels, key, [('le', _format_value(bound))]),
+                    cumulative))
+            labels = _format_labels(self.labels, key)
+            lines.append('%s_sum%s %s' % (
+                self.name, labels, _format_value(total)))
+            lines.append('%s_count%s %d' % (self.name, labels, cumulative))
+        return lines
+
+
+class Registry(object):
+    """
+    Collection of metrics rendered together in the Prometheus text format.
+    Metrics can be updated from any thread.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._metrics = {}
+
+    def _get(self, cls, name, help, labels, **kwds):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = cls(name, help, labels, self._lock, **kwds)
+                self._metrics[name] = metric
+        if not isinstance(metric, cls) or metric.labels != tuple(labels):
+            raise ValueError('%s is already registered differently' % (
+                name,))
+        return metric
+
+    def counter(self, name, help, labels=()):
+        """
+        Get a counter, creating it if needed.
+
+        @param name     - name of the metric.
+        @param help     - description of the metric.
+        @param labels   - names of the labels of the metric.
+        @return         - Counter.
+        """
+        return self._get(Counter, name, help, labels)
+
+    def gauge(self, name, help, labels=()):
+        """
+        Get a gauge, creating it if needed.  See counter().
+        """
+        return self._get(Gauge, name, help, labels)
+
+    def histogram(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        """
+        Get a histogram, creating it if needed.  See counter().
+
+        @param buckets  - upper bounds of the buckets.
+        """
+        return self._get(Histogram, name, help, labels, buckets=buckets)
+
+    def render(self):
+        """
+        Render every metric in the Prometheus text format.
+
+        @return - text of the metrics.
+        """
+        with self._lock:
+            metrics = sorted(self._metrics.items())
+
+        lines = []
+        for _, metric in metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+class HandlerMetrics(object):
+    """
+    Calls, errors and latencies of plugin handlers.  The time a handler
+    waits for a thread is recorded apart from the time it runs for.
+    """
+    def __init__(self, registry):
+        labels = ('kind', 'handler')
+        self._calls = registry.counter(
+            'delbert_handler_calls_total',
+            'Handler calls.',
+            labels)
+        self._errors = registry.counter(
+            'delbert_handler_errors_total',
+            'Handler calls that failed.',
+            labels)
+        self._queued = registry.histogram(
+            'delbert_handler_queue_seconds',
+            'Time handlers waited before running.',
+            labels)
+        self._run = registry.histogram(
+            'delbert_handler_run_seconds',
+            'Time handlers ran for, until their Deferred fired if any.',
+            labels)
+
+    def wrap(self, f, kind, name):
+        """
+        Wrap a handler to record its metrics.  The wait starts when the
+        handler is wrapped.
+
+        @param f    - handler.
+        @param kind - kind of handler: command, passive or user_join.
+        @param name - name of the handler.
+        @return     - the wrapped handler.
+        """
+        queued = time.time()
+
+        def finished(result, start):
+            self._run.observe(time.time() - start, kind, name)
+            return result
+
+        def failed(reason, start):
+            self._errors.inc(kind, name)
+            return finished(reason, start)
+
+        def timed(*args, **kwds):
+            start = time.time()
+            self._calls.inc(kind, name)
+            self._queued.observe(start - queued, kind, name)
+            try:
+                result = f(*args, **kwds)
+            except Exception:
+                failed(None, start)
+                raise
+
+            if isinstance(result, defer.Deferred):
+                result.addCallbacks(
+                    finished, failed,
+                    callbackArgs=(start,),
+                    errbackArgs=(start,))
+            else:
+                finished(result, start)
+            return result
+
+        timed.is_deferred = getattr(f, 'is_deferred', False)
+        timed.help = getattr(f, 'help', None)
+        return timed
+
+
+def watch_thread_pool(registry, pool=None):
+    """
+    Report the jobs waiting for and running in a thread pool.
+
+    @param registry - Registry to report to.
+    @param pool     - thread pool, the reactor's by default.
+    """
+    if pool is None:
+        pool = reactor.getThreadPool()
+
+    registry.gauge(
+        'delbert_thread_pool_queue',
+        'Jobs waiting for a thread.').set_function(
+            lambda: pool.q.qsize())
+    registry.gauge(
+        'delbert_thread_pool_working',
+        'Threads running a job.').set_function(
+            lambda: len(pool.working))
+
+
+class MetricsResource(resource.Resource):
+    isLeaf = True
+
+    def __init__(self, registry):
+        resource.Resource.__init__(self)
+        self._registry = registry
+
+    def render_GET(self, request):
+        request.setHeader(
+            'Content-Type',
+            'text/plain; version=0.0.4; charset=utf-8')
+        text = self._registry.render()
+        return text.encode('utf-8') if isinstance(text, unicode) else text
+
+
+def listen(registry, port, interface='127.0.0.1'):
+    """
+    Serve metrics over http.
+
+    @param registry     - Registry to serve.
+    @param port         - port to listen on.
+    @param interface    - address to listen on, local only by default.
+    @return             - the listening port.
+    """
+    return reactor.listenTCP(
+        port,
+        server.Site(MetricsResource(registry)),
+        interface=interface)
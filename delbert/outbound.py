@@ -0,0 +1,196 @@
+import collections
+
+from twisted.internet import reactor
+from twisted.python import context, log, threadable
+
+# Context key holding the priority of lines sent by the running handler.
+PRIORITY = 'delbert.outbound.priority'
+
+# Priorities, lower values are sent first.
+CONTROL = 0
+COMMAND = 1
+DEFAULT = 2
+PASSIVE = 3
+
+
+def in_reactor_thread():
+    """
+    Check if the caller is running in the reactor thread.  Until the reactor
+    is started every thread is treated as the reactor thread.
+    """
+    return threadable.ioThread is None or threadable.isInIOThread()
+
+
+class OutboundScheduler(object):
+    """
+    Schedule outgoing lines so the server's flood limits are respected
+    without one busy target starving the others.
+
+    Lines are rate limited with a token bucket: up to burst lines can be sent
+    at once, after which lines are sent at rate lines per second.  Waiting
+    lines are sent in priority order, and lines of the same priority are
+    sent round-robin between targets.
+    """
+    def __init__(self, rate=2.0, burst=5, clock=None, delays=None):
+        """
+        @param rate     - lines per second sent once the burst is used up.
+        @param burst    - lines that can be sent back to back.
+        @param clock    - reactor used for scheduling.
+        @param delays   - function called with the seconds each line waited
+                          before being sent.
+        """
+        self._rate = float(rate)
+        self._burst = burst
+        self._clock = clock if clock is not None else reactor
+        self._tokens = float(burst)
+        self._last = self._clock.seconds()
+        self._queues = {}
+        self._pending = 0
+        self._writer = None
+        self._delayed = None
+        self._delays = delays
+
+    def __len__(self):
+        return self._pending
+
+    def start(self, writer):
+        """
+        Start sending lines.
+
+        @param writer   - function called with each line to send.
+        """
+        self._writer = writer
+        self._pump()
+
+    def stop(self):
+        """
+        Stop sending lines.  Lines already queued are kept until the
+        scheduler is started again.
+        """
+        self._writer = None
+        if self._delayed is not None and self._delayed.active():
+            self._delayed.cancel()
+        self._delayed = None
+
+    def push(self, line, target=None, priority=DEFAULT, sent=None):
+        """
+        Queue a line to be sent.
+
+        @param line     - line to send.
+        @param target   - user or channel the line is sent to, lines to the
+                          same target are sent in order.
+        @param priority - priority of the line.
+        @param sent     - function called once the line is written.
+        """
+        targets = self._queues.setdefault(
+            priority,
+            collections.OrderedDict())
+        if target not in targets:
+            targets[target] = collections.deque()
+        targets[target].append((line, self._clock.seconds(), sent))
+        self._pending += 1
+
+        if self._delayed is None:
+            self._pump()
+
+    def _refill(self):
+        now = self._clock.seconds()
+        self._tokens = min(
+            self._burst,
+            self._tokens + (now - self._last) * self._rate)
+        self._last = now
+
+    def _next(self):
+        for priority in sorted(self._queues.keys()):
+            targets = self._queues[priority]
+            if not len(targets):
+                continue
+
+            # Move the target to the back so the others get a turn.
+            target, lines = targets.popitem(last=False)
+            line, queued, sent = lines.popleft()
+            if len(lines):
+                targets[target] = lines
+
+            self._pending -= 1
+            if self._delays is not None:
+                self._delays(self._clock.seconds() - queued)
+            return line, sent
+
+    def _pump(self):
+        self._delayed = None
+        if self._writer is None:
+            return
+
+        # Writing a line can lose the connection and stop the scheduler.
+        self._refill()
+        while self._writer is not None and self._pending and self._tokens >= 1:
+            self._tokens -= 1
+            line, sent = self._next()
+            self._writer(line)
+            if sent is not None:
+                sent()
+
+        if self._writer is not None and self._pending:
+            self._delayed = self._clock.callLater(
+                (1 - self._tokens) / self._rate,
+                self._pump)
+
+
+class Handoff(object):
+    """
+    Run calls made in worker threads on the reactor, in batches.  Calls are
+    appended to a deque, which needs no lock, and only the first call of a
+    batch wakes the reactor up with callFromThread.  The reactor then runs
+    every call queued by the time it drains the deque, so a handler sending
+    several lines costs a single wakeup.
+
+    Calls are run in the order they were made and keep the context they
+    were made in, such as the priority of the handler making them.
+    """
+    def __init__(self, clock=None):
+        """
+        @param clock    - reactor the calls are run on.
+        """
+        self._clock = clock if clock is not None else reactor
+        self._calls = collections.deque()
+        self._scheduled = False
+        self.calls = 0
+        self.wakeups = 0
+
+    def __len__(self):
+        return len(self._calls)
+
+    def call(self, f, *args, **kwds):
+        """
+        Run a function on the reactor.  Calls made from the reactor thread
+        run straight away.
+
+        @param f    - function to call.
+        @param args - arguments of the function.
+        @param kwds - keyword arguments of the function.
+        """
+        if in_reactor_thread():
+            f(*args, **kwds)
+            return
+
+        ctx = context.theContextTracker.currentContext().contexts[-1]
+        self._calls.append((ctx, f, args, kwds))
+
+        # The flag is cleared before the reactor drains the deque, so a call
+        # seeing it set is always picked up by the pending drain.  Two
+        # threads racing here at worst schedule an extra, empty, drain.
+        if not self._scheduled:
+            self._scheduled = True
+            self.wakeups += 1
+            self._clock.callFromThread(self._drain)
+
+    def _drain(self):
+        self._scheduled = False
+        while len(self._calls):
+            ctx, f, args, kwds = self._calls.popleft()
+            self.calls += 1
+            try:
+                context.call(ctx, f, *args, **kwds)
+            except Exception:
+                log.err(None, 'Handed off call to %r failed' % (f,))
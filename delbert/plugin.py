@@ -1,48 +1,193 @@
+import functools
 import inspect
+import re
+import sys
+import threading
 
+from twisted.internet import defer, reactor
+from twisted.python import context
 
-def irc_command(text):
+import outbound
+
+
+# Every function wrapped by inlineCallbacks shares the same code object.
+_INLINE_CALLBACKS_CODE = defer.inlineCallbacks(lambda: None).func_code
+
+
+def compile_triggers(substrings=None, keywords=None, regex=None):
+    """
+    Build a regular expression matching any of the given triggers.
+
+    @param substrings   - list of literal strings to look for.
+    @param keywords     - list of words to look for on word boundaries.
+    @param regex        - regular expression string to search for.  It must
+                          not use backreferences as it gets combined with the
+                          triggers of other passives.
+
+    @return - pattern string or None if no triggers were specified.
+    """
+    parts = [re.escape(s) for s in substrings or []]
+    parts.extend(r'\b%s\b' % (re.escape(k),) for k in keywords or [])
+    if regex is not None:
+        parts.append(regex)
+
+    if not len(parts):
+        return None
+
+    pattern = '|'.join('(?:%s)' % (p,) for p in parts)
+    re.compile(pattern)
+    return pattern
+
+
+def _in_context(func):
+    """
+    Wrap a generator function so the generator always resumes in the context
+    it was started in.  inlineCallbacks resumes a generator from whichever
+    callback fires, which would otherwise lose the context of the handler.
+
+    @param func - generator function.
+    @return     - generator function.
+    """
+    @functools.wraps(func)
+    def wrapper(*args, **kwds):
+        ctx = context.theContextTracker.currentContext().contexts[-1]
+        gen = func(*args, **kwds)
+        step, value = gen.send, None
+
+        while True:
+            result = context.call(ctx, step, value)
+            try:
+                value = yield result
+            except Exception:
+                exc = sys.exc_info()
+                step, value = lambda _: gen.throw(*exc), None
+            else:
+                step = gen.send
+
+    return wrapper
+
+
+def _handler(func, deferred):
+    """
+    Prepare a method for use as an irc handler.  Handlers returning a
+    Deferred are run on the reactor, all others are deferred to a thread.
+    Generator functions are wrapped with inlineCallbacks and, like methods
+    already wrapped by inlineCallbacks, are always run on the reactor.  They
+    keep the context they were called in across yields.
+
+    @param func     - handler method.
+    @param deferred - True if the method returns a Deferred.
+    @return         - the handler.
+    """
+    if inspect.isgeneratorfunction(func):
+        func = defer.inlineCallbacks(_in_context(func))
+        deferred = True
+    elif getattr(func, 'func_code', None) is _INLINE_CALLBACKS_CODE:
+        deferred = True
+
+    func = _tracked(func)
+    func.is_deferred = deferred
+    return func
+
+
+def _tracked(func):
+    """
+    Wrap a handler method so the plugin knows how many of its handlers are
+    running, see Plugin.drain().  Handlers returning a Deferred are running
+    until it fires.
+
+    @param func - handler method.
+    @return     - handler method.
+    """
+    @functools.wraps(func)
+    def wrapper(self, *args, **kwds):
+        self._enter()
+        try:
+            result = func(self, *args, **kwds)
+        except Exception:
+            self._leave()
+            raise
+
+        if isinstance(result, defer.Deferred):
+            result.addBoth(self._leave)
+        else:
+            self._leave()
+        return result
+
+    return wrapper
+
+
+def irc_command(text, deferred=False):
     """
     Declare a method as an irc command.
 
-    @param text - help string for the command.
+    @param text     - help string for the command.
+    @param deferred - the command returns a Deferred and should be run on
+                      the reactor rather than in a thread.
     """
     def f(func):
+        func = _handler(func, deferred)
         func.is_command = True
         func.help = text
         return func
     return f
 
 
-def irc_passive(text):
+def irc_passive(
+        text, substrings=None, keywords=None, regex=None, deferred=False):
     """
     Declare a method as a passive irc command.  Passive commands
     are run on every message sent to a public channel that the
     bot is in.
 
-    @param text - help string for the passive command.
+    Passives may declare cheap triggers, in which case they are only run on
+    messages matching at least one of them.  See compile_triggers().
+
+    @param text         - help string for the passive command.
+    @param substrings   - list of literal strings triggering the passive.
+    @param keywords     - list of words triggering the passive.
+    @param regex        - regular expression triggering the passive.
+    @param deferred     - the passive returns a Deferred and should be run
+                          on the reactor rather than in a thread.
     """
     def f(func):
+        func = _handler(func, deferred)
         func.is_passive = True
         func.help = text
+        func.triggers = compile_triggers(substrings, keywords, regex)
         return func
     return f
 
 
-def irc_user_join(text):
+def irc_user_join(text, deferred=False):
     """
     Declare a method as a user join callback.  User joins are called
     whenever a user joins a channel the bot is in.
 
-    @param text - help string for the passive command.
+    @param text     - help string for the passive command.
+    @param deferred - the callback returns a Deferred and should be run on
+                      the reactor rather than in a thread.
     """
     def f(func):
+        func = _handler(func, deferred)
         func.is_user_join = True
         func.help = text
         return func
     return f
 
 
+def owner(handler):
+    """
+    @param handler  - handler of a plugin, as found in a channel.
+    @return         - plugin the handler belongs to, or None if it is not a
+                      method of a plugin in this process.
+    """
+    p = getattr(handler, 'plugin', None)
+    if p is None:
+        p = getattr(handler, 'im_self', None)
+    return p if isinstance(p, Plugin) else None
+
+
 def get_nick(full_name):
     return full_name.split('!', 1)[0]
 
@@ -58,8 +203,18 @@ class Plugin(object):
     Plugins use the irc_command, irc_passive and irc_user_join method
     decorators to declare commands they can accept from users.
 
+    Handlers are run in a thread unless they return a Deferred, in which case
+    they are run on the reactor and must not block.  Generator handlers are
+    treated as inlineCallbacks:
+
+        @irc_command('lookup something')
+        def lookup(self, user, channel, args):
+            result = yield self.deferred_lookup(args)
+            self._proto.send_msg(channel, result)
+
     Prior to use, a plugin should be initialized with the initalize()
-    method in order to set the irc protocol and bot nickname.
+    method in order to set the irc protocol, bot nickname and the shared
+    http client.
     """
     class NullProto(object):
         def send_msg(self, channel, msg):
@@ -77,9 +232,14 @@ class Plugin(object):
         self._name = name
         self._nickname = ''
         self._proto = Plugin.NullProto()
+        self._http = None
         self._commands = {}
         self._passives = {}
         self._user_joins = {}
+        self._triggers = {}
+        self._running = 0
+        self._drained = []
+        self._running_lock = threading.Lock()
 
         for name, method in inspect.getmembers(self, inspect.ismethod):
             if getattr(method, 'is_command', False):
@@ -87,6 +247,7 @@ class Plugin(object):
 
             elif getattr(method, 'is_passive', False):
                 self._passives[name] = method
+                self._triggers[name] = getattr(method, 'triggers', None)
 
             elif getattr(method, 'is_user_join', False):
                 self._user_joins[name] = method
@@ -119,6 +280,25 @@ class Plugin(object):
         """
         return self._user_joins
 
+    @property
+    def triggers(self):
+        """
+        Mapping of passive function name to trigger pattern.  Passives without
+        triggers map to None.
+        """
+        return self._triggers
+
+    def set_triggers(self, name, substrings=None, keywords=None, regex=None):
+        """
+        Replace the triggers declared for a passive.  Useful when triggers
+        depend on the plugin configuration.
+
+        @param name - name of the passive.
+
+        See compile_triggers() for the remaining parameters.
+        """
+        self._triggers[name] = compile_triggers(substrings, keywords, regex)
+
     @property
     def proto(self):
         """
@@ -129,9 +309,17 @@ class Plugin(object):
     @property
     def nickname(self):
         """
-        Name of the bot.
+        Name of the bot.  When the protocol knows the nickname, such as when
+        the bot is on several networks, the protocol's nickname is used.
+        """
+        return getattr(self._proto, 'nickname', self._nickname)
+
+    @property
+    def http(self):
+        """
+        Shared non-blocking http client, see delbert.httpclient.
         """
-        return self._nickname
+        return self._http
 
     def send_to(self, channel, user):
         '''
@@ -146,12 +334,66 @@ class Plugin(object):
             return get_nick(user)
         return channel
 
-    def initialize(self, nickname, proto):
+    def _enter(self):
+        with self._running_lock:
+            self._running += 1
+
+    def _leave(self, result=None):
+        with self._running_lock:
+            self._running -= 1
+            drained = []
+            if not self._running:
+                drained, self._drained = self._drained, []
+
+        for d in drained:
+            if outbound.in_reactor_thread():
+                d.callback(None)
+            else:
+                reactor.callFromThread(d.callback, None)
+
+        return result
+
+    def queued(self):
+        """
+        Count a job running handlers of the plugin from the moment it is
+        queued, so drain() also waits for jobs that have yet to start.
+
+        @return - function to call with the result of the job once it
+                  finishes, returning the result.
+        """
+        self._enter()
+        return self._leave
+
+    def drain(self):
+        """
+        Wait for the handlers of the plugin that are queued or running to
+        finish.
+
+        @return - Deferred firing once no handler is running.
+        """
+        with self._running_lock:
+            if not self._running:
+                return defer.succeed(None)
+            d = defer.Deferred()
+            self._drained.append(d)
+            return d
+
+    def shutdown(self):
+        """
+        Called once the plugin has been replaced, for instance by a newer
+        version of the plugin, and none of its handlers are running.  Plugins
+        holding on to resources such as listening ports release them here.
+        """
+        pass
+
+    def initialize(self, nickname, proto, http=None):
         """
         Initialize the plugin.
 
         @param nickname - nickname of the bot.
         @param proto    - irc protocol.
+        @param http     - shared http client.
         """
         self._nickname = nickname
         self._proto = proto
+        self._http = http
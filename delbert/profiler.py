@@ -0,0 +1,243 @@
+import collections
+import os
+import sys
+import thread
+import threading
+import time
+
+from twisted.internet import defer, reactor
+from twisted.python import failure, log, threadable
+
+# Leaf frames of threads waiting for work rather than doing any.
+_IDLE = frozenset([
+    ('threading.py', 'wait'),
+    ('Queue.py', 'get'),
+    ('epollreactor.py', 'doPoll'),
+    ('pollreactor.py', 'doPoll'),
+    ('selectreactor.py', 'doSelect'),
+])
+
+
+def _function(code):
+    return '%s (%s:%d)' % (
+        code.co_name,
+        os.path.basename(code.co_filename),
+        code.co_firstlineno)
+
+
+class SamplingProfiler(object):
+    """
+    Profile the running bot by sampling the stack of every thread, the
+    reactor thread and the threads handlers run in, at a fixed interval.
+    Unlike cProfile nothing is added to the calls being profiled, so it can
+    be switched on in a live bot.
+
+    A profile runs for a number of seconds or until a number of handlers
+    have been called, whichever comes first.  The sampled stacks are written
+    to the dbdir in the collapsed format read by flamegraph.pl and
+    speedscope.
+    """
+    def __init__(self, dbdir, interval=0.005, max_duration=300, top=10,
+                 clock=None, frames=None):
+        """
+        @param dbdir        - directory profiles are written to.
+        @param interval     - seconds between samples.
+        @param max_duration - longest a profile may run for, in seconds.
+        @param top          - number of hot functions reported.
+        @param clock        - reactor used for scheduling and for handing
+                              the profile back from the sampling thread.
+        @param frames       - function returning the current frame of each
+                              thread by thread id, see sys._current_frames.
+        """
+        self._dbdir = dbdir
+        self._interval = interval
+        self._max_duration = max_duration
+        self._top = top
+        self._clock = clock if clock is not None else reactor
+        self._frames = frames if frames is not None else sys._current_frames
+
+        self._thread = None
+        self._stopping = threading.Event()
+        self._delayed = None
+        self._done = None
+        self._calls = None
+        self._handled = 0
+        self._started = None
+        self._stacks = collections.Counter()
+        self._samples = 0
+
+    @property
+    def running(self):
+        return self._done is not None
+
+    def start(self, duration=None, calls=None):
+        """
+        Start profiling.
+
+        @param duration - seconds to profile for, at most max_duration.
+        @param calls    - number of handler calls to profile, see handled().
+        @return         - Deferred firing with the lines of the report once
+                          the profile is written.
+        """
+        if self.running:
+            raise RuntimeError('Already profiling')
+
+        if duration is None or duration > self._max_duration:
+            duration = self._max_duration
+
+        self._stacks = collections.Counter()
+        self._samples = 0
+        self._handled = 0
+        self._calls = calls
+        self._started = time.time()
+        self._done = defer.Deferred()
+        self._delayed = self._clock.callLater(duration, self.stop)
+
+        self._stopping.clear()
+        self._thread = threading.Thread(
+            target=self._run,
+            name='delbert-profiler')
+        self._thread.daemon = True
+        self._thread.start()
+        return self._done
+
+    def handled(self, calls=1):
+        """
+        Count handler calls, stopping the profile once enough were made.
+        Called from the reactor thread as handlers finish.
+
+        @param calls    - number of handler calls that finished.
+        """
+        if not self.running or self._stopping.is_set():
+            return
+
+        self._handled += calls
+        if self._calls is not None and self._handled >= self._calls:
+            self.stop()
+
+    def stop(self):
+        """
+        Stop profiling.  The sampling thread writes the profile, so the
+        reactor is not blocked while it finishes.
+
+        @return - Deferred returned by start(), or None if not profiling.
+        """
+        if not self.running:
+            return None
+
+        if not self._stopping.is_set():
+            self._stopping.set()
+            if self._delayed.active():
+                self._delayed.cancel()
+            self._delayed = None
+        return self._done
+
+    def _run(self):
+        while not self._stopping.wait(self._interval):
+            self.sample()
+
+        try:
+            result = self._report(self._write())
+        except Exception:
+            result = failure.Failure()
+        self._clock.callFromThread(self._finished, result)
+
+    def _finished(self, result):
+        self._thread = None
+        done, self._done = self._done, None
+        if isinstance(result, failure.Failure):
+            done.errback(result)
+        else:
+            done.callback(result)
+
+    def sample(self):
+        """
+        Record the stack of every thread but the calling one.
+        """
+        me = thread.get_ident()
+        for ident, frame in self._frames().items():
+            if ident == me:
+                continue
+
+            stack = []
+            while frame is not None:
+                stack.append(frame.f_code)
+                frame = frame.f_back
+            if not len(stack):
+                continue
+
+            name = 'reactor' if ident == threadable.ioThread else 'worker'
+            stack.append(name)
+            self._stacks[tuple(reversed(stack))] += 1
+        self._samples += 1
+
+    def _idle(self, code):
+        return (os.path.basename(code.co_filename), code.co_name) in _IDLE
+
+    def _write(self):
+        path = os.path.join(
+            self._dbdir,
+            'profile-%s.txt' % (time.strftime('%Y%m%d-%H%M%S'),))
+        with open(path, 'w') as f:
+            for stack, count in sorted(self._stacks.items()):
+                f.write('%s;%s %d\n' % (
+                    stack[0],
+                    ';'.join(_function(code) for code in stack[1:]),
+                    count))
+
+        log.msg('Wrote profile %s' % (path,))
+        return path
+
+    def _report(self, path):
+        own = collections.Counter()
+        busy = 0
+        for stack, count in self._stacks.items():
+            if self._idle(stack[-1]):
+                continue
+            busy += count
+            own[(stack[0], _function(stack[-1]))] += count
+
+        lines = ['Profiled %.1fs, %d samples, %d handler calls: %s' % (
+            time.time() - self._started,
+            self._samples,
+            self._handled,
+            path)]
+        for (name, function), count in own.most_common(self._top):
+            lines.append('%5.1f%% %s in %s' % (
+                100.0 * count / busy, function, name))
+        return lines
+
+    def command(self, user, args):
+        """
+        Admin command profiling the bot.
+
+            profile [SECONDS]       profile for a number of seconds.
+            profile N calls         profile until N handlers were called.
+            profile stop            stop profiling now.
+
+        @param user - user sending the command.
+        @param args - arguments of the command.
+        @return     - Deferred firing with the lines of the reply once the
+                      profile is written.
+        """
+        args = args.split()
+        if args == ['stop']:
+            if not self.running:
+                return ['Not profiling']
+            self.stop()
+            return []
+
+        if self.running:
+            return ['Already profiling']
+
+        duration = 30
+        calls = None
+        if len(args) == 2 and args[1] == 'calls':
+            duration = None
+            calls = int(args[0])
+        elif len(args) == 1:
+            duration = float(args[0])
+        elif len(args):
+            return ['Usage: profile [SECONDS | N calls | stop]']
+
+        return self.start(duration, calls)
@@ -0,0 +1,212 @@
+import os
+
+from twisted.internet import defer, reactor, task
+from twisted.python import log
+
+import loader
+
+
+class Reloader(object):
+    """
+    Load the plugins of a directory and reload them while the bot stays
+    connected.  Reloaded plugins replace the old ones in every channel at
+    once.  The old plugins are shut down once their running handlers have
+    finished.
+    """
+    def __init__(self, config, path='plugins', lazy=True, cache=None,
+                 clock=None):
+        """
+        @param config   - configuration, the section named after each plugin
+                          file is passed to the plugins in it.
+        @param path     - directory containing the plugins.
+        @param lazy     - load plugins lazily, see loader.load_plugins().
+        @param cache    - file plugin descriptions are cached in.
+        @param clock    - reactor used for scheduling.
+        """
+        self._config = config
+        self._path = path
+        self._manifest = loader.Manifest(path, cache) if lazy else None
+        self._clock = clock if clock is not None else reactor
+        self._plugins = []
+        self._files = {}
+        self._stats = {}
+        self._channels = []
+        self._initialize = None
+        self._watch = None
+
+    @property
+    def plugins(self):
+        """
+        List of loaded plugins.  The list is updated in place when plugins
+        are reloaded.
+        """
+        return self._plugins
+
+    def _stat(self, pfile):
+        st = os.stat(os.path.join(self._path, pfile))
+        return st.st_mtime, st.st_size
+
+    def _files_on_disk(self):
+        return sorted(
+            f for f in os.listdir(self._path)
+            if f.endswith('.py') and not f.startswith('__'))
+
+    def _load(self, pfile, reload):
+        return loader.load_file(
+            self._config,
+            os.path.join(self._path, pfile),
+            self._manifest,
+            reload)
+
+    def _update_plugins(self):
+        self._plugins[:] = [
+            p for pfile in sorted(self._files) for p in self._files[pfile]]
+
+    def _save(self):
+        if self._manifest is not None:
+            self._manifest.save()
+
+    def load(self):
+        """
+        Load every plugin in the directory.
+
+        @return - list of plugin instances.
+        """
+        for pfile in self._files_on_disk():
+            self._stats[pfile] = self._stat(pfile)
+            try:
+                self._files[pfile] = self._load(pfile, False)
+            except ImportError, e:
+                log.err("Failed to log plugin '%s': %s" % (pfile[:-3], e))
+                self._files[pfile] = []
+
+        self._save()
+        self._update_plugins()
+        return self._plugins
+
+    def attach(self, channels, nickname, proto, http=None):
+        """
+        Keep track of channels the plugins are registered with, so reloaded
+        plugins can be registered with them.
+
+        @param channels - list of channels.Channel.
+        @param nickname - nickname reloaded plugins are initialized with.
+        @param proto    - protocol reloaded plugins are initialized with.
+        @param http     - shared http client.
+        """
+        self._channels.extend(channels)
+        self._initialize = (nickname, proto, http)
+
+    def changed(self):
+        """
+        Find the plugin files that were modified, added or removed since
+        they were loaded.
+
+        @return - sorted list of plugin file names.
+        """
+        on_disk = self._files_on_disk()
+        changed = set(
+            f for f in on_disk if self._stats.get(f) != self._stat(f))
+        changed.update(f for f in self._files if f not in on_disk)
+        return sorted(changed)
+
+    def reload(self, pfiles=None):
+        """
+        Reload plugin files.  Files that fail to load leave the plugins they
+        were meant to replace in place.
+
+        @param pfiles   - names of the plugin files to reload, the changed
+                          files if None.
+        @return         - Deferred firing with the list of reloaded files
+                          once the plugins they replaced are shut down.
+        """
+        if pfiles is None:
+            pfiles = self.changed()
+
+        reloaded = []
+        replaced = []
+        for pfile in pfiles:
+            old = self._files.get(pfile, [])
+            if os.path.exists(os.path.join(self._path, pfile)):
+                self._stats[pfile] = self._stat(pfile)
+                try:
+                    new = self._load(pfile, True)
+                except Exception:
+                    log.err(None, 'Failed to reload %s' % (pfile,))
+                    continue
+                self._files[pfile] = new
+            elif pfile in self._files:
+                new = []
+                del self._files[pfile]
+                del self._stats[pfile]
+            else:
+                log.msg('No plugin file %s' % (pfile,))
+                continue
+
+            if self._initialize is not None:
+                for p in new:
+                    p.initialize(*self._initialize)
+
+            for channel in self._channels:
+                channel.replace_plugins(old, new)
+
+            log.msg('Reloaded %s' % (pfile,))
+            reloaded.append(pfile)
+            replaced.extend(old)
+
+        self._save()
+        self._update_plugins()
+
+        d = defer.DeferredList([self._retire(p) for p in replaced])
+        d.addCallback(lambda _: reloaded)
+        return d
+
+    def _retire(self, p):
+        d = p.drain()
+        d.addCallback(lambda _: p.shutdown())
+        d.addErrback(log.err, 'Failed to shut down %s' % (p.name,))
+        return d
+
+    def command(self, user, args):
+        """
+        Admin command reloading plugins, the changed ones unless plugin
+        names are given.
+
+        @param user - user sending the command.
+        @param args - names of the plugins to reload.
+        @return     - Deferred firing with the lines of the reply.
+        """
+        pfiles = [
+            a if a.endswith('.py') else '%s.py' % (a,) for a in args.split()]
+
+        d = self.reload(pfiles if len(pfiles) else None)
+        d.addCallback(lambda reloaded: [
+            'Reloaded %s' % (', '.join(reloaded),) if len(reloaded)
+            else 'Nothing to reload'])
+        return d
+
+    def check(self):
+        """
+        Reload the plugin files that changed.
+        """
+        pfiles = self.changed()
+        if len(pfiles):
+            log.msg('Plugins changed: %s' % (', '.join(pfiles),))
+            self.reload(pfiles)
+
+    def watch(self, interval=2.0):
+        """
+        Reload plugins when their files change.
+
+        @param interval - seconds between checks for changes.
+        """
+        self._watch = task.LoopingCall(self.check)
+        self._watch.clock = self._clock
+        self._watch.start(interval, now=False)
+
+    def stop(self):
+        """
+        Stop watching for changes.
+        """
+        if self._watch is not None and self._watch.running:
+            self._watch.stop()
@@ -0,0 +1,86 @@
+import collections
+
+from twisted.python import context
+
+# Context key holding the protocol of the network a handler is running for.
+PROTOCOL = 'delbert.router.protocol'
+
+
+class ProtocolRouter(object):
+    """
+    Protocol given to plugins shared between several networks.  Lines are
+    sent with the protocol of the network whose handler is running.  Lines
+    sent outside of a handler, such as from a webhook, go to every network
+    with the target channel configured.
+    """
+    def __init__(self):
+        self._protos = collections.OrderedDict()
+
+    def __getattr__(self, attr):
+        return getattr(self.current(), attr)
+
+    @property
+    def networks(self):
+        """
+        List of network names, in the order they were attached.
+        """
+        return self._protos.keys()
+
+    def attach(self, network, proto):
+        """
+        Route lines for a network to a protocol.  A protocol replaces the
+        previous one for the same network, such as after a reconnect.
+
+        @param network  - name of the network.
+        @param proto    - delbert.bot.BotProtocol connected to the network.
+        """
+        self._protos[network] = proto
+
+    def get(self, network):
+        """
+        Get the protocol for a network.
+
+        @param network  - name of the network.
+        @return         - protocol or None if the network is unknown.
+        """
+        return self._protos.get(network)
+
+    def current(self):
+        """
+        Get the protocol of the running handler, or the first network's
+        protocol outside of a handler.
+        """
+        proto = context.get(PROTOCOL)
+        if proto is None and len(self._protos):
+            proto = self._protos.values()[0]
+        return proto
+
+    @property
+    def nickname(self):
+        """
+        Nickname of the bot on the current network.
+        """
+        return self.current().nickname
+
+    def _route(self, target):
+        proto = context.get(PROTOCOL)
+        if proto is not None:
+            return [proto]
+
+        protos = [p for p in self._protos.values() if p.has_channel(target)]
+        if not len(protos) and len(self._protos):
+            protos = [self._protos.values()[0]]
+        return protos
+
+    def send_msg(self, target, msg):
+        for proto in self._route(target):
+            proto.send_msg(target, msg)
+
+    def send_notice(self, target, msg):
+        for proto in self._route(target):
+            proto.send_notice(target, msg)
+
+    def send_lines(self, target, lines, notice=False, sep=' | '):
+        lines = list(lines)
+        for proto in self._route(target):
+            proto.send_lines(target, lines, notice, sep)
@@ -0,0 +1,185 @@
+import copy
+import os
+import sys
+import zlib
+
+from twisted.internet import defer, protocol, reactor
+from twisted.python import log
+
+
+def shard_of(channel, workers):
+    """
+    Get the worker a channel belongs to.  Channels are spread between
+    workers by a hash of their name, so a channel stays with the same worker
+    across restarts.
+
+    @param channel  - name of the channel.
+    @param workers  - number of workers.
+    @return         - index of the worker.
+    """
+    return (zlib.crc32(channel.lower()) & 0xffffffff) % workers
+
+
+def shard_config(config, shard, workers):
+    """
+    Get the configuration of a single worker.  Each worker joins its share
+    of the channels of every network, with its own nickname.  Only the first
+    worker listens for github webhooks, so channels receiving github events
+    always belong to it.
+
+    @param config   - configuration as returned by bot.parse_config().
+    @param shard    - index of the worker.
+    @param workers  - number of workers.
+    @return         - configuration of the worker.
+    """
+    config = copy.deepcopy(config)
+    nick_format = config.get('shard_nick', '%(nick)s-%(shard)d')
+
+    for network in config['networks']:
+        github = network.get('github', {})
+        pinned = set(
+            c for channels in github.get('repos', {}).values()
+            for c in channels)
+
+        def owner(channel):
+            if channel in pinned:
+                return 0
+            return shard_of(channel, workers)
+
+        network['channels'] = dict(
+            (c, v) for c, v in network['channels'].items()
+            if owner(c) == shard)
+
+        # Workers authenticate as the same account under different nicks.
+        network.setdefault('account', network['nick'])
+        if shard:
+            network['nick'] = nick_format % {
+                'nick': network['nick'],
+                'shard': shard}
+            github.pop('listen_port', None)
+
+    return config
+
+
+class WorkerProtocol(protocol.ProcessProtocol):
+    def __init__(self, supervisor, shard):
+        self._supervisor = supervisor
+        self._shard = shard
+
+    def processEnded(self, reason):
+        self._supervisor.worker_ended(self._shard, reason)
+
+
+class Supervisor(object):
+    """
+    Run several worker processes, such as bots each handling a share of the
+    channels or plugin workers.  Workers that exit are restarted with a
+    growing delay.
+    """
+    def __init__(self, args, workers, max_delay=60, clock=None, spawn=None,
+                 option='--shard'):
+        """
+        @param args         - command line of a worker, the worker's index is
+                              appended with option.
+        @param workers      - number of workers.
+        @param max_delay    - longest wait in seconds before restarting a
+                              worker.
+        @param clock        - reactor used for scheduling.
+        @param spawn        - function used to start processes, see
+                              IReactorProcess.spawnProcess.
+        @param option       - option passing the worker's index as I/N.
+        """
+        self._args = args
+        self._option = option
+        self._workers = workers
+        self._max_delay = max_delay
+        self._clock = clock if clock is not None else reactor
+        self._spawn = spawn if spawn is not None else reactor.spawnProcess
+        self._processes = {}
+        self._started = {}
+        self._delays = {}
+        self._ended = {}
+        self._stopping = False
+
+    @property
+    def workers(self):
+        """
+        Mapping of shard to running worker processes.
+        """
+        return dict(self._processes)
+
+    def start(self):
+        """
+        Start every worker.
+        """
+        for shard in range(self._workers):
+            self._delays[shard] = 1
+            self.start_worker(shard)
+
+    def start_worker(self, shard):
+        """
+        Start a single worker.
+
+        @param shard    - index of the worker.
+        """
+        args = self._args + [self._option, '%d/%d' % (shard, self._workers)]
+        log.msg('Starting worker %d: %s' % (shard, ' '.join(args)))
+        self._started[shard] = self._clock.seconds()
+        self._processes[shard] = self._spawn(
+            WorkerProtocol(self, shard),
+            args[0],
+            args,
+            env=os.environ,
+            childFDs={0: 'w', 1: 1, 2: 2})
+
+    def worker_ended(self, shard, reason):
+        """
+        Called when a worker exits.  Workers are restarted unless the
+        supervisor is stopping.
+
+        @param shard    - index of the worker.
+        @param reason   - failure describing how the process ended.
+        """
+        log.msg('Worker %d ended: %s' % (shard, reason.value))
+        del self._processes[shard]
+
+        if self._stopping:
+            d = self._ended.pop(shard, None)
+            if d is not None:
+                d.callback(None)
+            return
+
+        # Workers that stayed up for a while are restarted straight away.
+        if self._clock.seconds() - self._started[shard] > self._max_delay:
+            self._delays[shard] = 1
+
+        delay = self._delays[shard]
+        self._delays[shard] = min(delay * 2, self._max_delay)
+        self._clock.callLater(delay, self.start_worker, shard)
+
+    def stop(self):
+        """
+        Stop every worker.
+
+        @return - Deferred firing once every worker has exited.
+        """
+        self._stopping = True
+
+        ended = []
+        for shard, process in self._processes.items():
+            self._ended[shard] = defer.Deferred()
+            ended.append(self._ended[shard])
+            try:
+                process.signalProcess('TERM')
+            except Exception:
+                log.err()
+
+        return defer.DeferredList(ended)
+
+
+def worker_args():
+    """
+    Get the command line used to run a worker, which is the command line of
+    the running supervisor.
+    """
+    return [sys.executable] + sys.argv
@@ -0,0 +1,88 @@
+import types
+
+
+def encode(msg):
+    """
+    Encode a message as utf-8 if it is unicode.
+
+    @param msg  - message to encode.
+    @return     - the message as a byte string.
+    """
+    if isinstance(msg, types.UnicodeType):
+        return msg.encode('utf-8')
+    return msg
+
+
+def split_message(msg, limit):
+    """
+    Split a message into lines no longer than limit bytes once encoded as
+    utf-8.  Messages are split on newlines and then, where possible, on
+    spaces.  Multibyte characters are never split and blank lines are
+    dropped.
+
+    @param msg      - message to split.
+    @param limit    - maximum length of a line in bytes.
+    @return         - list of utf-8 encoded lines, empty for a blank
+                      message.
+    """
+    lines = []
+
+    for data in encode(msg).split('\n'):
+        data = data.rstrip('\r')
+
+        while len(data) > limit:
+            cut = limit
+
+            # Back up to the start of a character, bytes 10xxxxxx continue a
+            # multibyte sequence.
+            while cut > 0 and (ord(data[cut]) & 0xc0) == 0x80:
+                cut -= 1
+
+            space = data.rfind(' ', 0, cut + 1)
+            if space > 0:
+                cut = space
+
+            if cut == 0:
+                cut = limit
+
+            line = data[:cut].rstrip(' ')
+            if len(line):
+                lines.append(line)
+            data = data[cut:].lstrip(' ')
+
+        if len(data.strip(' ')):
+            lines.append(data)
+
+    return lines
+
+
+def pack_lines(lines, limit, sep=' | '):
+    """
+    Merge short lines into as few lines as possible without any of them
+    going over limit bytes once encoded as utf-8.  Lines that are too long
+    on their own are split with split_message().
+
+    @param lines    - lines to pack, in order.
+    @param limit    - maximum length of a packed line in bytes.
+    @param sep      - separator placed between merged lines.
+    @return         - list of utf-8 encoded packed lines.
+    """
+    sep = encode(sep)
+    packed = []
+    current = None
+
+    for line in lines:
+        for part in split_message(encode(line).strip(), limit):
+            if current is not None and (
+                    len(current) + len(sep) + len(part) <= limit):
+                current = current + sep + part
+                continue
+
+            if current is not None:
+                packed.append(current)
+            current = part
+
+    if current is not None:
+        packed.append(current)
+
+    return packed
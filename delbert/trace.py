@@ -0,0 +1,162 @@
+import itertools
+import json
+import os
+import random
+import threading
+import time
+
+from twisted.internet import defer
+from twisted.python import context, logfile
+
+# Context key holding the id of the trace of the message being handled.
+TRACE = 'delbert.trace.id'
+
+
+def current():
+    """
+    Get the id of the trace of the running handler, None if the message it
+    handles is not traced.
+    """
+    return context.get(TRACE)
+
+
+class Tracer(object):
+    """
+    Record spans of the messages handled by the bot in the chrome trace event
+    format, see chrome://tracing.  Each traced message gets its own row,
+    showing where the time went between receiving it and writing replies.
+
+    Only a sample of the messages are traced.  Events are written to a file
+    rotated once it grows too large.  A rotated file is a complete trace.
+    """
+    def __init__(self, path, sample=0.01, rotate_length=10 * 1024 * 1024,
+                 max_files=5, rand=None):
+        """
+        @param path             - file events are written to.
+        @param sample           - fraction of the messages traced.
+        @param rotate_length    - size in bytes of a file before it is
+                                  rotated.
+        @param max_files        - number of rotated files kept.
+        @param rand             - function returning random numbers in
+                                  [0, 1), used for sampling.
+        """
+        self._sample = sample
+        self._rand = rand if rand is not None else random.random
+        self._ids = itertools.count(1)
+        self._pid = os.getpid()
+        self._lock = threading.Lock()
+        self._file = logfile.LogFile(
+            os.path.basename(path),
+            os.path.dirname(os.path.abspath(path)),
+            rotateLength=rotate_length,
+            maxRotatedFiles=max_files)
+
+    def start(self, name, **args):
+        """
+        Start tracing a message, if it is sampled.
+
+        @param name - name of the first event of the trace.
+        @param args - arguments recorded with the event.
+        @return     - id of the trace, None if the message is not traced.
+        """
+        if self._rand() >= self._sample:
+            return None
+
+        trace = next(self._ids)
+        self.instant(trace, name, **args)
+        return trace
+
+    def _write(self, event):
+        line = json.dumps(event) + ',\n'
+        with self._lock:
+            # Rotate before writing so the next file starts a new array.
+            if self._file.shouldRotate():
+                self._file.rotate()
+            if self._file.size == 0:
+                # Trace viewers accept an array without its closing bracket.
+                line = '[\n' + line
+            self._file.write(line)
+            self._file.flush()
+
+    def instant(self, trace, name, **args):
+        """
+        Record an event happening at a point in time.
+
+        @param trace    - id of the trace.
+        @param name     - name of the event.
+        @param args     - arguments recorded with the event.
+        """
+        self._write({
+            'name': name,
+            'ph': 'i',
+            's': 't',
+            'ts': int(time.time() * 1e6),
+            'pid': self._pid,
+            'tid': trace,
+            'args': args,
+        })
+
+    def span(self, trace, name, start, end=None, **args):
+        """
+        Record an event lasting for some time.
+
+        @param trace    - id of the trace.
+        @param name     - name of the event.
+        @param start    - time the event started, in seconds since the epoch.
+        @param end      - time the event ended, now if None.
+        @param args     - arguments recorded with the event.
+        """
+        end = end if end is not None else time.time()
+        self._write({
+            'name': name,
+            'ph': 'X',
+            'ts': int(start * 1e6),
+            'dur': int((end - start) * 1e6),
+            'pid': self._pid,
+            'tid': trace,
+            'args': args,
+        })
+
+    def wrap(self, f, trace, name):
+        """
+        Wrap a handler to record the time it waits before running and the
+        time it runs for.  The handler runs with the trace in its context so
+        the lines it sends and the requests it makes are traced too.
+
+        @param f        - handler.
+        @param trace    - id of the trace, the handler is returned as is if
+                          None.
+        @param name     - name of the handler.
+        @return         - the wrapped handler.
+        """
+        if trace is None:
+            return f
+
+        queued = time.time()
+
+        def finished(result, start):
+            self.span(trace, name, start)
+            return result
+
+        def traced(*args, **kwds):
+            start = time.time()
+            self.span(trace, 'queued %s' % (name,), queued, start)
+            try:
+                result = context.call({TRACE: trace}, f, *args, **kwds)
+            except Exception:
+                finished(None, start)
+                raise
+
+            if isinstance(result, defer.Deferred):
+                result.addBoth(finished, start)
+            else:
+                finished(result, start)
+            return result
+
+        traced.is_deferred = getattr(f, 'is_deferred', False)
+        traced.help = getattr(f, 'help', None)
+        return traced
+
+    def close(self):
+        with self._lock:
+            self._file.close()
@@ -0,0 +1,122 @@
+import collections
+
+from twisted.internet import reactor
+from twisted.python import log
+
+# Jobs waiting for, or running in, a thread that each kind of handler is
+# limited to.  Commands are never shed.
+DEFAULT_LIMITS = {
+    'passive': 200,
+    'user_join': 50,
+}
+
+
+class WorkQueues(object):
+    """
+    Bound the handler jobs of each kind queued for or running in a thread or
+    a plugin worker, so a flood of messages or joins sheds load instead of
+    queueing work without limit.
+
+    Once a kind is at its limit, new passives and user joins are dropped.
+    A user join identical to one still pending, such as a user rejoining
+    during a netsplit, is coalesced with it whatever the load.  Commands are
+    always run, they only count towards the pending jobs.
+
+    Dropped jobs are logged as a summary once per report interval rather
+    than one line each.  Coalesced jobs are only counted, they are not a
+    sign of overload.
+    """
+    def __init__(self, limits=None, report_interval=60, clock=None,
+                 shed=None):
+        """
+        @param limits           - mapping of handler kinds to the jobs they
+                                  may have pending, None for no limit.  Kinds
+                                  missing use DEFAULT_LIMITS.
+        @param report_interval  - seconds between logs of the dropped jobs.
+        @param clock            - reactor used for scheduling the reports.
+        @param shed             - function called with the kind and the
+                                  reason, dropped or coalesced, of every shed
+                                  job.
+        """
+        self._limits = dict(DEFAULT_LIMITS)
+        self._limits.update(limits or {})
+        self._report_interval = report_interval
+        self._clock = clock if clock is not None else reactor
+        self._shed = shed
+        self._pending = collections.Counter()
+        self._keys = set()
+        self._report = None
+        self._unreported = collections.Counter()
+        self.stats = collections.Counter()
+
+    def pending(self, kind):
+        """
+        @return - number of jobs of a kind queued or running.
+        """
+        return self._pending[kind]
+
+    def admit(self, kind, key=None):
+        """
+        Admit a job, unless it should be shed.
+
+        @param kind - kind of handler: command, passive or user_join.
+        @param key  - identity of the job, jobs of the same kind with the
+                      same key are coalesced.  None to never coalesce.
+        @return     - function to call with the result of the job once it
+                      finishes, returning the result, or None if the job was
+                      shed.
+        """
+        if kind != 'command':
+            if key is not None and (kind, key) in self._keys:
+                self._drop(kind, 'coalesced')
+                return None
+
+            limit = self._limits.get(kind)
+            if limit is not None and self._pending[kind] >= limit:
+                self._drop(kind, 'dropped')
+                return None
+
+        self._pending[kind] += 1
+        if key is not None:
+            self._keys.add((kind, key))
+
+        def release(result):
+            self._pending[kind] -= 1
+            self._keys.discard((kind, key))
+            return result
+
+        return release
+
+    def _drop(self, kind, reason):
+        self.stats[(kind, reason)] += 1
+        if self._shed is not None:
+            self._shed(kind, reason)
+
+        if reason != 'dropped':
+            return
+
+        self._unreported[kind] += 1
+        if self._report is None:
+            log.msg('Shedding load, %s pending %s jobs' % (
+                self._pending[kind], kind))
+            self._report = self._clock.callLater(
+                self._report_interval,
+                self.report)
+
+    def report(self):
+        """
+        Log the jobs dropped since the last report.
+        """
+        if self._report is not None and self._report.active():
+            self._report.cancel()
+        self._report = None
+
+        if not len(self._unreported):
+            return
+
+        log.msg('Dropped %s jobs in the last %ds' % (
+            ', '.join(
+                '%d %s' % (count, kind)
+                for kind, count in sorted(self._unreported.items())),
+            self._report_interval))
+        self._unreported.clear()
@@ -1,7 +1,7 @@
 from bs4 import BeautifulSoup as soup
-import requests
 from twisted.python import log
 
+import delbert.httpclient
 import delbert.plugin
 
 
@@ -9,6 +9,8 @@ class Excuses(delbert.plugin.Plugin):
     def __init__(self, config={}):
         super(Excuses, self).__init__('Excuses')
         self._config = config
+        self._base_url = config.get('base_url', 'http://developerexcuses.com/')
+        self._timeout = config.get('timeout', 5)
 
     def query_excuse(self):
         """
@@ -17,9 +19,13 @@ class Excuses(delbert.plugin.Plugin):
         @return  -  why the code is broken, incomplete, not-finished,
                     unexpected, you_getThe-idea None if parsing failed.
         """
+        # Every excuse is random, so they are not cached.
         try:
-            html = requests.get('http://developerexcuses.com', verify=False)
-        except requests.exceptions.RequestException, e:
+            html = self.http.blocking_get(
+                self._base_url,
+                timeout=self._timeout,
+                verify=False)
+        except delbert.httpclient.RequestError as e:
             log.err(str(e))
             return
 
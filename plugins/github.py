@@ -1,11 +1,11 @@
 import json
 
-import requests
 from twisted.python import log
 
 from twisted.web import (server, resource)
-from twisted.internet import reactor
+from twisted.internet import error, reactor
 
+import delbert.httpclient
 import delbert.plugin
 
 
@@ -80,18 +80,68 @@ class GithubHook(resource.Resource):
 
 
 class Github(delbert.plugin.Plugin):
-    def __init__(self, config=None):
+    # Webhooks are received from startup, see loader.
+    eager_config = ['listen_port']
+
+    # Seconds between attempts to listen for webhooks, doubled after every
+    # failure up to MAX_RETRY_DELAY.
+    RETRY_DELAY = 1
+    MAX_RETRY_DELAY = 60
+
+    def __init__(self, config=None, clock=None):
         super(Github, self).__init__('github')
         self._config = config if config is not None else {}
+        self._clock = clock if clock is not None else reactor
         self._hook = None
+        self._port = None
+        self._stopped = False
+        self._retry = None
+        self._retries = 0
+        self._max_retries = self._config.get('listen_retries', 10)
         self._repos = self._config.get('repos', {})
+        self._status_url = self._config.get(
+            'status_url', 'https://status.github.com/')
+        self._gitio_url = self._config.get('gitio_url', 'http://git.io/')
+        self._timeout = self._config.get('timeout', 5)
+        self._cache_ttl = self._config.get('cache_ttl', 60)
 
         if 'listen_port' in self._config:
             self._handler = GithubHook()
             self._handler.register_push_handler(self.handle_push)
             self._handler.register_issue_handler(self.handle_issue)
-            site = server.Site(self._handler)
-            reactor.listenTCP(self._config['listen_port'], site)
+            self._site = server.Site(self._handler)
+            self._listen()
+
+    def _listen(self):
+        # When reloaded, the port is free once the old plugin shuts down.
+        self._retry = None
+        if self._stopped:
+            return
+        try:
+            self._port = reactor.listenTCP(
+                self._config['listen_port'],
+                self._site)
+        except error.CannotListenError, e:
+            if self._retries >= self._max_retries:
+                log.err('Giving up listening for webhooks after %d retries: '
+                        '%s' % (self._retries, e))
+                return
+
+            delay = min(
+                self.RETRY_DELAY * 2 ** self._retries,
+                self.MAX_RETRY_DELAY)
+            self._retries += 1
+            log.msg('Retrying to listen for webhooks in %ds: %s' % (delay, e))
+            self._retry = self._clock.callLater(delay, self._listen)
+
+    def shutdown(self):
+        self._stopped = True
+        if self._retry is not None and self._retry.active():
+            self._retry.cancel()
+        self._retry = None
+        if self._port is not None:
+            self._port.stopListening()
+            self._port = None
 
     @property
     def status(self):
@@ -99,10 +149,12 @@ class Github(delbert.plugin.Plugin):
         Return current github status.
         """
         try:
-            html = requests.get(
-                    'https://status.github.com/api/last-message.json',
-                    verify=False)
-        except requests.exceptions.RequestException, e:
+            html = self.http.blocking_get(
+                self._status_url + 'api/last-message.json',
+                timeout=self._timeout,
+                cache_ttl=self._cache_ttl,
+                verify=False)
+        except delbert.httpclient.RequestError as e:
             log.err(str(e))
             return
 
@@ -116,8 +168,7 @@ class Github(delbert.plugin.Plugin):
                 html.json()['status'],
                 html.json()['body'])
 
-    @staticmethod
-    def shorten(url):
+    def shorten(self, url):
         """
         Shorten a github url
 
@@ -125,9 +176,12 @@ class Github(delbert.plugin.Plugin):
         @return     - shortened url
         """
         try:
-            req = requests.post('http://git.io/', data={'url': url})
+            req = self.http.blocking_post(
+                self._gitio_url,
+                data={'url': url},
+                timeout=self._timeout)
             req.raise_for_status()
-        except Exception, e:
+        except Exception as e:
             log.err('Failed to git.io shorten %s: %s' % (url, str(e)))
             return url
 
@@ -166,9 +220,10 @@ class Github(delbert.plugin.Plugin):
 
         msgs = self._push_msgs(repo, data)
 
+        # The summary gets a line of its own, the commits are packed together.
         for channel in channels:
-            for msg in msgs:
-                self._proto.send_notice(channel, msg)
+            self._proto.send_notice(channel, msgs[0])
+            self._proto.send_lines(channel, msgs[1:], notice=True)
 
     def handle_issue(self, data):
         """
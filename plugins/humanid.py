@@ -1,6 +1,6 @@
-import requests
 from twisted.python import log
 
+import delbert.httpclient
 import delbert.plugin
 
 
@@ -8,16 +8,22 @@ class HumanId(delbert.plugin.Plugin):
     def __init__(self, config={}):
         super(HumanId, self).__init__('HumanId')
         self._config = config
+        self._base_url = config.get(
+            'base_url',
+            'https://uz83qtfqh2.execute-api.us-east-1.amazonaws.com/')
+        self._timeout = config.get('timeout', 5)
 
     def get_some(self):
         """
         get a human id
         @return     - a human readable 'unique' id
         """
+        # Every id is new, so they are not cached.
         try:
-            html = requests.get(
-                'https://uz83qtfqh2.execute-api.us-east-1.amazonaws.com/dev')
-        except requests.exceptions.RequestException, e:
+            html = self.http.blocking_get(
+                self._base_url + 'dev',
+                timeout=self._timeout)
+        except delbert.httpclient.RequestError as e:
             log.err(str(e))
             return
 
@@ -1,6 +1,6 @@
-import requests
 from twisted.python import log
 
+import delbert.httpclient
 import delbert.plugin
 
 
@@ -8,6 +8,10 @@ class IsItDown(delbert.plugin.Plugin):
     def __init__(self, config={}):
         super(IsItDown, self).__init__('isitdown')
         self._config = config
+        self._base_url = config.get(
+            'base_url', 'http://downforeveryoneorjustme.com/')
+        self._timeout = config.get('timeout', 10)
+        self._cache_ttl = config.get('cache_ttl', 60)
 
     @staticmethod
     def parse_site(url):
@@ -34,10 +38,12 @@ class IsItDown(delbert.plugin.Plugin):
         @return  - True if the site is up, False otherwise.
         """
         try:
-            html = requests.get(
-                    'http://downforeveryoneorjustme.com/%s' % (url,),
-                    verify=False)
-        except requests.exceptions.RequestException, e:
+            html = self.http.blocking_get(
+                '%s%s' % (self._base_url, url),
+                timeout=self._timeout,
+                cache_ttl=self._cache_ttl,
+                verify=False)
+        except delbert.httpclient.RequestError as e:
             log.err(str(e))
             return False
 
@@ -1,3 +1,4 @@
+import fcntl
 import os
 import re
 import threading
@@ -34,6 +35,11 @@ class Karma(delbert.plugin.Plugin):
                 self._ds = config['ds']
 
         self._karma = {}
+
+        # Channels modified since the last save.  Only these are written back
+        # so bots sharing the data store do not undo each other's changes.
+        self._dirty = set()
+
         self._pos_search = re.compile('(\w+)\+\+(?:\s+|\Z)')
         self._neg_search = re.compile('(\w+)--(?:\s+|\Z)')
 
@@ -43,19 +49,28 @@ class Karma(delbert.plugin.Plugin):
         if self._ds is not None:
             with self._lock:
                 with open(self._ds, 'r') as fp:
-                    self._karma = yaml.load(fp.read())
-            if self._karma is None:
-                self._karma = {}
+                    fcntl.flock(fp, fcntl.LOCK_SH)
+                    karma = yaml.load(fp.read())
 
-    def _modify(self, channel, user, amount):
-        if channel not in self._karma:
-            self._karma[channel] = {}
-        if user not in self._karma[channel]:
-            self._karma[channel][user] = 0
+                if karma is None:
+                    karma = {}
+                for channel in self._dirty:
+                    karma[channel] = self._karma.get(channel, {})
+                self._karma = karma
 
-        self._karma[channel][user] += amount
-        if self._karma[channel][user] == 0:
-            del self._karma[channel][user]
+    def _modify(self, channel, user, amount):
+        # A change made while saving would be lost when the save clears the
+        # dirty channels.
+        with self._lock:
+            self._dirty.add(channel)
+            if channel not in self._karma:
+                self._karma[channel] = {}
+            if user not in self._karma[channel]:
+                self._karma[channel][user] = 0
+
+            self._karma[channel][user] += amount
+            if self._karma[channel][user] == 0:
+                del self._karma[channel][user]
 
     def add(self, channel, thing):
         """
@@ -77,12 +92,29 @@ class Karma(delbert.plugin.Plugin):
 
     def save(self):
         """
-        Save karma to the data store.
+        Save karma to the data store.  Changes made by other bots sharing the
+        data store since it was last read are kept and picked up.
         """
         if self._ds is not None:
             with self._lock:
-                with open(self._ds, 'w') as fp:
-                    yaml.dump(self._karma, fp)
+                with open(self._ds, 'r+') as fp:
+                    fcntl.flock(fp, fcntl.LOCK_EX)
+                    karma = yaml.load(fp.read())
+                    if karma is None:
+                        karma = {}
+
+                    for channel in self._dirty:
+                        if len(self._karma.get(channel, {})):
+                            karma[channel] = self._karma[channel]
+                        else:
+                            karma.pop(channel, None)
+
+                    fp.seek(0)
+                    fp.truncate()
+                    yaml.dump(karma, fp)
+
+                self._karma = karma
+                self._dirty.clear()
 
     def get_karma(self, channel):
         """
@@ -94,7 +126,8 @@ class Karma(delbert.plugin.Plugin):
         return self._karma.get(channel, {})
 
     @delbert.plugin.irc_passive(
-        'check messages for X++ or X-- and modify karma for X')
+        'check messages for X++ or X-- and modify karma for X',
+        substrings=['++', '--'])
     def passive_karma(self, user, channel, msg):
         user = delbert.plugin.get_nick(user)
         pos = re.findall(self._pos_search, msg)
@@ -138,14 +171,18 @@ class Karma(delbert.plugin.Plugin):
 
         send_to = self.send_to(channel, user)
 
+        # Other bots may be keeping karma for other channels.
+        self._refresh()
+
         for c in channels:
             karma = self.get_karma(c)
             if len(karma):
                 self._proto.send_notice(send_to, '%s karma:' % (c,))
-                for nick, value in sorted(karma.items(), key=lambda v: v[1]):
-                    self._proto.send_notice(
-                        send_to,
-                        '    %-20s%d' % (nick + ':', value))
+                self._proto.send_lines(
+                    send_to,
+                    ['%s: %d' % (nick, value) for nick, value in
+                        sorted(karma.items(), key=lambda v: v[1])],
+                    notice=True)
             else:
                 self._proto.send_msg(
                     send_to,
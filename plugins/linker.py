@@ -5,6 +5,7 @@ import requests_oauthlib
 from twisted.python import log
 from bs4 import BeautifulSoup as soup
 
+import delbert.httpclient
 import delbert.plugin
 
 
@@ -15,6 +16,11 @@ class Linker(delbert.plugin.Plugin):
     def __init__(self, config):
         super(Linker, self).__init__('linker')
         self._config = config
+        self._cache_ttl = config.get('cache_ttl', 300)
+        self._timeout = config.get('timeout', 10)
+        self._verify = config.get('verify', False)
+        self._twitter_url = config.get(
+            'twitter_url', 'https://api.twitter.com/1.1/')
         self._twitter_auth = None
         self._url_re = re.compile(
             'http[s]?://(?:[a-zA-Z]|[0-9]|[$-_@.&+#]|[!*\(\),]'
@@ -47,12 +53,23 @@ class Linker(delbert.plugin.Plugin):
         @param msg_id   - id of the tweet.
         @returns        - formatted string representing the tweet.
         """
+        url = '%sstatuses/show/%s.json' % (self._twitter_url, msg_id)
+
+        # Sign the request with requests_oauthlib, then send it with the
+        # shared client.
+        signed = requests.Request('GET', url, auth=self._twitter_auth)
+        headers = dict(
+            (k, v) for k, v in signed.prepare().headers.items()
+            if k == 'Authorization')
+
         try:
-            url = 'https://api.twitter.com/1.1/statuses/show/%s.json' % (
-                msg_id,)
-            html = requests.get(url, auth=self._twitter_auth)
+            html = self.http.blocking_get(
+                url,
+                headers=headers,
+                timeout=self._timeout,
+                cache_ttl=self._cache_ttl)
             html.raise_for_status()
-        except requests.exceptions.RequestException, e:
+        except delbert.httpclient.RequestError as e:
             log.err("Couldn't get tweet %s: %s" % (msg_id, str(e)))
             return
 
@@ -69,20 +86,31 @@ class Linker(delbert.plugin.Plugin):
         will first be followed before pulling the title.  Image and pdf links
         will be ignored.
 
+        The page is fetched with the shared http client, so the same link
+        pasted in several channels at once is only fetched once.  Must not be
+        called from the reactor thread.  Certificates are not verified unless
+        the verify option is set, titles of sites with broken certificates
+        are still shown.
+
         @param url  - url to pull title for.
         @return     - title if found.
         """
         while True:
             try:
-                html = requests.get(url, verify=False)
+                html = self.http.blocking_get(
+                    url,
+                    timeout=self._timeout,
+                    cache_ttl=self._cache_ttl,
+                    verify=self._verify)
                 html.raise_for_status()
-            except requests.exceptions.RequestException, e:
+            except delbert.httpclient.RequestError as e:
                 log.err(str(e))
                 return
 
-            if html.headers['content-type'].startswith('image'):
+            content_type = html.headers.get('content-type', '')
+            if content_type.startswith('image'):
                 return
-            elif html.headers['content-type'].startswith('application/pdf'):
+            elif content_type.startswith('application/pdf'):
                 return
             else:
                 parsed = soup(html.text, 'html.parser')
@@ -111,7 +139,9 @@ class Linker(delbert.plugin.Plugin):
             url = redirect['content'].split('url=')[1]
             return url
 
-    @delbert.plugin.irc_passive('get more information about links')
+    @delbert.plugin.irc_passive(
+        'get more information about links',
+        substrings=['http://', 'https://'])
     def linker(self, user, channel, msg):
         urls = self._url_re.findall(msg)
         for url in urls:
@@ -33,6 +33,12 @@ class Source(delbert.plugin.Plugin):
         self._pre_verbs = config.get('pre_verbs', pre_verbs)
         self._post_verbs = config.get('post_verbs', post_verbs)
 
+        # Both searches need one of the verbs, they are matched as regular
+        # expressions just like in _searches().
+        self.set_triggers(
+            'request',
+            regex='|'.join(self._pre_verbs + self._post_verbs))
+
         responses = [
             'Put a little effort in jerky',
             'Oh yeah?  Bring it right here',
@@ -43,29 +49,37 @@ class Source(delbert.plugin.Plugin):
         ]
         self._responses = config.get('responses', responses)
 
-        self._pre_re = None
-        self._post_re = None
+        # Mapping of bot nickname to searches, the nickname can differ
+        # between networks.
+        self._searches = {}
 
         if seed:
             random.seed(seed)
         else:
             random.seed()
 
-    def initialize(self, nickname, proto):
-        super(Source, self).initialize(nickname, proto)
-        pre = '|'.join(self._pre_verbs)
-        post = '|'.join(self._post_verbs)
-        self._pre_re = re.compile('((%s)\s+)%s(\s+|$)' % (pre, nickname))
-        self._post_re = re.compile('(^|\s+)%s(\s+(%s)\s)' % (nickname, post))
+    def _get_searches(self, nickname):
+        """
+        Get the searches matching requests made to the bot.
+
+        @param nickname - nickname of the bot.
+        @return         - tuple of compiled (pre, post) searches.
+        """
+        if nickname not in self._searches:
+            pre = '|'.join(self._pre_verbs)
+            post = '|'.join(self._post_verbs)
+            self._searches[nickname] = (
+                re.compile('((%s)\s+)%s(\s+|$)' % (pre, nickname)),
+                re.compile('(^|\s+)%s(\s+(%s)\s)' % (nickname, post)))
+        return self._searches[nickname]
 
     @delbert.plugin.irc_passive('help user with feature request')
     def request(self, user, channel, msg):
-        search = None
+        pre_re, post_re = self._get_searches(self.nickname)
 
-        if self._pre_re is not None:
-            search = self._pre_re.search(msg)
-        if search is None and self._post_re is not None:
-            search = self._post_re.search(msg)
+        search = pre_re.search(msg)
+        if search is None:
+            search = post_re.search(msg)
 
         if search is not None:
             self._proto.send_msg(
@@ -1,6 +1,6 @@
-import requests
 from twisted.python import log
 
+import delbert.httpclient
 import delbert.plugin
 
 
@@ -8,6 +8,8 @@ class Startup(delbert.plugin.Plugin):
     def __init__(self, config={}):
         super(Startup, self).__init__('startup')
         self._config = config
+        self._base_url = config.get('base_url', 'http://itsthisforthat.com/')
+        self._timeout = config.get('timeout', 5)
 
     def query_startup(self):
         """
@@ -15,11 +17,13 @@ class Startup(delbert.plugin.Plugin):
 
         @return  - a pretty sweet business idea bro!
         """
+        # Every idea is random, so they are not cached.
         try:
-            html = requests.get(
-                'http://itsthisforthat.com/api.php?text',
+            html = self.http.blocking_get(
+                self._base_url + 'api.php?text',
+                timeout=self._timeout,
                 verify=False)
-        except requests.exceptions.RequestException, e:
+        except delbert.httpclient.RequestError as e:
             log.err(str(e))
             return
 
@@ -1,7 +1,7 @@
-import requests
-
+from twisted.internet import defer
 from twisted.python import log
 
+import delbert.httpclient
 import delbert.plugin
 
 
@@ -12,9 +12,12 @@ class InvalidSymbolError(Exception):
 class Stocks(delbert.plugin.Plugin):
     def __init__(self, config=None):
         super(Stocks, self).__init__('stocks')
-        self._base_url = 'http://dev.markitondemand.com/Api/v2/'
         self._config = config if config is not None else {}
+        self._base_url = self._config.get(
+            'base_url', 'http://dev.markitondemand.com/Api/v2/')
+        self._cache_ttl = self._config.get('cache_ttl', 60)
 
+    @defer.inlineCallbacks
     def get_quote(self, symbol):
         """
         Get a stock quote for the specified symbol.  Return is a dictionary
@@ -22,12 +25,14 @@ class Stocks(delbert.plugin.Plugin):
         http://dev.markitondemand.com/#doc_quote
 
         @param symbol   - symbol for which to lookup quote
-        @return         - stock quote
+        @return         - Deferred firing with the stock quote
         """
         try:
-            url = self._base_url + 'Quote/json?symbol=%s' % (symbol,)
-            html = requests.get(url, verify=False)
-        except requests.exceptions.RequestException, e:
+            html = yield self.http.get(
+                self._base_url + 'Quote/json',
+                params={'symbol': symbol},
+                cache_ttl=self._cache_ttl)
+        except delbert.httpclient.RequestError as e:
             log.err(str(e))
             return
 
@@ -36,24 +41,30 @@ class Stocks(delbert.plugin.Plugin):
         if ret.get('Message', '').startswith('No symbol matches found for '):
             raise InvalidSymbolError()
 
-        return html.json()
+        defer.returnValue(ret)
 
     @delbert.plugin.irc_command(
         'Lookup the current quote for the specified ticker symbol')
     def quote(self, user, channel, args):
         log.msg('Pulling quotes for symbols: %s' % (','.join(args.split())))
 
-        for arg in args.split():
+        # Request every quote at once, but reply in the order asked for.
+        quotes = [(arg, self.get_quote(arg)) for arg in args.split()]
+
+        for arg, d in quotes:
             try:
-                quote = self.get_quote(arg)
+                quote = yield d
             except InvalidSymbolError:
                 msg = 'Invalid Symbol %s' % (arg,)
             else:
-                msg = '%s [%s], %.2f, %.2f(%.2f%%)' % (
-                        quote['Name'],
-                        quote['Symbol'],
-                        quote['LastPrice'],
-                        quote['Change'],
-                        quote['ChangePercent'])
+                if quote is None:
+                    msg = 'Failed to get a quote for %s' % (arg,)
+                else:
+                    msg = '%s [%s], %.2f, %.2f(%.2f%%)' % (
+                            quote['Name'],
+                            quote['Symbol'],
+                            quote['LastPrice'],
+                            quote['Change'],
+                            quote['ChangePercent'])
 
             self._proto.send_msg(self.send_to(channel, user), msg)
@@ -1,8 +1,9 @@
 import urllib
 
-import requests
+from twisted.internet import defer
 from twisted.python import log
 
+import delbert.httpclient
 import delbert.plugin
 
 
@@ -14,24 +15,36 @@ class UrbanDictionary(delbert.plugin.Plugin):
     def __init__(self, config={}):
         super(UrbanDictionary, self).__init__('UrbanDictionary')
         self._config = config
+        self._cache_ttl = config.get('cache_ttl', 3600)
+        self._negative_ttl = config.get('negative_ttl', 600)
+        self._base_url = config.get(
+            'base_url', 'http://api.urbandictionary.com/v0/')
 
+    @staticmethod
+    def _no_definition(resp):
+        return not len(resp.json().get('list', []))
+
+    @defer.inlineCallbacks
     def query(self, term):
         """
         Query urban dictionary for a definition
 
         @param term - word to lookup on urban dictionary
-        @return     - the top definition for the term
+        @return     - Deferred firing with the top definition for the term
         """
         try:
-            html = requests.get(
-                'http://api.urbandictionary.com/v0/define?term=%s' % (term,))
-        except requests.exceptions.RequestException, e:
+            html = yield self.http.get(
+                '%sdefine?term=%s' % (self._base_url, term),
+                cache_ttl=self._cache_ttl,
+                negative_ttl=self._negative_ttl,
+                negative=self._no_definition)
+        except delbert.httpclient.RequestError as e:
             log.err(str(e))
             return
 
         ret = html.json()
         if 'list' in ret and len(ret['list']):
-            return ret['list'][0]['definition']
+            defer.returnValue(ret['list'][0]['definition'])
         else:
             raise NoDefinition()
 
@@ -46,7 +59,7 @@ class UrbanDictionary(delbert.plugin.Plugin):
         else:
             terms = '+'.join(urllib.quote(t) for t in args.split())
             try:
-                definition = self.query(terms)
+                definition = yield self.query(terms)
                 self._proto.send_msg(send_to, '%s:  %s' % (
                     args,
                     definition))
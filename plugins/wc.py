@@ -1,16 +1,20 @@
-import requests
-
 import delbert.plugin
 
 
 class WorldCup(delbert.plugin.Plugin):
     def __init__(self, config={}):
         super(WorldCup, self).__init__('wc')
+        self._base_url = config.get('base_url', 'http://worldcup.sfg.io/')
+        self._timeout = config.get('timeout', 5)
+        self._cache_ttl = config.get('cache_ttl', 30)
 
     @delbert.plugin.irc_command('Get current score from world cup')
     def wc(self, user, channel, args):
         try:
-            response = requests.get('http://worldcup.sfg.io/matches/current')
+            response = self.http.blocking_get(
+                self._base_url + 'matches/current',
+                timeout=self._timeout,
+                cache_ttl=self._cache_ttl)
             results = response.json()
             for result in results:
                 away_team = result['away_team']['country']
@@ -1,8 +1,8 @@
 import errno
 
-import requests
 from twisted.python import log
 
+import delbert.httpclient
 import delbert.plugin
 
 
@@ -14,14 +14,25 @@ class Weather(delbert.plugin.Plugin):
     def __init__(self, config={}):
         super(Weather, self).__init__('weather')
         self._api_key = None
+        self._api_url = config.get(
+            'api_url', 'http://api.wunderground.com/api/')
+        self._autocomplete_url = config.get(
+            'autocomplete_url', 'http://autocomplete.wunderground.com/')
+        self._geoip_url = config.get(
+            'geoip_url', 'http://www.telize.com/geoip/')
+        self._timeout = config.get('timeout', 10)
+
+        # Seconds conditions and forecasts are cached for, locations change
+        # far less often.
+        self._cache_ttl = config.get('cache_ttl', 600)
+        self._location_ttl = config.get('location_ttl', 86400)
 
         if 'api_key' in config:
             self._api_key = config['api_key']
         else:
             log.err('No "weather.api_key" specified in config')
 
-    @staticmethod
-    def geoip(ip):
+    def geoip(self, ip):
         """
         Lookup a physical location based on ip address.
 
@@ -29,16 +40,18 @@ class Weather(delbert.plugin.Plugin):
         @return     - tuple (region_code, city) based on ip address.
         """
         try:
-            req = requests.get('http://www.telize.com/geoip/%s' % (ip,))
+            req = self.http.blocking_get(
+                '%s%s' % (self._geoip_url, ip),
+                timeout=self._timeout,
+                cache_ttl=self._location_ttl)
             req.raise_for_status()
-        except requests.exceptions.RequestException, e:
+        except delbert.httpclient.RequestError as e:
             log.err('Failed to get location for %s: %s' % (ip, str(e)))
             raise IOError(errno.EIO, 'Failed to get location for %s' % (ip,))
 
         return (req.json()['region_code'], req.json()['city'])
 
-    @staticmethod
-    def autocomplete(string):
+    def autocomplete(self, string):
         """
         Autocomplete a string to the best fit location.
 
@@ -46,11 +59,13 @@ class Weather(delbert.plugin.Plugin):
         @return         - best fit location based on specified string.
         """
         try:
-            req = requests.get(
-                'http://autocomplete.wunderground.com/aq',
-                params={'query': string})
+            req = self.http.blocking_get(
+                self._autocomplete_url + 'aq',
+                params={'query': string},
+                timeout=self._timeout,
+                cache_ttl=self._location_ttl)
             req.raise_for_status()
-        except requests.exceptions.RequestException, e:
+        except delbert.httpclient.RequestError as e:
             log.err('Failed to autocomplete "%s": %s' % (string, str(e)))
             raise IOError(errno.EIO, 'Failed to autocomplete "%s"' % (string,))
 
@@ -68,15 +83,18 @@ class Weather(delbert.plugin.Plugin):
         @return     - mapping of weather types to current conditions.
         """
         try:
-            url = 'http://api.wunderground.com/api/%s/conditions%s.json' % (
-                    self._api_key, location)
+            url = '%s%s/conditions%s.json' % (
+                    self._api_url, self._api_key, location)
         except IOError:
             return
 
         try:
-            req = requests.get(url)
+            req = self.http.blocking_get(
+                url,
+                timeout=self._timeout,
+                cache_ttl=self._cache_ttl)
             req.raise_for_status()
-        except requests.exceptions.RequestException, e:
+        except delbert.httpclient.RequestError as e:
             log.err(str(e))
             return
 
@@ -91,15 +109,18 @@ class Weather(delbert.plugin.Plugin):
                           http://www.wunderground.com/weather/api/d/docs?d=data/forecast&MR=1
         """
         try:
-            url = 'http://api.wunderground.com/api/%s/forecast%s.json' % (
-                    self._api_key, location)
+            url = '%s%s/forecast%s.json' % (
+                    self._api_url, self._api_key, location)
         except IOError:
             return
 
         try:
-            req = requests.get(url)
+            req = self.http.blocking_get(
+                url,
+                timeout=self._timeout,
+                cache_ttl=self._cache_ttl)
             req.raise_for_status()
-        except requests.exceptions.RequestException as e:
+        except delbert.httpclient.RequestError as e:
             log.err(str(e))
             return
 
@@ -204,11 +225,12 @@ class Weather(delbert.plugin.Plugin):
         except IOError:
             self._proto.send_msg(send_to, 'Nope, no forecast for you')
 
-        for day in forecast['txt_forecast']['forecastday']:
-            try:
-                self._proto.send_notice(
-                    send_to,
-                    '%-15s %s' % (day['title'] + ':', day['fcttext']))
-            except KeyError as e:
-                log.err('Failed to parse %s: %s' % (forecast, e))
-                return
+        try:
+            days = [
+                '%s %s' % (day['title'] + ':', day['fcttext'])
+                for day in forecast['txt_forecast']['forecastday']]
+        except KeyError as e:
+            log.err('Failed to parse %s: %s' % (forecast, e))
+            return
+
+        self._proto.send_lines(send_to, days, notice=True)
@@ -1,8 +1,8 @@
 import random
 
-import requests
 from twisted.python import log
 
+import delbert.httpclient
 import delbert.plugin
 
 
@@ -11,6 +11,8 @@ class YesNo(delbert.plugin.Plugin):
         super(YesNo, self).__init__('yesno')
         self._config = config
         self._chance = config.get('chance', 0.01)
+        self._base_url = config.get('base_url', 'http://yesno.wtf/')
+        self._timeout = config.get('timeout', 5)
 
     def query(self):
         """
@@ -19,9 +21,12 @@ class YesNo(delbert.plugin.Plugin):
         @return - Tuple of the answer and url to a demostration
 
         """
+        # Every answer is random, so they are not cached.
         try:
-            html = requests.get('http://yesno.wtf/api')
-        except requests.exceptions.RequestException, e:
+            html = self.http.blocking_get(
+                self._base_url + 'api',
+                timeout=self._timeout)
+        except delbert.httpclient.RequestError as e:
             log.err(str(e))
             return False
 
@@ -34,7 +39,9 @@ class YesNo(delbert.plugin.Plugin):
         msg = '%s! (%s)' % (answer.upper(), image)
         self._proto.send_msg(self.send_to(channel, user), msg)
 
-    @delbert.plugin.irc_passive('Provide answers to the important questions')
+    @delbert.plugin.irc_passive(
+        'Provide answers to the important questions',
+        substrings=['?'])
     def provide_answers(self, user, channel, msg):
         words = msg.strip().split()
         chances = sum(word.endswith('?') for word in words)
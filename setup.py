@@ -26,7 +26,7 @@ setuptools.setup(
             '': ['*.rst', 'db/*', 'LICENSE'],
         },
         scripts=scripts,
-        install_requires=['beautifulsoup', 'pyyaml', 'requests', 'requests-oauthlib', 'twisted',],
+        install_requires=['beautifulsoup', 'pyyaml', 'requests', 'requests-oauthlib', 'twisted[tls]',],
         classifiers=[
             'Development Status :: 3 - Alpha',
             'Environment :: Console',
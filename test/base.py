@@ -6,12 +6,17 @@ import re
 import sys
 import unittest
 
+import requests
 import responses
 
+from twisted.internet import defer
+from twisted.python import failure
+
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
 import delbert.bot
 import delbert.channels
+import delbert.httpclient
 
 plugin_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), '../plugins'))
 
@@ -56,16 +61,72 @@ def load_plugin_and_excs(name, obj_name, config={}, *args, **kwds):
     excs = {symbol:cls for symbol, cls in env.items() if inspect.isclass(cls) and issubclass(cls, Exception)}
     return (plugin, excs)
 
+class RequestsHTTP(object):
+    """
+    Stand in for delbert.httpclient.HTTPClient which makes synchronous
+    requests with the requests module, so they can be mocked with responses.
+    """
+    def request(self, method, url, params=None, data=None, headers=None,
+                **kwds):
+        try:
+            r = requests.request(
+                method,
+                delbert.httpclient.HTTPClient.build_url(url, params),
+                data=data,
+                headers=headers,
+                verify=kwds.get('verify', True))
+        except requests.exceptions.RequestException, e:
+            return defer.fail(delbert.httpclient.RequestError(str(e)))
+
+        headers = dict((k.lower(), v) for k, v in r.headers.items())
+        return defer.succeed(delbert.httpclient.Response(
+            r.url, r.status_code, headers, r.content))
+
+    def get(self, url, **kwds):
+        return self.request('GET', url, **kwds)
+
+    def blocking_get(self, url, **kwds):
+        return result_of(self.get(url, **kwds))
+
+    def post(self, url, **kwds):
+        return self.request('POST', url, **kwds)
+
+    def blocking_post(self, url, **kwds):
+        return result_of(self.post(url, **kwds))
+
+def result_of(d):
+    """
+    Get the result of a Deferred that has already fired.  Failures are
+    raised.
+
+    @param d    - Deferred to get the result of.
+    @return     - result of the Deferred.
+    """
+    results = []
+
+    def collect(result):
+        results.append(result)
+        if not isinstance(result, failure.Failure):
+            return result
+
+    d.addBoth(collect)
+    if not len(results):
+        raise AssertionError('%r has not fired' % (d,))
+
+    if isinstance(results[0], failure.Failure):
+        results[0].raiseException()
+    return results[0]
+
 class TestProto(delbert.bot.BotProtocol):
     def __init__(self, plugins):
         priv_channel = delbert.channels.Channel(TEST_NICK, {})
-        _ = [priv_channel.register_plugin(p) for p in plugins]
+        priv_channel.set_plugins(plugins)
 
         channel_map = {
             TEST_CHANNEL: TestChannel(plugins),
             TEST_NICK: priv_channel,
         }
-        _ = [p.initialize(TEST_NICK, self) for p in plugins]
+        _ = [p.initialize(TEST_NICK, self, RequestsHTTP()) for p in plugins]
         self._msgs = []
         delbert.bot.BotProtocol.__init__(self, TEST_NICK, 'pw', channel_map)
 
@@ -79,8 +140,14 @@ class TestProto(delbert.bot.BotProtocol):
     def _call(self, *args, **kwds):
         _ = kwds.pop('cb', None)
         _ = kwds.pop('eb', None)
+        _ = kwds.pop('priority', None)
+        release = kwds.pop('release', None)
 
-        args[0](*args[1:], **kwds)
+        try:
+            args[0](*args[1:], **kwds)
+        finally:
+            if release is not None:
+                release(None)
 
     def send_msg(self, channel, msg):
         self._msgs.append(('msg', channel, msg))
@@ -96,7 +163,7 @@ class TestChannel(delbert.channels.Channel):
             },
         }
         super(TestChannel, self).__init__(TEST_CHANNEL, config)
-        _ = [self.register_plugin(p) for p in plugins]
+        self.set_plugins(plugins)
 
 def net_test(func):
     net_tests = os.environ.get('DELBERT_RUN_NET_TESTS') is not None
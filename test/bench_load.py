@@ -0,0 +1,169 @@
+"""
+Load test the bot end to end against a fake IRC server on localhost.  A real
+BotFactory connects to the server, joins the channels, and simulated users
+chat in them and send it commands.
+
+    python test/bench_load.py [-c CHANNELS] [-u USERS] [-r RATE] [-d SECONDS]
+                              [-e COMMAND_EVERY] [--bot-rate RATE]
+                              [--bot-burst N] [--server-rate RATE]
+                              [--server-burst N] [--plugins] [--command CMD]
+
+RATE is the messages per second sent by each user.  By default the bot runs
+an echo plugin, --plugins loads the plugins directory instead, in which case
+--command should name a command answered with a single line.
+
+Reports, as json, the replies received, the commands left unanswered, the
+lines dropped by the server's flood limit, and the p50/p99/max time between a
+command being sent and its reply arriving.
+"""
+import getopt
+import json
+import os
+import sys
+import tempfile
+
+from twisted.internet import defer, reactor
+
+sys.path.insert(
+    0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import delbert.bot  # noqa: E402
+import delbert.plugin  # noqa: E402
+import ircd  # noqa: E402
+
+NICK = 'delbert'
+
+
+class EchoPlugin(delbert.plugin.Plugin):
+    def __init__(self, config=None):
+        super(EchoPlugin, self).__init__('echo')
+
+    @delbert.plugin.irc_command('echo the arguments', deferred=True)
+    def echo(self, user, channel, args):
+        self._proto.send_msg(channel, args)
+        return defer.succeed(None)
+
+
+def run(options):
+    server = ircd.IRCServer(
+        options['server_rate'],
+        options['server_burst'])
+    port = ircd.listen(server).getHost().port
+
+    channels = ['#c%d' % (i,) for i in range(options['channels'])]
+    config = {
+        'nick': NICK,
+        'pass': 'pw',
+        'dbdir': tempfile.mkdtemp(),
+        'server': '127.0.0.1',
+        'port': port,
+        'channels': dict((c, None) for c in channels),
+        'flood': {
+            'rate': options['bot_rate'],
+            'burst': options['bot_burst'],
+        },
+        'sasl': False,
+    }
+
+    plugins = None if options['plugins'] else [EchoPlugin()]
+    bot = delbert.bot.BotFactory(config, plugins=plugins)
+    reactor.connectTCP('127.0.0.1', port, bot)
+
+    generator = ircd.LoadGenerator(
+        server,
+        NICK,
+        channels,
+        options['users'],
+        options['rate'],
+        options['command'],
+        options['command_every'])
+
+    def joined(_):
+        generator.start()
+        reactor.callLater(options['duration'], finish)
+
+    def finish():
+        generator.stop()
+
+        # Give the bot time to answer the last commands.
+        reactor.callLater(options['drain'], report)
+
+    def report():
+        results = generator.results()
+        results['duration'] = options['duration']
+        print json.dumps(results, indent=2, sort_keys=True)
+        bot.stopTrying()
+        reactor.stop()
+
+    server.wait_for_joins(len(channels)).addCallback(joined)
+    reactor.run()
+
+
+def usage():
+    print __doc__
+
+
+def main():
+    try:
+        opts, _ = getopt.getopt(
+            sys.argv[1:],
+            'hc:u:r:d:e:',
+            [
+                'bot-rate=',
+                'bot-burst=',
+                'server-rate=',
+                'server-burst=',
+                'plugins',
+                'command=',
+            ])
+    except getopt.GetoptError, e:
+        print str(e)
+        sys.exit(1)
+
+    options = {
+        'channels': 10,
+        'users': 50,
+        'rate': 0.1,
+        'duration': 30,
+        'drain': 10,
+        'command_every': 20,
+        'bot_rate': 2.0,
+        'bot_burst': 5,
+        'server_rate': 2.0,
+        'server_burst': 5,
+        'plugins': False,
+        'command': '!echo',
+    }
+
+    for o, a in opts:
+        if o == '-h':
+            usage()
+            sys.exit(0)
+        elif o == '-c':
+            options['channels'] = int(a)
+        elif o == '-u':
+            options['users'] = int(a)
+        elif o == '-r':
+            options['rate'] = float(a)
+        elif o == '-d':
+            options['duration'] = float(a)
+        elif o == '-e':
+            options['command_every'] = int(a)
+        elif o == '--bot-rate':
+            options['bot_rate'] = float(a)
+        elif o == '--bot-burst':
+            options['bot_burst'] = int(a)
+        elif o == '--server-rate':
+            options['server_rate'] = float(a)
+        elif o == '--server-burst':
+            options['server_burst'] = int(a)
+        elif o == '--plugins':
+            options['plugins'] = True
+        elif o == '--command':
+            options['command'] = a
+
+    run(options)
+
+
+if __name__ == '__main__':
+    main()
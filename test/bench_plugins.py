@@ -0,0 +1,358 @@
+"""
+Benchmark the handlers of the plugins.  A corpus of channel lines is pushed
+through each passive, and each command is run repeatedly, on a TestProto
+with the http requests of the plugins answered from the upstream fixtures.
+
+    python test/bench_plugins.py [-f CORPUS] [-n LINES] [-i ITERATIONS]
+                                 [-o OUTPUT]
+
+CORPUS is a file with one channel message per line, by default a synthetic
+corpus of chatter, questions, karma, links and requests to the bot is used.
+
+Reports, as json, for every passive and command:
+    ops_per_second      - lines, or commands, handled per second of cpu.
+    calls               - times the handler was run, passives only run on
+                          lines matching their triggers.
+    replies             - lines sent by the handler.
+    errors              - handlers raising an exception.
+    gc_objects_per_call - net container objects allocated per call.  Python
+                          2 has no allocation tracer, so objects freed while
+                          handling a line are not counted.
+    regex_seconds       - time spent in regular expressions, triggers
+                          included, measured in a separate profiled run.
+"""
+import cProfile
+import gc
+import getopt
+import json
+import os
+import pstats
+import random
+import re
+import shutil
+import sys
+import tempfile
+import time
+import urlparse
+
+import responses
+
+import base
+import upstream
+
+TEST_USER = 'user!u@host'
+
+WORDS = [
+    'the', 'build', 'is', 'broken', 'again', 'deploy', 'looks', 'fine',
+    'lunch', 'anyone', 'review', 'my', 'patch', 'please', 'tests', 'pass',
+    'locally', 'why', 'does', 'this', 'keep', 'failing', 'she', 'said',
+    'russia', 'healthcare', 'spelling', 'ffs', 'delbert', 'ok', 'thanks',
+]
+
+LINKS = [
+    'http://example.com/',
+    'https://github.com/jsbronder/delbert/pull/%d',
+    'http://www.example.org/articles/%d.html',
+    'https://twitter.com/user/status/%d',
+]
+
+# Commands run by the benchmark and their arguments.
+COMMANDS = {
+    'cah': '',
+    'excuse': '',
+    'forecast': 'Boston, MA',
+    'github': '',
+    'humanid': '',
+    'isitdown': 'example.com',
+    'karma': '',
+    'quote': 'AAPL',
+    'source': '',
+    'sprint': '',
+    'startup': '',
+    'ud': 'test',
+    'wc': '',
+    'weather': 'Boston, MA',
+    'yesno': '',
+}
+
+PAGE = '<html><head><title>Example page</title></head><body></body></html>'
+
+
+def plugin_configs(dbdir):
+    """
+    @param dbdir    - directory for data stores written by the plugins.
+    @return         - list of (file, class, config, extra keyword arguments)
+                      of the plugins to benchmark.
+    """
+    db = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'db')
+    return [
+        ('cah.py', 'CardsAgainstHumanity', {
+            'white': os.path.join(db, 'cah-white.txt'),
+            'black': os.path.join(db, 'cah-black.txt'),
+        }, {'seed': 0}),
+        ('excuses.py', 'Excuses', {}, {}),
+        ('github.py', 'Github', {}, {}),
+        ('humanid.py', 'HumanId', {}, {}),
+        ('isitdown.py', 'IsItDown', {}, {}),
+        ('karma.py', 'Karma', {
+            'ds': os.path.join(dbdir, 'karma.yaml'),
+        }, {'seed': 0}),
+        ('linker.py', 'Linker', {}, {}),
+        ('source.py', 'Source', {}, {'seed': 0}),
+        ('sprint.py', 'SprintGoals', {
+            'sprint': os.path.join(db, 'sprint.yaml'),
+        }, {'seed': 0}),
+        ('startup.py', 'Startup', {}, {}),
+        ('stocks.py', 'Stocks', {}, {}),
+        ('trump.py', 'Trump', {}, {'seed': 0}),
+        ('urban_dictionary.py', 'UrbanDictionary', {}, {}),
+        ('wc.py', 'WorldCup', {}, {}),
+        ('weather.py', 'Weather', {'api_key': 'key'}, {}),
+        ('yesno.py', 'YesNo', {}, {}),
+    ]
+
+
+def synthetic(lines, seed=0):
+    """
+    Generate channel messages: mostly chatter, with questions, karma, links
+    and requests to the bot mixed in.
+
+    @return - list of messages.
+    """
+    rand = random.Random(seed)
+
+    def chatter(n):
+        return ' '.join(rand.choice(WORDS) for _ in range(n))
+
+    corpus = []
+    for i in range(lines):
+        kind = rand.random()
+        if kind < 0.08:
+            corpus.append('%s %s?' % (chatter(6), rand.choice(WORDS)))
+        elif kind < 0.12:
+            corpus.append('%s%s %s' % (
+                rand.choice(['bob', 'alice', 'jenkins', 'coffee']),
+                rand.choice(['++', '--']),
+                chatter(3)))
+        elif kind < 0.14:
+            # Triggers the karma passive without changing any.
+            corpus.append('%s c++ and --verbose' % (chatter(4),))
+        elif kind < 0.18:
+            link = rand.choice(LINKS)
+            if '%d' in link:
+                link = link % (rand.randrange(20),)
+            corpus.append('%s %s' % (chatter(3), link))
+        elif kind < 0.20:
+            corpus.append(rand.choice([
+                '%s should add a %s command',
+                'can you make %s %s',
+            ]) % (base.TEST_NICK, rand.choice(WORDS)))
+        else:
+            corpus.append(chatter(rand.randrange(3, 15)))
+    return corpus
+
+
+def read_corpus(path):
+    with open(path) as f:
+        return [line.rstrip('\r\n') for line in f if line.strip()]
+
+
+class Upstream(object):
+    """
+    Answer the requests of the plugins from the upstream fixtures, requests
+    to other sites get a plain html page.
+    """
+    def __init__(self):
+        self._fixtures = upstream.Fixtures(
+            upstream.DEFAULT_FIXTURES)
+        self.requests = 0
+
+    def __call__(self, request):
+        self.requests += 1
+        url = urlparse.urlsplit(request.url)
+        for service, base_url in upstream.SERVICES.items():
+            prefix = urlparse.urlsplit(base_url)
+            if url.netloc != prefix.netloc:
+                continue
+            path = url.path[len(prefix.path) - 1:]
+            found = self._fixtures.find(
+                service, request.method, path, url.query)
+            if found is not None:
+                return found
+        return 200, {'content-type': 'text/html'}, PAGE
+
+
+def handlers(plugin, kind):
+    return sorted(getattr(plugin, kind).items())
+
+
+def measure(proto, run, items, calls):
+    """
+    Run a handler over some items, once timed and once profiled.
+
+    @param proto    - TestProto the handler sends its replies to.
+    @param run      - function called with each item.
+    @param items    - items to handle.
+    @param calls    - number of items the handler runs for.
+    @return         - dict of results.
+    """
+    errors = 0
+
+    gc.collect()
+    gc.disable()
+    objects = len(gc.get_objects())
+    start = time.clock()
+    try:
+        for item in items:
+            try:
+                run(item)
+            except Exception:
+                errors += 1
+        elapsed = time.clock() - start
+        objects = len(gc.get_objects()) - objects
+    finally:
+        gc.enable()
+
+    replies = len(proto.msgs)
+    proto.clear()
+
+    profile = cProfile.Profile()
+    profile.enable()
+    for item in items:
+        try:
+            run(item)
+        except Exception:
+            pass
+    profile.disable()
+
+    return {
+        'ops_per_second': len(items) / elapsed if elapsed else None,
+        'calls': calls,
+        'errors': errors,
+        'replies': replies,
+        'gc_objects_per_call': float(objects) / calls if calls else None,
+        'regex_seconds': regex_seconds(profile),
+    }
+
+
+def regex_seconds(profile):
+    """
+    Sum the time spent in the re module and in compiled patterns.
+    """
+    stats = pstats.Stats(profile).stats
+    total = 0.0
+    for (filename, _, name), (_, _, tottime, _, _) in stats.items():
+        if os.path.basename(filename) in ('re.py', 'sre_compile.py',
+                                          'sre_parse.py'):
+            total += tottime
+        elif '_sre.SRE_' in name:
+            total += tottime
+    return total
+
+
+def bench_passive(plugin, name, corpus):
+    proto = base.TestProto([plugin])
+    channel = proto._channels[base.TEST_CHANNEL]
+    passive = plugin.passives[name]
+    calls = sum(
+        any(f is passive for _, f in channel.match_passives(msg))
+        for msg in corpus)
+
+    def run(msg):
+        proto.privmsg(TEST_USER, base.TEST_CHANNEL, msg)
+
+    result = measure(proto, run, corpus, calls)
+    result['triggers'] = plugin.triggers.get(name)
+    return result
+
+
+def bench_command(plugin, name, args, iterations):
+    proto = base.TestProto([plugin])
+    msg = '!%s %s' % (name, args)
+
+    def run(_):
+        proto.privmsg(TEST_USER, base.TEST_CHANNEL, msg.strip())
+
+    return measure(proto, run, range(iterations), iterations)
+
+
+def run(corpus, iterations):
+    dbdir = tempfile.mkdtemp()
+    server = Upstream()
+    results = {'passives': {}, 'commands': {}}
+
+    try:
+        with responses.RequestsMock(
+                assert_all_requests_are_fired=False) as mock:
+            for method in (responses.GET, responses.POST):
+                mock.add_callback(method, re.compile('.*'), server)
+
+            for pfile, cls, config, kwds in plugin_configs(dbdir):
+                plugin = base.load_plugin(pfile, cls, config, **kwds)
+                for name, _ in handlers(plugin, 'passives'):
+                    results['passives']['%s.%s' % (plugin.name, name)] = (
+                        bench_passive(plugin, name, corpus))
+                for name, _ in handlers(plugin, 'commands'):
+                    if name not in COMMANDS:
+                        continue
+                    results['commands']['%s.%s' % (plugin.name, name)] = (
+                        bench_command(
+                            plugin, name, COMMANDS[name], iterations))
+                plugin.shutdown()
+    finally:
+        shutil.rmtree(dbdir)
+
+    results['lines'] = len(corpus)
+    results['iterations'] = iterations
+    results['http_requests'] = server.requests
+    return results
+
+
+def usage():
+    print __doc__
+
+
+def main():
+    try:
+        opts, _ = getopt.getopt(sys.argv[1:], 'hf:n:i:o:')
+    except getopt.GetoptError, e:
+        print str(e)
+        sys.exit(1)
+
+    corpus_file = None
+    lines = 20000
+    iterations = 200
+    output = None
+
+    for o, a in opts:
+        if o == '-h':
+            usage()
+            sys.exit(0)
+        elif o == '-f':
+            corpus_file = a
+        elif o == '-n':
+            lines = int(a)
+        elif o == '-i':
+            iterations = int(a)
+        elif o == '-o':
+            output = a
+
+    if corpus_file is not None:
+        corpus = read_corpus(corpus_file)
+    else:
+        corpus = synthetic(lines)
+
+    if not len(corpus):
+        print 'Empty corpus'
+        sys.exit(1)
+
+    report = json.dumps(run(corpus, iterations), indent=2, sort_keys=True)
+    if output is None:
+        print report
+    else:
+        with open(output, 'w') as f:
+            f.write(report + '\n')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,270 @@
+"""
+Replay irc traffic through a BotProtocol to measure dispatch and scheduling.
+The traffic is either a log written with 'delbert -t', or a synthetic corpus
+of channel chatter, commands and joins.  The protocol writes to a fake
+transport and runs on a fake clock, so the numbers only depend on the bot.
+
+    python test/bench_replay.py [-t TRAFFIC_LOG] [-n LINES] [-c CHANNELS]
+                                [-p PASSIVES] [-r RATE]
+
+Reports, as json:
+    lines_per_second    - lines of traffic handled per second of cpu.
+    passive_overhead_us - dispatch cost per registered passive and message,
+                          measured against a run without passives.
+    reply_p50_seconds,
+    reply_p99_seconds   - time replies waited for the flood limit, in the
+                          simulated time of traffic arriving at RATE lines
+                          per second.
+    gc_objects_per_line - net container objects allocated per line.  Python
+                          2 has no allocation tracer, so objects freed while
+                          handling a line are not counted.
+"""
+import ast
+import gc
+import getopt
+import json
+import os
+import random
+import sys
+import time
+
+from twisted.internet import defer, task
+from twisted.test import proto_helpers
+
+sys.path.insert(
+    0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import delbert.bot  # noqa: E402
+import delbert.outbound  # noqa: E402
+import delbert.plugin  # noqa: E402
+
+NICK = 'delbert'
+
+
+def make_plugin(passives):
+    """
+    Create a plugin with an echo command and a number of keyword passives,
+    all running on the reactor so the replay is single threaded.
+    """
+    def echo(self, user, channel, args):
+        self._proto.send_msg(channel, args)
+        return defer.succeed(None)
+
+    def passive(self, user, channel, msg):
+        return defer.succeed(None)
+
+    members = {
+        '__init__': lambda self, config=None: delbert.plugin.Plugin.__init__(
+            self, 'bench'),
+        'echo': delbert.plugin.irc_command('echo', deferred=True)(echo),
+    }
+    for i in range(passives):
+        members['passive%d' % (i,)] = delbert.plugin.irc_passive(
+            'passive %d' % (i,),
+            keywords=['word%d' % (i,)],
+            deferred=True)(lambda self, *args: passive(self, *args))
+
+    return type('BenchPlugin', (delbert.plugin.Plugin,), members)()
+
+
+def synthetic(lines, channels, passives, seed=0):
+    """
+    Generate traffic: mostly chatter, some of it triggering passives, with a
+    command every 20 lines and a join every 50.
+
+    @return - list of chunks of data received from the server.
+    """
+    rand = random.Random(seed)
+    words = ['lorem', 'ipsum', 'dolor', 'sit', 'amet', 'consectetur']
+    words.extend('word%d' % (i,) for i in range(max(passives, 1)))
+
+    data = []
+    for i in range(lines):
+        channel = '#c%d' % (rand.randrange(channels),)
+        user = 'user%d!u@host%d' % (rand.randrange(200), i % 7)
+        if i % 50 == 0:
+            data.append(':%s JOIN %s' % (user, channel))
+        elif i % 20 == 0:
+            data.append(':%s PRIVMSG %s :!echo %d' % (user, channel, i))
+        else:
+            msg = ' '.join(rand.choice(words) for _ in range(8))
+            data.append(':%s PRIVMSG %s :%s' % (user, channel, msg))
+
+    # Servers send several lines per segment.
+    return [
+        ''.join(line + '\r\n' for line in data[i:i + 10])
+        for i in range(0, len(data), 10)]
+
+
+def read_log(path):
+    """
+    Read the data received from the server in a traffic log.
+
+    @return - list of chunks of data received from the server.
+    """
+    data = []
+    with open(path) as f:
+        for line in f:
+            direction, _, rest = line.partition(': ')
+            if not direction.startswith('C '):
+                continue
+            try:
+                chunk = ast.literal_eval(rest.strip())
+            except (SyntaxError, ValueError):
+                # The reason the connection was lost.
+                continue
+            data.append(chunk)
+    return data
+
+
+def channels_of(data):
+    channels = set()
+    for chunk in data:
+        for line in chunk.split('\r\n'):
+            parts = line.split(' ')
+            if len(parts) > 2 and parts[1] in ('PRIVMSG', 'JOIN'):
+                if parts[2].lstrip(':').startswith('#'):
+                    channels.add(parts[2].lstrip(':'))
+    return channels
+
+
+def replay(data, passives, rate):
+    """
+    Feed traffic to a signed on BotProtocol.
+
+    @param data     - chunks of data received from the server.
+    @param passives - number of passives registered.
+    @param rate     - lines per second the traffic arrives at.
+    @return         - dict of results.
+    """
+    clock = task.Clock()
+    bench = make_plugin(passives)
+
+    class Factory(delbert.bot.BotFactory):
+        def _load_plugins(self, path='plugins'):
+            return [bench]
+
+    factory = Factory(
+        {
+            'nick': NICK,
+            'pass': 'pw',
+            'dbdir': '/tmp',
+            'channels': dict((c, None) for c in channels_of(data)),
+            'sasl': False,
+        },
+        clock)
+
+    delays = []
+    factory.outbound = delbert.outbound.OutboundScheduler(
+        2.0, 5, clock, delays.append)
+
+    transport = proto_helpers.StringTransport()
+    proto = factory.buildProtocol(None)
+    proto.makeConnection(transport)
+    proto.dataReceived(':server 001 %s :Welcome\r\n' % (NICK,))
+    proto.dataReceived(':server 376 %s :End of MOTD\r\n' % (NICK,))
+    clock.advance(60)
+    del delays[:]
+
+    lines = sum(chunk.count('\n') for chunk in data)
+    gc.collect()
+    gc.disable()
+    objects = len(gc.get_objects())
+    elapsed = 0.0
+    try:
+        for chunk in data:
+            start = time.clock()
+            proto.dataReceived(chunk)
+            elapsed += time.clock() - start
+
+            # Keep the transport small, only the timing of replies matters.
+            transport.clear()
+            clock.advance(float(chunk.count('\n')) / rate)
+        objects = len(gc.get_objects()) - objects
+    finally:
+        gc.enable()
+
+    # Let the flood limit drain what is left.
+    while len(factory.outbound):
+        clock.advance(1)
+
+    delays.sort()
+    return {
+        'lines': lines,
+        'seconds': elapsed,
+        'replies': len(delays),
+        'delays': delays,
+        'gc_objects': objects,
+    }
+
+
+def percentile(values, p):
+    if not len(values):
+        return None
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+def usage():
+    print __doc__
+
+
+def main():
+    try:
+        opts, _ = getopt.getopt(sys.argv[1:], 'ht:n:c:p:r:')
+    except getopt.GetoptError, e:
+        print str(e)
+        sys.exit(1)
+
+    traffic_log = None
+    lines = 20000
+    channels = 50
+    passives = 20
+    rate = 100.0
+
+    for o, a in opts:
+        if o == '-h':
+            usage()
+            sys.exit(0)
+        elif o == '-t':
+            traffic_log = a
+        elif o == '-n':
+            lines = int(a)
+        elif o == '-c':
+            channels = int(a)
+        elif o == '-p':
+            passives = int(a)
+        elif o == '-r':
+            rate = float(a)
+
+    if traffic_log is not None:
+        data = read_log(traffic_log)
+    else:
+        data = synthetic(lines, channels, passives)
+
+    if not sum(chunk.count('\n') for chunk in data):
+        print 'No traffic to replay'
+        sys.exit(1)
+
+    baseline = replay(data, 0, rate)
+    result = replay(data, passives, rate)
+
+    privmsgs = sum(chunk.count(' PRIVMSG ') for chunk in data)
+    overhead = None
+    if passives and privmsgs:
+        overhead = 1e6 * (result['seconds'] - baseline['seconds']) / (
+            privmsgs * passives)
+
+    print json.dumps({
+        'lines': result['lines'],
+        'passives': passives,
+        'lines_per_second': result['lines'] / result['seconds'],
+        'passive_overhead_us': overhead,
+        'replies': result['replies'],
+        'reply_p50_seconds': percentile(result['delays'], 0.5),
+        'reply_p99_seconds': percentile(result['delays'], 0.99),
+        'gc_objects_per_line': float(result['gc_objects']) / result['lines'],
+    }, indent=2, sort_keys=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,77 @@
+"""
+Measure how long it takes to load the plugins and the memory used once they
+are loaded, with and without lazy loading.  Each run happens in a fresh
+process so the numbers include importing the plugins' dependencies.
+
+    python test/bench_startup.py [RUNS]
+"""
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+CHILD = """
+import json
+import resource
+import sys
+import time
+
+sys.path.insert(0, %(root)r)
+start = time.time()
+
+import delbert.loader
+
+plugins = delbert.loader.load_plugins(
+    {}, %(plugins)r, lazy=%(lazy)r, cache=%(cache)r)
+
+print json.dumps({
+    'seconds': time.time() - start,
+    'maxrss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+    'plugins': len(plugins),
+})
+"""
+
+
+def run(lazy, cache):
+    source = CHILD % {
+        'root': ROOT,
+        'plugins': os.path.join(ROOT, 'plugins'),
+        'lazy': lazy,
+        'cache': cache,
+    }
+    with open(os.devnull, 'w') as devnull:
+        out = subprocess.check_output(
+            [sys.executable, '-c', source],
+            stderr=devnull,
+            cwd=ROOT)
+    return json.loads(out.splitlines()[-1])
+
+
+def summarize(results):
+    seconds = sorted(r['seconds'] for r in results)
+    return {
+        'median_seconds': seconds[len(seconds) // 2],
+        'maxrss_kb': max(r['maxrss_kb'] for r in results),
+        'plugins': results[0]['plugins'],
+    }
+
+
+def main():
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    cache = os.path.join(tempfile.mkdtemp(), 'plugins.manifest')
+
+    # Fill the manifest cache and the bytecode of the plugins first.
+    run(True, cache)
+    run(False, cache)
+
+    print json.dumps({
+        'eager': summarize([run(False, cache) for _ in range(runs)]),
+        'lazy': summarize([run(True, cache) for _ in range(runs)]),
+    }, indent=2, sort_keys=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,357 @@
+import collections
+import itertools
+import random
+
+from twisted.internet import defer, protocol, reactor, task
+from twisted.python import log
+from twisted.words.protocols import irc
+
+
+class ServerConnection(irc.IRC):
+    """
+    Connection of a client to the IRCServer.  Lines sent faster than the
+    server's flood limit are dropped, or close the connection with an excess
+    flood error like most real servers do.
+    """
+    hostname = 'irc.delbert.test'
+
+    def connectionMade(self):
+        irc.IRC.connectionMade(self)
+        self.nickname = None
+        self.username = None
+        self.registered = False
+        self._tokens = float(self.factory.burst)
+        self._last = self.factory.clock.seconds()
+
+    def connectionLost(self, reason):
+        self.factory.remove(self)
+
+    @property
+    def prefix(self):
+        return '%s!%s@localhost' % (self.nickname, self.username)
+
+    def _allow(self):
+        now = self.factory.clock.seconds()
+        self._tokens = min(
+            self.factory.burst,
+            self._tokens + (now - self._last) * self.factory.rate)
+        self._last = now
+        if self._tokens < 1:
+            return False
+        self._tokens -= 1
+        return True
+
+    def handleCommand(self, command, prefix, params):
+        self.factory.stats['received'] += 1
+        if self.registered and not self._allow():
+            self.factory.stats['throttled'] += 1
+            if self.factory.disconnect_on_flood:
+                self.sendLine('ERROR :Closing Link (Excess Flood)')
+                self.transport.loseConnection()
+            return
+
+        method = getattr(self, 'irc_%s' % (command,), None)
+        if method is None:
+            self.reply(irc.ERR_UNKNOWNCOMMAND, command, 'Unknown command')
+            return
+        method(prefix, params)
+
+    def reply(self, code, *params):
+        """
+        Send a numeric reply to the client.
+        """
+        self.sendMessage(
+            code,
+            self.nickname or '*',
+            *(list(params[:-1]) + [':%s' % (params[-1],)]),
+            prefix=self.hostname)
+
+    def irc_CAP(self, prefix, params):
+        # Capabilities, SASL included, are not supported.
+        if len(params) > 1 and params[0] == 'REQ':
+            self.sendLine(':%s CAP * NAK :%s' % (self.hostname, params[-1]))
+        elif len(params) and params[0] == 'LS':
+            self.sendLine(':%s CAP * LS :' % (self.hostname,))
+
+    def irc_PASS(self, prefix, params):
+        pass
+
+    def irc_NICK(self, prefix, params):
+        self.nickname = params[0]
+        self._register()
+
+    def irc_USER(self, prefix, params):
+        self.username = params[0]
+        self._register()
+
+    def _register(self):
+        if self.registered or self.nickname is None or self.username is None:
+            return
+
+        self.registered = True
+        self.factory.add(self)
+        self.reply(irc.RPL_WELCOME, 'Welcome %s' % (self.prefix,))
+        self.reply(irc.RPL_ENDOFMOTD, 'End of MOTD')
+
+    def irc_PING(self, prefix, params):
+        self.sendLine(':%s PONG %s :%s' % (
+            self.hostname, self.hostname, params[-1]))
+
+    def irc_JOIN(self, prefix, params):
+        for name in params[0].split(','):
+            self.factory.join(self, name)
+
+    def irc_PART(self, prefix, params):
+        for name in params[0].split(','):
+            self.factory.part(self, name)
+
+    def irc_PRIVMSG(self, prefix, params):
+        self.factory.message(self, 'PRIVMSG', params[0], params[-1])
+
+    def irc_NOTICE(self, prefix, params):
+        self.factory.message(self, 'NOTICE', params[0], params[-1])
+
+    def irc_QUIT(self, prefix, params):
+        self.transport.loseConnection()
+
+
+class IRCServer(protocol.ServerFactory):
+    """
+    Minimal IRC server for load testing the bot locally.  It supports
+    registration, joining and parting channels, messages and notices, and
+    enforces a flood limit on the lines sent by clients.
+
+    Users simulated by a LoadGenerator are not connected, their messages are
+    delivered straight to the clients in the channel.
+    """
+    protocol = ServerConnection
+
+    def __init__(self, rate=2.0, burst=5, disconnect_on_flood=False,
+                 clock=None):
+        """
+        @param rate                 - lines per second a client may send
+                                      once its burst is used up.
+        @param burst                - lines a client may send back to back.
+        @param disconnect_on_flood  - close the connection of a client going
+                                      over the limit rather than dropping
+                                      the line.
+        @param clock                - reactor used for the flood limit.
+        """
+        self.rate = float(rate)
+        self.burst = burst
+        self.disconnect_on_flood = disconnect_on_flood
+        self.clock = clock if clock is not None else reactor
+        self.clients = {}
+        self.channels = collections.defaultdict(set)
+        self.observers = []
+        self.stats = collections.Counter()
+        self._joins = []
+
+    def add(self, client):
+        self.clients[client.nickname] = client
+
+    def remove(self, client):
+        if self.clients.get(client.nickname) is client:
+            del self.clients[client.nickname]
+        for members in self.channels.values():
+            members.discard(client)
+
+    def join(self, client, name):
+        members = self.channels[name]
+        members.add(client)
+        for member in members:
+            member.sendLine(':%s JOIN %s' % (client.prefix, name))
+        client.reply(irc.RPL_NAMREPLY, '=', name, ' '.join(
+            sorted(m.nickname for m in members)))
+        client.reply(irc.RPL_ENDOFNAMES, name, 'End of NAMES list')
+
+        for count, d in list(self._joins):
+            if self.joined(client.nickname) >= count:
+                self._joins.remove((count, d))
+                d.callback(client)
+
+    def part(self, client, name):
+        members = self.channels.get(name, set())
+        for member in members:
+            member.sendLine(':%s PART %s' % (client.prefix, name))
+        members.discard(client)
+
+    def joined(self, nickname):
+        """
+        Get the number of channels a client is in.
+        """
+        return sum(
+            1 for members in self.channels.values()
+            if any(m.nickname == nickname for m in members))
+
+    def wait_for_joins(self, count):
+        """
+        @return - Deferred firing with the first client to be in count
+                  channels.
+        """
+        d = defer.Deferred()
+        self._joins.append((count, d))
+        return d
+
+    def message(self, client, command, target, text):
+        """
+        Deliver a message sent by a client.
+        """
+        self.stats[command] += 1
+        for observer in self.observers:
+            observer(client.nickname, command, target, text)
+
+        if target.startswith('#'):
+            recipients = [
+                m for m in self.channels.get(target, ()) if m is not client]
+        elif target in self.clients:
+            recipients = [self.clients[target]]
+        else:
+            client.reply(irc.ERR_NOSUCHNICK, target, 'No such nick/channel')
+            return
+
+        line = ':%s %s %s :%s' % (client.prefix, command, target, text)
+        for recipient in recipients:
+            recipient.sendLine(line)
+
+    def say(self, prefix, channel, text):
+        """
+        Send a message to a channel from a simulated user.
+
+        @param prefix   - nick!user@host of the user.
+        @param channel  - channel the message is sent to.
+        @param text     - message.
+        """
+        line = ':%s PRIVMSG %s :%s' % (prefix, channel, text)
+        for member in self.channels.get(channel, ()):
+            member.sendLine(line)
+
+
+class LoadGenerator(object):
+    """
+    Simulate users chatting in channels on an IRCServer and measure how long
+    the bot takes to answer their commands.
+
+    Replies are matched to commands in order per channel, so the command
+    used should be answered with a single line.
+    """
+    def __init__(self, server, nickname, channels, users, rate,
+                 command='!echo', command_every=20, clock=None, seed=0):
+        """
+        @param server           - IRCServer the users are on.
+        @param nickname         - nickname of the bot.
+        @param channels         - names of the channels users talk in.
+        @param users            - number of simulated users.
+        @param rate             - messages per second sent by each user.
+        @param command          - command sent to the bot, followed by a
+                                  sequence number.
+        @param command_every    - one message in every command_every is a
+                                  command.
+        @param clock            - reactor used for scheduling.
+        @param seed             - seed of the random choice of channels and
+                                  users.
+        """
+        self._server = server
+        self._nickname = nickname
+        self._channels = sorted(channels)
+        self._users = users
+        self._rate = float(rate)
+        self._command = command
+        self._command_every = command_every
+        self._clock = clock if clock is not None else reactor
+        self._rand = random.Random(seed)
+        self._sequence = itertools.count()
+        self._due = 0.0
+        self._loop = None
+
+        self._pending = collections.defaultdict(collections.deque)
+        self.latencies = []
+        self.stats = collections.Counter()
+        server.observers.append(self._observe)
+
+    def start(self, tick=0.05):
+        """
+        Start sending messages.
+
+        @param tick - seconds between batches of messages.
+        """
+        self._tick = tick
+        self._loop = task.LoopingCall(self._send)
+        self._loop.clock = self._clock
+        self._loop.start(tick, now=False)
+
+    def stop(self):
+        if self._loop is not None and self._loop.running:
+            self._loop.stop()
+        self._loop = None
+
+    def _send(self):
+        self._due += self._users * self._rate * self._tick
+        while self._due >= 1:
+            self._due -= 1
+            self.send()
+
+    def send(self):
+        """
+        Send a single message from a random user to a random channel.
+        """
+        i = next(self._sequence)
+        channel = self._rand.choice(self._channels)
+        prefix = 'user%d!u@sim' % (self._rand.randrange(self._users),)
+
+        if self._command_every and i % self._command_every == 0:
+            self.stats['commands'] += 1
+            self._pending[channel].append(self._clock.seconds())
+            self._server.say(
+                prefix, channel, '%s %d' % (self._command, i))
+        else:
+            self.stats['messages'] += 1
+            self._server.say(prefix, channel, 'message number %d' % (i,))
+
+    def _observe(self, nickname, command, target, text):
+        if nickname != self._nickname or target not in self._channels:
+            return
+
+        pending = self._pending.get(target)
+        if not pending:
+            self.stats['unmatched'] += 1
+            return
+        self.stats['replies'] += 1
+        self.latencies.append(self._clock.seconds() - pending.popleft())
+
+    def results(self):
+        """
+        Summarize the run.
+
+        @return - dict of results.
+        """
+        latencies = sorted(self.latencies)
+
+        def percentile(p):
+            if not len(latencies):
+                return None
+            return latencies[min(len(latencies) - 1, int(len(latencies) * p))]
+
+        return {
+            'commands': self.stats['commands'],
+            'messages': self.stats['messages'],
+            'replies': self.stats['replies'],
+            'unanswered': sum(len(p) for p in self._pending.values()),
+            'unmatched': self.stats['unmatched'],
+            'throttled': self._server.stats['throttled'],
+            'reply_p50_seconds': percentile(0.5),
+            'reply_p99_seconds': percentile(0.99),
+            'reply_max_seconds': latencies[-1] if len(latencies) else None,
+        }
+
+
+def listen(server, port=0, interface='127.0.0.1'):
+    """
+    Listen for IRC clients.
+
+    @return - the listening port, see getHost() for the port picked when
+              port is 0.
+    """
+    listening = reactor.listenTCP(port, server, interface=interface)
+    log.msg('Fake IRC server listening on %s' % (listening.getHost(),))
+    return listening
@@ -0,0 +1,389 @@
+import base64
+import os
+import shutil
+import tempfile
+import unittest
+
+import yaml
+
+from twisted.internet import defer, error, task
+from twisted.python import failure
+from twisted.test import proto_helpers
+
+import base
+
+import delbert.bot
+import delbert.outbound
+import delbert.plugin
+import delbert.router
+
+
+class Connector(object):
+    def __init__(self):
+        self.attempts = 0
+
+    def connect(self):
+        self.attempts += 1
+
+
+class TestFactory(delbert.bot.BotFactory):
+    def _load_plugins(self, path='plugins'):
+        return []
+
+
+class ReconnectTester(unittest.TestCase):
+    def setUp(self):
+        self._clock = task.Clock()
+        self._factory = TestFactory({
+            'nick': base.TEST_NICK,
+            'pass': 'pw',
+            'dbdir': '/tmp',
+            'channels': {'#a': None, '#b': None},
+            'flood': {'rate': 100, 'burst': 100},
+            'reconnect': {
+                'initial_delay': 1,
+                'max_delay': 10,
+                'factor': 2,
+                'jitter': 0,
+            },
+        }, self._clock)
+        self._connector = Connector()
+
+    def lost(self):
+        self._factory.clientConnectionFailed(
+            self._connector,
+            failure.Failure(error.ConnectionRefusedError()))
+
+    def connect(self):
+        proto = self._factory.buildProtocol(None)
+        transport = proto_helpers.StringTransport()
+        proto.makeConnection(transport)
+        return proto, transport
+
+    def test_backoff(self):
+        delays = []
+        for _ in range(5):
+            self.lost()
+            delays.append(self._factory.delay)
+
+            attempts = self._connector.attempts
+            self._clock.advance(self._factory.delay - 0.01)
+            self.assertEqual(self._connector.attempts, attempts)
+            self._clock.advance(0.01)
+            self.assertEqual(self._connector.attempts, attempts + 1)
+
+        self.assertEqual(delays, [2, 4, 8, 10, 10])
+
+    def test_reset(self):
+        self.lost()
+        self.lost()
+        self.assertEqual(self._factory.delay, 4)
+
+        proto, _ = self.connect()
+        proto.irc_RPL_WELCOME('server', [base.TEST_NICK, 'Welcome'])
+        proto.irc_RPL_ENDOFMOTD('server', [base.TEST_NICK, 'End'])
+        self.assertEqual(self._factory.delay, 1)
+
+    def test_resume(self):
+        proto, transport = self.connect()
+        proto.irc_RPL_WELCOME('server', [base.TEST_NICK, 'Welcome'])
+        proto.irc_RPL_ENDOFMOTD('server', [base.TEST_NICK, 'End'])
+        proto.connectionLost(failure.Failure(error.ConnectionLost()))
+
+        # Sent while disconnected, kept until the bot is back.
+        proto.send_msg('#a', 'pending')
+        self._clock.advance(1)
+
+        proto, transport = self.connect()
+        lines = transport.value().splitlines()
+        self.assertTrue(any(line.startswith('NICK') for line in lines))
+        self.assertFalse(any('pending' in line for line in lines))
+
+        # Sent once signed on, without waiting for the end of the motd.
+        transport.clear()
+        proto.irc_RPL_WELCOME('server', [base.TEST_NICK, 'Welcome'])
+        self._clock.advance(1)
+        self.assertEqual(
+            transport.value().splitlines(),
+            ['PRIVMSG nickserv :identify testbot pw', 'PRIVMSG #a :pending'])
+
+        transport.clear()
+        proto.irc_RPL_ENDOFMOTD('server', [base.TEST_NICK, 'End'])
+        self._clock.advance(1)
+
+        lines = transport.value().splitlines()
+        self.assertEqual(len(lines), 1)
+        self.assertIn(lines[0], ('JOIN #a,#b', 'JOIN #b,#a'))
+
+
+class RegistrationTester(unittest.TestCase):
+    def setUp(self):
+        self._clock = task.Clock()
+        scheduler = delbert.outbound.OutboundScheduler(
+            rate=100, burst=100, clock=self._clock)
+        self._channels = dict(
+            ('#channel-%03d' % (i,), None) for i in range(100))
+        self._proto = delbert.bot.BotProtocol(
+            base.TEST_NICK, 'pw', self._channels, scheduler)
+        self._transport = proto_helpers.StringTransport()
+
+    def lines(self):
+        lines = self._transport.value().splitlines()
+        self._transport.clear()
+        return lines
+
+    def receive(self, line):
+        self._proto.dataReceived(line + '\r\n')
+
+    def test_sasl(self):
+        self._proto.makeConnection(self._transport)
+        self.assertEqual(self.lines()[0], 'CAP REQ :sasl')
+
+        self.receive(':server CAP * ACK :sasl')
+        self.assertEqual(self.lines(), ['AUTHENTICATE PLAIN'])
+
+        self.receive('AUTHENTICATE +')
+        self.assertEqual(
+                self.lines(),
+                ['AUTHENTICATE %s' % (
+                    base64.b64encode('testbot\0testbot\0pw'),)])
+
+        self.receive(':server 903 testbot :SASL authentication successful')
+        self.assertEqual(self.lines(), ['CAP END'])
+
+        self.receive(':server 001 testbot :Welcome')
+        self._clock.advance(1)
+        self.assertEqual(self.lines(), [])
+
+    def test_sasl_unsupported(self):
+        self._proto.makeConnection(self._transport)
+        self.lines()
+
+        self.receive(':server CAP * NAK :sasl')
+        self.assertEqual(self.lines(), ['CAP END'])
+
+        self.receive(':server 001 testbot :Welcome')
+        self.receive(':server 422 testbot :MOTD File is missing')
+        self._clock.advance(1)
+        lines = self.lines()
+        self.assertEqual(lines[0], 'PRIVMSG nickserv :identify testbot pw')
+
+    def test_join(self):
+        self._proto.makeConnection(self._transport)
+        self.receive(':server 001 testbot :Welcome')
+        self.receive(':server 376 testbot :End of MOTD')
+        self._clock.advance(1)
+
+        joins = [j for j in self.lines() if j.startswith('JOIN ')]
+        self.assertTrue(len(joins) < 5)
+        self.assertTrue(all(len(j) + 2 <= 512 for j in joins))
+
+        joined = sum((j[5:].split(',') for j in joins), [])
+        self.assertEqual(sorted(joined), sorted(self._channels.keys()))
+
+    def test_join_targmax(self):
+        self._proto.makeConnection(self._transport)
+        self.receive(':server 001 testbot :Welcome')
+        self.receive(':server 005 testbot TARGMAX=JOIN:10 :are supported')
+        self.receive(':server 376 testbot :End of MOTD')
+        self._clock.advance(1)
+
+        joins = [j for j in self.lines() if j.startswith('JOIN ')]
+        self.assertEqual(len(joins), 10)
+        self.assertTrue(all(len(j.split(',')) == 10 for j in joins))
+
+
+class EchoPlugin(delbert.plugin.Plugin):
+    def __init__(self, config=None):
+        super(EchoPlugin, self).__init__('echo')
+        self.pending = defer.Deferred()
+
+    @delbert.plugin.irc_command('echo arguments', deferred=True)
+    def echo(self, user, channel, args):
+        self._proto.send_msg(channel, '%s: %s' % (self.nickname, args))
+        return defer.succeed(None)
+
+    @delbert.plugin.irc_command('echo arguments later')
+    def later(self, user, channel, args):
+        yield self.pending
+        self._proto.send_msg(channel, '%s: %s' % (self.nickname, args))
+
+
+class NetworkTester(unittest.TestCase):
+    def setUp(self):
+        self._clock = task.Clock()
+        self._plugin = EchoPlugin()
+        self._router = delbert.router.ProtocolRouter()
+
+        self._transports = {}
+        self._protos = {}
+        for name, channels in (('one', ['#a', '#shared']), ('two', ['#b'])):
+            factory = TestFactory(
+                {
+                    'name': name,
+                    'nick': 'bot-%s' % (name,),
+                    'pass': 'pw',
+                    'dbdir': '/tmp',
+                    'channels': dict((c, None) for c in channels),
+                    'flood': {'rate': 100, 'burst': 100},
+                    'sasl': False,
+                },
+                self._clock,
+                plugins=[self._plugin],
+                proto_router=self._router)
+
+            proto = factory.buildProtocol(None)
+            transport = proto_helpers.StringTransport()
+            proto.makeConnection(transport)
+            proto.irc_RPL_WELCOME('server', [proto.nickname, 'Welcome'])
+            proto.irc_RPL_ENDOFMOTD('server', [proto.nickname, 'End'])
+            self._clock.advance(1)
+            transport.clear()
+
+            self._protos[name] = proto
+            self._transports[name] = transport
+
+    def lines(self, name):
+        self._clock.advance(1)
+        lines = self._transports[name].value().splitlines()
+        self._transports[name].clear()
+        return lines
+
+    def test_route(self):
+        self._protos['two'].privmsg('user!u@host', '#b', '!echo hi')
+        self.assertEqual(self.lines('one'), [])
+        self.assertEqual(self.lines('two'), ['PRIVMSG #b :bot-two: hi'])
+
+        self._protos['one'].privmsg('user!u@host', '#a', '!echo hi')
+        self.assertEqual(self.lines('one'), ['PRIVMSG #a :bot-one: hi'])
+        self.assertEqual(self.lines('two'), [])
+
+    def test_route_after_yield(self):
+        self._protos['two'].privmsg('user!u@host', '#b', '!later hi')
+        self._plugin.pending.callback(None)
+        self.assertEqual(self.lines('one'), [])
+        self.assertEqual(self.lines('two'), ['PRIVMSG #b :bot-two: hi'])
+
+    def test_route_outside_handler(self):
+        self._router.send_msg('#b', 'webhook')
+        self.assertEqual(self.lines('one'), [])
+        self.assertEqual(self.lines('two'), ['PRIVMSG #b :webhook'])
+
+        self._router.send_msg('#shared', 'webhook')
+        self.assertEqual(self.lines('one'), ['PRIVMSG #shared :webhook'])
+        self.assertEqual(self.lines('two'), [])
+
+
+class AdminTester(unittest.TestCase):
+    def setUp(self):
+        self._clock = task.Clock()
+        self._factory = TestFactory(
+            {
+                'nick': base.TEST_NICK,
+                'pass': 'pw',
+                'dbdir': '/tmp',
+                'channels': {'#a': None},
+                'flood': {'rate': 100, 'burst': 100},
+                'sasl': False,
+                'admins': ['admin!*@trusted.host'],
+            },
+            self._clock)
+        self._factory.admin_commands['ping'] = lambda user, args: [
+            'pong %s' % (args,)]
+
+        self._proto = self._factory.buildProtocol(None)
+        self._transport = proto_helpers.StringTransport()
+        self._proto.makeConnection(self._transport)
+        self._proto.irc_RPL_WELCOME('server', [base.TEST_NICK, 'Welcome'])
+        self._proto.irc_RPL_ENDOFMOTD('server', [base.TEST_NICK, 'End'])
+        self._clock.advance(1)
+        self._transport.clear()
+
+    def lines(self):
+        self._clock.advance(1)
+        lines = self._transport.value().splitlines()
+        self._transport.clear()
+        return lines
+
+    def test_admin(self):
+        self._proto.privmsg('admin!a@trusted.host', base.TEST_NICK, '!ping x')
+        self.assertEqual(self.lines(), ['NOTICE admin :pong x'])
+
+    def test_not_admin(self):
+        self._proto.privmsg('admin!a@other.host', base.TEST_NICK, '!ping x')
+        self._proto.privmsg('admin!a@trusted.host', '#a', '!ping x')
+        self.assertEqual(self.lines(), [])
+
+    def test_failure(self):
+        def fail(user, args):
+            raise ValueError('broken')
+
+        self._factory.admin_commands['fail'] = fail
+        self._proto.privmsg('admin!a@trusted.host', base.TEST_NICK, '!fail')
+        self.assertEqual(self.lines(), ['NOTICE admin :fail failed: broken'])
+
+
+class ConfigTester(unittest.TestCase):
+    def setUp(self):
+        self._dir = tempfile.mkdtemp()
+        self._path = os.path.join(self._dir, 'bot.conf')
+
+    def tearDown(self):
+        shutil.rmtree(self._dir)
+
+    def parse(self, config):
+        with open(self._path, 'w') as f:
+            yaml.dump(config, f)
+        os.chmod(self._path, 0600)
+        return delbert.bot.parse_config(self._path)
+
+    def test_single(self):
+        config = self.parse({
+            'server': 'irc.example.com',
+            'port': 6667,
+            'nick': 'bot',
+            'pass': 'pw',
+            'channels': {'#a': None},
+        })
+
+        self.assertEqual(len(config['networks']), 1)
+        network = config['networks'][0]
+        self.assertEqual(network['name'], 'irc.example.com')
+        self.assertEqual(network['channels'], {'#a': None})
+        self.assertEqual(network['dbdir'], config['dbdir'])
+
+    def test_networks(self):
+        config = self.parse({
+            'nick': 'bot',
+            'pass': 'pw',
+            'port': 6667,
+            'karma': {'ds': 'karma.yaml'},
+            'networks': [
+                {'server': 'irc.one.com', 'channels': {'#a': None}},
+                {'server': 'irc.two.com', 'nick': 'other', 'port': 6697},
+            ],
+        })
+
+        one, two = config['networks']
+        self.assertEqual(one['nick'], 'bot')
+        self.assertEqual(one['channels'], {'#a': None})
+        self.assertEqual(one['karma'], {'ds': 'karma.yaml'})
+        self.assertEqual(two['nick'], 'other')
+        self.assertEqual(two['port'], 6697)
+        self.assertEqual(two['channels'], {})
+
+    def test_missing(self):
+        with self.assertRaises(KeyError):
+            self.parse({
+                'nick': 'bot',
+                'pass': 'pw',
+                'networks': [{'server': 'irc.one.com'}],
+            })
+
+
+def main():
+    unittest.main()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,169 @@
+import unittest
+
+from twisted.internet import defer, task
+from twisted.test import iosim, proto_helpers
+
+import base
+
+import delbert.bot
+import delbert.bus
+import delbert.plugin
+import delbert.router
+
+
+class EchoPlugin(delbert.plugin.Plugin):
+    def __init__(self, config=None):
+        super(EchoPlugin, self).__init__('echo')
+
+    @delbert.plugin.irc_command('echo arguments', deferred=True)
+    def echo(self, user, channel, args):
+        self._proto.send_msg(channel, '%s: %s' % (self.nickname, args))
+        return defer.succeed(None)
+
+    @delbert.plugin.irc_command('list arguments', deferred=True)
+    def split(self, user, channel, args):
+        self._proto.send_lines(channel, args.split(), notice=True)
+        return defer.succeed(None)
+
+    @delbert.plugin.irc_command('fail', deferred=True)
+    def fail(self, user, channel, args):
+        return defer.fail(ValueError('failed'))
+
+    @delbert.plugin.irc_passive(
+        'say hi', substrings=['hello'], deferred=True)
+    def hello(self, user, channel, msg):
+        self._proto.send_msg(channel, 'hi')
+        return defer.succeed(None)
+
+
+class TestFactory(delbert.bot.BotFactory):
+    def _load_plugins(self, path='plugins'):
+        return []
+
+
+class BusTester(unittest.TestCase):
+    def setUp(self):
+        self._clock = task.Clock()
+        self._router = delbert.router.ProtocolRouter()
+        self._bus = delbert.bus.Bus(self._router)
+
+        self._plugin = EchoPlugin()
+        proto = delbert.bus.BusProto('worker')
+        self._plugin.initialize('worker', proto, None)
+
+        _, self._worker, self._pump = iosim.connectedServerAndClient(
+            lambda: self._bus.buildProtocol(None),
+            lambda: delbert.bus.WorkerProtocol([self._plugin], proto))
+
+    def connect(self, queues=None):
+        factory = TestFactory(
+            {
+                'name': 'net',
+                'nick': base.TEST_NICK,
+                'pass': 'pw',
+                'dbdir': '/tmp',
+                'channels': {'#a': None},
+                'flood': {'rate': 100, 'burst': 100},
+                'sasl': False,
+                'queues': queues,
+            },
+            self._clock,
+            plugins=self._bus.plugins(),
+            proto_router=self._router)
+
+        proto = factory.buildProtocol(None)
+        self._transport = proto_helpers.StringTransport()
+        proto.makeConnection(self._transport)
+        proto.irc_RPL_WELCOME('server', [base.TEST_NICK, 'Welcome'])
+        proto.irc_RPL_ENDOFMOTD('server', [base.TEST_NICK, 'End'])
+        self._clock.advance(1)
+        self._transport.clear()
+        return proto
+
+    def lines(self):
+        self._pump.flush()
+        self._clock.advance(1)
+        lines = self._transport.value().splitlines()
+        self._transport.clear()
+        return lines
+
+    def test_manifest(self):
+        manifest = delbert.bus.manifest([self._plugin])
+        self.assertEqual(
+                sorted(manifest['echo']['commands']),
+                ['echo', 'fail', 'split'])
+        self.assertEqual(
+                manifest['echo']['passives']['hello']['help'], 'say hi')
+        self.assertEqual(
+                manifest['echo']['passives']['hello']['triggers'],
+                '(?:hello)')
+        self.assertEqual(manifest['echo']['user_joins'], {})
+
+    def test_ready(self):
+        described = []
+        self._bus.ready.addCallback(described.append)
+        self.assertEqual(len(described), 1)
+        self.assertIn('echo', described[0])
+
+        plugins = self._bus.plugins()
+        self.assertEqual([p.name for p in plugins], ['echo'])
+        self.assertEqual(plugins[0].commands['echo'].help, 'echo arguments')
+
+    def test_command(self):
+        proto = self.connect()
+        proto.privmsg('user!u@host', '#a', '!echo hi there')
+        self.assertEqual(
+                self.lines(),
+                ['PRIVMSG #a :%s: hi there' % (base.TEST_NICK,)])
+
+        proto.privmsg('user!u@host', '#a', '!split one two')
+        self.assertEqual(self.lines(), ['NOTICE #a :one | two'])
+
+    def test_nickname(self):
+        # Outside of a handler plugins see the configured nickname.
+        self.assertEqual(self._plugin.nickname, 'worker')
+
+    def test_passive(self):
+        proto = self.connect()
+        proto.privmsg('user!u@host', '#a', 'well hello')
+        proto.privmsg('user!u@host', '#a', 'nothing')
+        self.assertEqual(self.lines(), ['PRIVMSG #a :hi'])
+
+    def test_shed(self):
+        # Calls waiting on the workers are bounded like threaded handlers.
+        proto = self.connect({'passive': 2})
+        for i in range(5):
+            proto.privmsg('user!u@host', '#a', 'hello %d' % (i,))
+        self.assertEqual(proto.queues.pending('passive'), 2)
+        self.assertEqual(proto.queues.stats[('passive', 'dropped')], 3)
+
+        self.assertEqual(self.lines(), ['PRIVMSG #a :hi'] * 2)
+        self.assertEqual(proto.queues.pending('passive'), 0)
+
+    def test_failure(self):
+        self.connect()
+        result = []
+        d = self._bus.call('echo', 'fail', [], 'net', base.TEST_NICK, 1)
+        d.addErrback(result.append)
+        self._pump.flush()
+
+        self.assertEqual(len(result), 1)
+        self.assertTrue(result[0].check(delbert.bus.HandlerError))
+
+    def test_no_workers(self):
+        self._worker.transport.loseConnection()
+        self._pump.flush()
+        self.assertEqual(self._bus.workers, [])
+
+        result = []
+        d = self._bus.call('echo', 'echo', [], 'net', base.TEST_NICK, 1)
+        d.addErrback(result.append)
+        self.assertTrue(result[0].check(delbert.bus.NoWorkersError))
+
+
+def main():
+    unittest.main()
+
+
+if __name__ == '__main__':
+    main()
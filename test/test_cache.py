@@ -0,0 +1,71 @@
+import unittest
+
+from twisted.internet import task
+
+import base  # noqa: F401, puts the repository on sys.path
+
+import delbert.cache
+
+
+class CacheTester(unittest.TestCase):
+    def setUp(self):
+        self._clock = task.Clock()
+        self._cache = delbert.cache.ResponseCache(10, self._clock)
+
+    def test_hit(self):
+        self._cache.set('a', 'A', 5, 1)
+        self.assertEqual(self._cache.get('a'), 'A')
+        self.assertEqual(self._cache.get('b'), None)
+        self.assertEqual(self._cache.get('b', 'B'), 'B')
+
+        stats = self._cache.stats
+        self.assertEqual(stats['hits'], 1)
+        self.assertEqual(stats['misses'], 2)
+        self.assertEqual(stats['entries'], 1)
+        self.assertEqual(stats['bytes'], 1)
+
+    def test_expire(self):
+        self._cache.set('a', 'A', 5, 3)
+        self._clock.advance(4)
+        self.assertEqual(self._cache.get('a'), 'A')
+        self._clock.advance(1)
+        self.assertEqual(self._cache.get('a'), None)
+        self.assertEqual(self._cache.stats['expired'], 1)
+        self.assertEqual(self._cache.size, 0)
+
+    def test_lru(self):
+        self._cache.set('a', 'A', 5, 4)
+        self._cache.set('b', 'B', 5, 4)
+        self._cache.get('a')
+        self._cache.set('c', 'C', 5, 4)
+
+        self.assertEqual(self._cache.get('a'), 'A')
+        self.assertEqual(self._cache.get('b'), None)
+        self.assertEqual(self._cache.get('c'), 'C')
+        self.assertEqual(self._cache.size, 8)
+        self.assertEqual(self._cache.stats['evictions'], 1)
+
+    def test_replace(self):
+        self._cache.set('a', 'A', 5, 4)
+        self._cache.set('a', 'AA', 5, 6)
+        self.assertEqual(self._cache.get('a'), 'AA')
+        self.assertEqual(self._cache.size, 6)
+
+    def test_too_large(self):
+        self._cache.set('a', 'A', 5, 11)
+        self.assertEqual(len(self._cache), 0)
+        self.assertEqual(self._cache.size, 0)
+
+    def test_clear(self):
+        self._cache.set('a', 'A', 5, 4)
+        self._cache.clear()
+        self.assertEqual(self._cache.get('a'), None)
+        self.assertEqual(self._cache.size, 0)
+
+
+def main():
+    unittest.main()
+
+
+if __name__ == '__main__':
+    main()
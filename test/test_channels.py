@@ -0,0 +1,82 @@
+import unittest
+
+import base
+
+import delbert.channels
+import delbert.plugin
+
+
+class GreetPlugin(delbert.plugin.Plugin):
+    def __init__(self, config=None):
+        super(GreetPlugin, self).__init__('greet')
+
+    @delbert.plugin.irc_command('say hello')
+    def hello(self, user, channel, args):
+        pass
+
+    @delbert.plugin.irc_command('say goodbye')
+    def goodbye(self, user, channel, args):
+        pass
+
+    @delbert.plugin.irc_passive('wave back', ['o/'])
+    def wave(self, user, channel, msg):
+        pass
+
+
+class ChannelTester(unittest.TestCase):
+    def setUp(self):
+        self._plugins = [GreetPlugin()]
+
+    def channel(self, name, config):
+        channel = delbert.channels.Channel(name, config)
+        channel.set_plugins(self._plugins)
+        return channel
+
+    def test_shared(self):
+        channels = [self.channel('#c%d' % (i,), {}) for i in range(100)]
+        self.assertTrue(all(c.table is channels[0].table for c in channels))
+        self.assertEqual(sorted(channels[0].commands), ['goodbye', 'hello'])
+
+        # Configuration for other plugins does not matter.
+        other = self.channel('#other', {'unknown': {'load': False}})
+        self.assertIs(other.table, channels[0].table)
+
+    def test_configured(self):
+        default = self.channel('#a', {})
+        configured = self.channel('#b', {'greet': {'commands': ['hello']}})
+        same = self.channel('#c', {'greet': {'commands': ['hello']}})
+
+        self.assertIsNot(configured.table, default.table)
+        self.assertIs(configured.table, same.table)
+        self.assertEqual(sorted(configured.commands), ['hello'])
+
+    def test_frozen(self):
+        channel = self.channel(base.TEST_CHANNEL, {})
+        with self.assertRaises(TypeError):
+            channel.commands['other'] = None
+        with self.assertRaises(TypeError):
+            channel.passives.pop('wave')
+
+    def test_replace(self):
+        channels = [self.channel('#c%d' % (i,), {}) for i in range(3)]
+        table = channels[0].table
+
+        new = GreetPlugin()
+        for channel in channels:
+            channel.replace_plugins(self._plugins, [new])
+
+        self.assertIsNot(channels[0].table, table)
+        self.assertTrue(
+            all(c.table is channels[0].table for c in channels))
+        self.assertEqual(channels[0].commands['hello'], new.hello)
+        self.assertEqual(
+            [name for name, _ in channels[0].match_passives('hi o/')],
+            ['wave'])
+
+
+def main():
+    unittest.main()
+
+
+if __name__ == '__main__':
+    main()
@@ -4,6 +4,8 @@ import unittest
 import warnings
 
 import responses
+from twisted.internet import reactor, task
+from twisted.web import resource, server
 
 import base
 
@@ -211,6 +213,48 @@ class GithubTester(unittest.TestCase):
                 self._proto.msgs[0][2])
 
 
+class ListenTester(unittest.TestCase):
+    """
+    Test retrying to listen for webhooks while the port is taken.
+    """
+    def setUp(self):
+        self._taken = reactor.listenTCP(0, server.Site(resource.Resource()))
+        self._clock = task.Clock()
+
+    def tearDown(self):
+        self._taken.stopListening()
+
+    def test_backoff(self):
+        plugin = base.load_plugin(
+            'github.py',
+            'Github',
+            {
+                'listen_port': self._taken.getHost().port,
+                'listen_retries': 3,
+            },
+            clock=self._clock)
+
+        delays = []
+        while self._clock.getDelayedCalls():
+            call, = self._clock.getDelayedCalls()
+            delays.append(call.getTime() - self._clock.seconds())
+            self._clock.advance(delays[-1])
+
+        self.assertEqual(delays, [1, 2, 4])
+        self.assertIsNone(plugin._port)
+
+    def test_shutdown(self):
+        plugin = base.load_plugin(
+            'github.py',
+            'Github',
+            {'listen_port': self._taken.getHost().port},
+            clock=self._clock)
+        self.assertEqual(len(self._clock.getDelayedCalls()), 1)
+
+        plugin.shutdown()
+        self.assertEqual(self._clock.getDelayedCalls(), [])
+
+
 def main():
     unittest.main()
 
@@ -0,0 +1,387 @@
+import unittest
+
+from twisted.internet import (
+    defer,
+    task,
+)
+from twisted.python import context, failure
+from twisted.web import client
+from twisted.web.http_headers import Headers
+from twisted.web.iweb import UNKNOWN_LENGTH
+
+import base
+
+import delbert.httpclient
+import delbert.metrics
+import delbert.trace
+
+
+class FakeTransport(object):
+    def __init__(self):
+        self.stopped = False
+
+    def stopProducing(self):
+        self.stopped = True
+
+
+class FakeResponse(object):
+    def __init__(self, body, code=200, headers=None, length=UNKNOWN_LENGTH):
+        self.code = code
+        self.headers = Headers(
+            dict((k, [v]) for k, v in (headers or {}).items()))
+        self.length = length
+        self.transport = FakeTransport()
+        self._body = body
+
+    def deliverBody(self, proto):
+        proto.makeConnection(self.transport)
+        for i in range(0, len(self._body), 4):
+            if self.transport.stopped:
+                return
+            proto.dataReceived(self._body[i:i + 4])
+        proto.connectionLost(failure.Failure(client.ResponseDone()))
+
+
+class FakeAgent(object):
+    def __init__(self):
+        self.requests = []
+
+    def request(self, method, uri, headers=None, bodyProducer=None):
+        d = defer.Deferred()
+        self.requests.append((method, uri, headers, bodyProducer, d))
+        return d
+
+    def respond(self, *args, **kwds):
+        self.requests.pop(0)[-1].callback(FakeResponse(*args, **kwds))
+
+
+class HTTPClientTester(unittest.TestCase):
+    def setUp(self):
+        self._clock = task.Clock()
+        self._agent = FakeAgent()
+        self._http = delbert.httpclient.HTTPClient(
+            {'timeout': 5, 'max_size': 16, 'max_per_host': 2},
+            clock=self._clock,
+            agent=self._agent)
+
+    def test_build_url(self):
+        build = delbert.httpclient.HTTPClient.build_url
+        self.assertEqual(build('http://a/b'), 'http://a/b')
+        self.assertEqual(
+                build('http://a/b', {'q': 'x y', 'a': u'\xe9'}),
+                'http://a/b?a=%C3%A9&q=x+y')
+        self.assertEqual(
+                build('http://a/b?c=1', [('q', 1)]), 'http://a/b?c=1&q=1')
+
+    def test_get(self):
+        d = self._http.get('http://test.com/api', params={'q': 'x'})
+        method, uri, headers, _, _ = self._agent.requests[0]
+        self.assertEqual(method, 'GET')
+        self.assertEqual(uri, 'http://test.com/api?q=x')
+        self.assertEqual(headers.getRawHeaders('User-Agent'), ['delbert'])
+
+        self._agent.respond(
+                '{"a": 1}',
+                headers={'Content-Type': 'application/json'})
+        resp = base.result_of(d)
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.headers['content-type'], 'application/json')
+        self.assertEqual(resp.json(), {'a': 1})
+        self.assertFalse(self._clock.getDelayedCalls())
+
+    def test_post(self):
+        self._http.post('http://test.com/', data={'url': 'x'})
+        method, _, headers, body, _ = self._agent.requests[0]
+        self.assertEqual(method, 'POST')
+        self.assertEqual(
+                headers.getRawHeaders('Content-Type'),
+                ['application/x-www-form-urlencoded'])
+        self.assertEqual(body.length, len('url=x'))
+
+    def test_status(self):
+        d = self._http.get('http://test.com/')
+        self._agent.respond('missing', code=404)
+        resp = base.result_of(d)
+        self.assertFalse(resp.ok)
+        with self.assertRaises(delbert.httpclient.HTTPError):
+            resp.raise_for_status()
+
+    def test_too_large(self):
+        d = self._http.get('http://test.com/')
+        response = FakeResponse('x' * 17)
+        self._agent.requests.pop(0)[-1].callback(response)
+
+        self.assertTrue(response.transport.stopped)
+        with self.assertRaises(delbert.httpclient.ResponseTooLarge):
+            base.result_of(d)
+
+    def test_too_large_length(self):
+        d = self._http.get('http://test.com/')
+        self._agent.respond('x' * 17, length=17)
+        with self.assertRaises(delbert.httpclient.ResponseTooLarge):
+            base.result_of(d)
+
+    def test_timeout(self):
+        d = self._http.get('http://test.com/')
+        self._clock.advance(5)
+        with self.assertRaises(delbert.httpclient.Timeout):
+            base.result_of(d)
+
+    def test_failure(self):
+        d = self._http.get('http://test.com/')
+        self._agent.requests.pop(0)[-1].errback(ValueError('boom'))
+        with self.assertRaises(delbert.httpclient.RequestError):
+            base.result_of(d)
+
+    def test_per_host_limit(self):
+        ds = [self._http.get('http://a.com/%d' % (i,)) for i in range(3)]
+        self._http.get('http://b.com/')
+        self.assertEqual(
+                [r[1] for r in self._agent.requests],
+                ['http://a.com/0', 'http://a.com/1', 'http://b.com/'])
+
+        self._agent.respond('0')
+        self.assertEqual(base.result_of(ds[0]).content, '0')
+        self.assertEqual(
+                [r[1] for r in self._agent.requests],
+                ['http://a.com/1', 'http://b.com/', 'http://a.com/2'])
+
+
+class VerifyTester(unittest.TestCase):
+    def setUp(self):
+        self._clock = task.Clock()
+        self._http = delbert.httpclient.HTTPClient(clock=self._clock)
+        self._agents = []
+
+        def make_agent(pool, policy=None):
+            agent = FakeAgent()
+            self._agents.append((pool, policy, agent))
+            return agent
+
+        self._http._make_agent = make_agent
+
+    def test_no_verify(self):
+        self._http.get('https://test.com/a', verify=False)
+        self._http.get('https://test.com/b', verify=False)
+
+        # Unverified requests get their own agent and connections.
+        (pool, policy, agent), = self._agents
+        self.assertIsNot(pool, self._http._pool)
+        self.assertIsInstance(policy, delbert.httpclient._NoVerifyPolicy)
+        self.assertEqual(
+            [r[1] for r in agent.requests],
+            ['https://test.com/a', 'https://test.com/b'])
+
+    def test_policy(self):
+        try:
+            from twisted.internet import ssl
+        except ImportError:
+            self.skipTest('needs the twisted tls extras')
+
+        policy = delbert.httpclient._NoVerifyPolicy()
+        options = policy.creatorForNetloc('test.com', 443)
+        self.assertIsInstance(options, ssl.CertificateOptions)
+        self.assertFalse(options.verify)
+
+
+class CachingTester(unittest.TestCase):
+    def setUp(self):
+        self._clock = task.Clock()
+        self._agent = FakeAgent()
+        self._http = delbert.httpclient.HTTPClient(
+            {'cache': {'ttls': {'http://short.com/': 1}}},
+            clock=self._clock,
+            agent=self._agent)
+
+    def test_uncached(self):
+        self._http.get('http://test.com/')
+        self._agent.respond('a')
+        self._http.get('http://test.com/')
+        self.assertEqual(1, len(self._agent.requests))
+
+    def test_cached(self):
+        d = self._http.get('http://test.com/', params={'q': 1}, cache_ttl=10)
+        self._agent.respond('a')
+        first = base.result_of(d)
+
+        d = self._http.get('http://test.com/', params={'q': 1}, cache_ttl=10)
+        self.assertIs(base.result_of(d), first)
+        self.assertEqual(0, len(self._agent.requests))
+
+        self._http.get('http://test.com/', params={'q': 2}, cache_ttl=10)
+        self.assertEqual(1, len(self._agent.requests))
+
+        self._clock.advance(10)
+        self._http.get('http://test.com/', params={'q': 1}, cache_ttl=10)
+        self.assertEqual(2, len(self._agent.requests))
+        self.assertEqual(self._http.cache.stats['hits'], 1)
+
+    def test_errors_uncached(self):
+        self._http.get('http://test.com/', cache_ttl=10)
+        self._agent.respond('a', code=500)
+        self._http.get('http://test.com/', cache_ttl=10)
+        self.assertEqual(1, len(self._agent.requests))
+
+    def test_negative(self):
+        def negative(resp):
+            return resp.content == 'none'
+
+        for code, body in ((404, 'missing'), (200, 'none')):
+            self._http.get(
+                'http://test.com/%d' % (code,),
+                cache_ttl=10,
+                negative_ttl=2,
+                negative=negative)
+            self._agent.respond(body, code=code)
+
+        self._clock.advance(1)
+        for code in (404, 200):
+            self._http.get('http://test.com/%d' % (code,), cache_ttl=10)
+        self.assertEqual(0, len(self._agent.requests))
+
+        self._clock.advance(1)
+        for code in (404, 200):
+            self._http.get('http://test.com/%d' % (code,), cache_ttl=10)
+        self.assertEqual(2, len(self._agent.requests))
+
+    def test_negative_error(self):
+        def negative(resp):
+            return resp.json()['results']
+
+        d = self._http.get(
+            'http://test.com/', cache_ttl=10, negative=negative)
+        self._agent.respond('not json')
+        with self.assertRaises(delbert.httpclient.RequestError):
+            base.result_of(d)
+
+        self._http.get('http://test.com/', cache_ttl=10)
+        self.assertEqual(1, len(self._agent.requests))
+
+    def test_configured_ttl(self):
+        self._http.get('http://short.com/x', cache_ttl=10)
+        self._agent.respond('a')
+        self._clock.advance(1)
+        self._http.get('http://short.com/x', cache_ttl=10)
+        self.assertEqual(1, len(self._agent.requests))
+
+
+class CoalesceTester(unittest.TestCase):
+    def setUp(self):
+        self._clock = task.Clock()
+        self._agent = FakeAgent()
+        self._http = delbert.httpclient.HTTPClient(
+            clock=self._clock,
+            agent=self._agent)
+
+    def test_coalesce(self):
+        ds = [
+            self._http.get('http://test.com/', params={'q': 1})
+            for _ in range(3)]
+        other = []
+        self._http.get(
+            'http://test.com/', params={'q': 2}).addCallback(other.append)
+        self.assertEqual(2, len(self._agent.requests))
+
+        self._agent.respond('one')
+        results = [base.result_of(d) for d in ds]
+        self.assertEqual([r.content for r in results], ['one'] * 3)
+        self.assertEqual(other, [])
+        self.assertEqual(self._http.stats, {'requests': 2, 'coalesced': 2})
+
+        self._http.get('http://test.com/', params={'q': 1})
+        self.assertEqual(2, len(self._agent.requests))
+
+    def test_coalesce_arguments(self):
+        self._http.get('http://test.com/')
+        self._http.get('http://test.com/', headers={'Accept': 'text/plain'})
+        self._http.get('http://test.com/', max_size=16)
+        self._http.get('http://test.com/', timeout=1)
+        self._http.get('http://test.com/', verify=False)
+        self.assertEqual(self._http.stats['coalesced'], 0)
+
+        self._http.get('http://test.com/', headers={'Accept': 'text/plain'})
+        self.assertEqual(self._http.stats['coalesced'], 1)
+
+    def test_coalesce_failure(self):
+        ds = [self._http.get('http://test.com/') for _ in range(2)]
+        self._agent.requests.pop(0)[-1].errback(ValueError('boom'))
+        for d in ds:
+            with self.assertRaises(delbert.httpclient.RequestError):
+                base.result_of(d)
+
+    def test_coalesce_failure_copies(self):
+        first, second = [self._http.get('http://test.com/') for _ in range(2)]
+        failures = []
+        second.addErrback(failures.append)
+        first.addErrback(failures.append)
+        self._agent.requests.pop(0)[-1].errback(ValueError('boom'))
+
+        self.assertEqual(len(failures), 2)
+        self.assertIsNot(failures[0], failures[1])
+        for f in failures:
+            self.assertTrue(f.check(delbert.httpclient.RequestError))
+
+    def test_coalesce_cache(self):
+        first = self._http.get('http://test.com/')
+        second = self._http.get('http://test.com/', cache_ttl=10)
+        self._agent.respond('one')
+
+        d = self._http.get('http://test.com/', cache_ttl=10)
+        self.assertIs(base.result_of(d), base.result_of(second))
+        self.assertIs(base.result_of(first), base.result_of(second))
+        self.assertEqual(0, len(self._agent.requests))
+
+    def test_post_not_coalesced(self):
+        self._http.post('http://test.com/', data='a')
+        self._http.post('http://test.com/', data='a')
+        self.assertEqual(2, len(self._agent.requests))
+
+    def test_metrics(self):
+        registry = delbert.metrics.Registry()
+        http = delbert.httpclient.HTTPClient(
+            {'timeout': 5},
+            clock=self._clock,
+            agent=self._agent,
+            metrics=registry)
+
+        http.get('http://test.com/a')
+        self._clock.advance(2)
+        self._agent.respond('ok')
+        http.get('http://test.com/b')
+        self._clock.advance(6)
+
+        latency = registry.histogram(
+            'delbert_http_request_seconds', '', ('host',))
+        responses = registry.counter(
+            'delbert_http_responses_total', '', ('host', 'outcome'))
+        self.assertEqual(latency.count('test.com'), 2)
+        self.assertEqual(responses.value('test.com', '200'), 1)
+        self.assertEqual(responses.value('test.com', 'timeout'), 1)
+
+    def test_trace(self):
+        class Tracer(object):
+            spans = []
+
+            def span(self, traced, name, start, **args):
+                self.spans.append((traced, name, args['outcome']))
+
+        http = delbert.httpclient.HTTPClient(
+            clock=self._clock,
+            agent=self._agent,
+            tracer=Tracer())
+
+        http.get('http://test.com/a')
+        context.call(
+            {delbert.trace.TRACE: 7},
+            http.get, 'http://test.com/b')
+        self._agent.respond('a')
+        self._agent.respond('b')
+        self.assertEqual(Tracer.spans, [(7, 'http GET test.com', 200)])
+
+
+def main():
+    unittest.main()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,104 @@
+import unittest
+
+from twisted.internet import task
+from twisted.test import proto_helpers
+
+import ircd
+
+
+class IRCServerTester(unittest.TestCase):
+    def setUp(self):
+        self._clock = task.Clock()
+        self._server = ircd.IRCServer(
+            rate=1,
+            burst=2,
+            clock=self._clock)
+
+    def connect(self, nickname):
+        transport = proto_helpers.StringTransport()
+        client = self._server.buildProtocol(None)
+        client.makeConnection(transport)
+        client.dataReceived('NICK %s\r\nUSER %s 0 * :real\r\n' % (
+            nickname, nickname))
+        return client, transport
+
+    def lines(self, transport):
+        lines = transport.value().splitlines()
+        transport.clear()
+        return lines
+
+    def test_register(self):
+        _, transport = self.connect('bot')
+        lines = self.lines(transport)
+        self.assertEqual(
+            lines[0], ':irc.delbert.test 001 bot :Welcome bot!bot@localhost')
+        self.assertEqual(lines[1].split()[1], '376')
+
+    def test_messages(self):
+        bot, bot_transport = self.connect('bot')
+        other, other_transport = self.connect('other')
+        bot.dataReceived('JOIN #a,#b\r\n')
+        other.dataReceived('JOIN #a\r\n')
+        self.assertEqual(self._server.joined('bot'), 2)
+        self.lines(bot_transport)
+        self.lines(other_transport)
+
+        self._clock.advance(10)
+        bot.dataReceived('PRIVMSG #a :hello\r\n')
+        self.assertEqual(
+            self.lines(other_transport),
+            [':bot!bot@localhost PRIVMSG #a :hello'])
+        self.assertEqual(self.lines(bot_transport), [])
+
+        self._server.say('user!u@sim', '#b', 'hi')
+        self.assertEqual(
+            self.lines(bot_transport), [':user!u@sim PRIVMSG #b :hi'])
+
+    def test_flood(self):
+        bot, transport = self.connect('bot')
+        bot.dataReceived('JOIN #a\r\n')
+        for i in range(3):
+            bot.dataReceived('PRIVMSG #a :%d\r\n' % (i,))
+
+        self.assertEqual(self._server.stats['PRIVMSG'], 1)
+        self.assertEqual(self._server.stats['throttled'], 2)
+
+        self._clock.advance(1)
+        bot.dataReceived('PRIVMSG #a :3\r\n')
+        self.assertEqual(self._server.stats['PRIVMSG'], 2)
+
+    def test_load(self):
+        bot, transport = self.connect('bot')
+        bot.dataReceived('JOIN #a\r\n')
+        self.lines(transport)
+
+        generator = ircd.LoadGenerator(
+            self._server,
+            'bot',
+            ['#a'],
+            users=10,
+            rate=1,
+            command_every=5,
+            clock=self._clock)
+        generator.start(tick=1)
+        self._clock.advance(1)
+        self.assertEqual(len(self.lines(transport)), 10)
+
+        self._clock.advance(0.5)
+        bot.dataReceived('PRIVMSG #a :0\r\n')
+        generator.stop()
+
+        results = generator.results()
+        self.assertEqual(results['commands'], 2)
+        self.assertEqual(results['messages'], 8)
+        self.assertEqual(results['replies'], 1)
+        self.assertEqual(results['unanswered'], 1)
+        self.assertEqual(results['reply_p50_seconds'], 0.5)
+
+
+def main():
+    unittest.main()
+
+
+if __name__ == '__main__':
+    main()
@@ -1,5 +1,6 @@
 import os
 import tempfile
+import threading
 import unittest
 
 import base
@@ -48,8 +49,10 @@ class KarmaTester(unittest.TestCase):
 
         self.assertEqual(self._proto.msgs[0],
                 ('notice', base.TEST_CHANNEL, '%s karma:' % (base.TEST_CHANNEL,)))
+        self.assertEqual(self._proto.msgs[1],
+                ('notice', base.TEST_CHANNEL, 'you: -1 | me: 1'))
 
-        self.assertEqual(3, len(self._proto.msgs))
+        self.assertEqual(2, len(self._proto.msgs))
 
     def test_cmd2(self):
         self._plugin.add('blah', 'me')
@@ -59,7 +62,62 @@ class KarmaTester(unittest.TestCase):
         self.assertEqual(self._proto.msgs[0],
                 ('notice', base.TEST_CHANNEL, 'blah karma:'))
 
-        self.assertEqual(3, len(self._proto.msgs))
+        self.assertEqual(2, len(self._proto.msgs))
+
+    def test_shared(self):
+        other = base.load_plugin('karma.py', 'Karma', config={'ds': self._path})
+
+        self._plugin.add('#one', 'me')
+        self._plugin.save()
+        other.add('#two', 'you')
+        other.save()
+        self._plugin.add('#one', 'me')
+        self._plugin.save()
+
+        self.assertEqual(other.get_karma('#two'), {'you': 1})
+        self.assertEqual(self._plugin.get_karma('#two'), {'you': 1})
+
+        fresh = base.load_plugin('karma.py', 'Karma', config={'ds': self._path})
+        self.assertEqual(fresh.get_karma('#one'), {'me': 2})
+        self.assertEqual(fresh.get_karma('#two'), {'you': 1})
+
+    def test_modify_while_saving(self):
+        env = self._plugin.save.im_func.func_globals
+        yaml = env['yaml']
+        adding = []
+
+        class SlowYaml(object):
+            load = staticmethod(yaml.load)
+
+            @staticmethod
+            def dump(data, fp):
+                yaml.dump(data, fp)
+                t = threading.Thread(
+                    target=self._plugin.add, args=('#one', 'late'))
+                t.start()
+                t.join(0.1)
+                adding.append(t)
+
+        self._plugin.add('#one', 'me')
+        env['yaml'] = SlowYaml
+        try:
+            self._plugin.save()
+        finally:
+            env['yaml'] = yaml
+        adding[0].join()
+        self._plugin.save()
+
+        fresh = base.load_plugin('karma.py', 'Karma', config={'ds': self._path})
+        self.assertEqual(fresh.get_karma('#one'), {'me': 1, 'late': 1})
+
+    def test_shared_cmd(self):
+        other = base.load_plugin('karma.py', 'Karma', config={'ds': self._path})
+        other.add('#other', 'you')
+        other.save()
+
+        self._proto.privmsg('tester', base.TEST_CHANNEL, '!karma #other')
+        self.assertEqual(self._proto.msgs[1],
+                ('notice', base.TEST_CHANNEL, 'you: 1'))
 
 def main():
     unittest.main()
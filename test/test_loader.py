@@ -0,0 +1,206 @@
+import os
+import shutil
+import tempfile
+import textwrap
+import unittest
+
+import base
+
+import delbert.loader
+import delbert.plugin
+
+
+GREETER = textwrap.dedent("""
+    from twisted.internet import defer
+
+    import delbert.plugin
+
+    LOADED = []
+
+
+    class Greeter(delbert.plugin.Plugin):
+        eager_config = ['listen_port']
+
+        def __init__(self, config={}):
+            super(Greeter, self).__init__('greeter')
+            self.config = config
+            LOADED.append(self)
+
+        @delbert.plugin.irc_command('say hello')
+        def hello(self, user, channel, args):
+            return 'hello %s' % (args,)
+
+        @delbert.plugin.irc_passive('wave back', ['wave'], regex='^o/$')
+        def wave(self, user, channel, msg):
+            return 'o/'
+
+        @delbert.plugin.irc_user_join('greet users', deferred=True)
+        def greet(self, user, channel):
+            return defer.succeed(user)
+
+        @delbert.plugin.irc_command('count slowly')
+        @defer.inlineCallbacks
+        def count(self, user, channel, args):
+            yield None
+""")
+
+EAGER = textwrap.dedent("""
+    import delbert.plugin
+
+
+    class Eager(delbert.plugin.Plugin):
+        lazy = False
+
+        def __init__(self, config={}):
+            super(Eager, self).__init__('eager')
+
+        @delbert.plugin.irc_command('be eager')
+        def eager(self, user, channel, args):
+            pass
+""")
+
+DYNAMIC = textwrap.dedent("""
+    import delbert.plugin
+
+    HELP = 'computed'
+
+
+    class Dynamic(delbert.plugin.Plugin):
+        def __init__(self, config={}):
+            super(Dynamic, self).__init__('dynamic')
+
+        @delbert.plugin.irc_command(HELP)
+        def dynamic(self, user, channel, args):
+            pass
+""")
+
+
+class LoaderTester(unittest.TestCase):
+    def setUp(self):
+        self._dir = tempfile.mkdtemp()
+        self._plugins = os.path.join(self._dir, 'plugins')
+        self._cache = os.path.join(self._dir, 'plugins.manifest')
+        os.mkdir(self._plugins)
+
+        self.write('greeter.py', GREETER)
+        self.write('eager.py', EAGER)
+        self.write('dynamic.py', DYNAMIC)
+
+    def tearDown(self):
+        shutil.rmtree(self._dir)
+
+    def write(self, name, source):
+        with open(os.path.join(self._plugins, name), 'w') as f:
+            f.write(source)
+
+    def load(self, config=None):
+        plugins = delbert.loader.load_plugins(
+            config or {'greeter': {'key': 'value'}},
+            self._plugins,
+            lazy=True,
+            cache=self._cache)
+        return dict((p.name, p) for p in plugins)
+
+    def test_describe(self):
+        description, = delbert.loader.describe(
+            os.path.join(self._plugins, 'greeter.py'))
+
+        self.assertEqual(description['class'], 'Greeter')
+        self.assertEqual(description['name'], 'greeter')
+        self.assertEqual(description['eager_config'], ['listen_port'])
+        self.assertEqual(
+            description['commands'],
+            {
+                'hello': {'help': 'say hello', 'deferred': False},
+                'count': {'help': 'count slowly', 'deferred': True},
+            })
+        self.assertEqual(
+            description['passives']['wave']['triggers'],
+            delbert.plugin.compile_triggers(['wave'], regex='^o/$'))
+        self.assertTrue(description['user_joins']['greet']['deferred'])
+
+        for name in ('eager.py', 'dynamic.py'):
+            self.assertIsNone(delbert.loader.describe(
+                os.path.join(self._plugins, name)))
+
+    def test_lazy(self):
+        plugins = self.load()
+        greeter = plugins['greeter']
+        self.assertIsInstance(greeter, delbert.loader.LazyPlugin)
+        self.assertFalse(greeter.active)
+        self.assertEqual(greeter.commands['hello'].help, 'say hello')
+        self.assertEqual(
+            greeter.triggers['wave'],
+            delbert.plugin.compile_triggers(['wave'], regex='^o/$'))
+
+        # Plugins that cannot be described are loaded straight away.
+        self.assertNotIsInstance(
+            plugins['eager'], delbert.loader.LazyPlugin)
+        self.assertNotIsInstance(
+            plugins['dynamic'], delbert.loader.LazyPlugin)
+
+        greeter.initialize(base.TEST_NICK, None, None)
+        self.assertEqual(
+            greeter.commands['hello']('user', '#a', 'there'),
+            'hello there')
+        self.assertTrue(greeter.active)
+
+        p = greeter.activate()
+        self.assertEqual(p.config, {'key': 'value'})
+        self.assertEqual(p.nickname, base.TEST_NICK)
+
+        module = delbert.loader.load_module(
+            os.path.join(self._plugins, 'greeter.py'))
+        self.assertEqual(module.LOADED, [p])
+
+    def test_drain(self):
+        greeter = self.load()['greeter']
+        hello = greeter.commands['hello']
+        self.assertIs(delbert.plugin.owner(hello), greeter)
+
+        # Jobs queued before the plugin is loaded are waited for.
+        leave = greeter.queued()
+        drained = []
+        greeter.drain().addCallback(drained.append)
+        greeter.initialize(base.TEST_NICK, None, None)
+        hello('user', '#a', 'there')
+        self.assertEqual(drained, [])
+        leave(None)
+        self.assertEqual(len(drained), 1)
+
+    def test_eager_config(self):
+        greeter = self.load({'greeter': {'listen_port': 8080}})['greeter']
+        self.assertIsInstance(greeter, delbert.loader.LazyPlugin)
+        self.assertTrue(greeter.active)
+
+    def test_manifest_cache(self):
+        self.load()
+        self.assertTrue(os.path.exists(self._cache))
+
+        manifest = delbert.loader.Manifest(self._plugins, self._cache)
+        for pfile in manifest.files():
+            manifest.get(pfile)
+        self.assertEqual(manifest.described, 0)
+
+        # Changed plugins are described again.
+        self.write('greeter.py', GREETER.replace('say hello', 'say hi'))
+        os.utime(os.path.join(self._plugins, 'greeter.py'), (0, 0))
+        manifest = delbert.loader.Manifest(self._plugins, self._cache)
+        description, = manifest.get('greeter.py')
+        self.assertEqual(manifest.described, 1)
+        self.assertEqual(description['commands']['hello']['help'], 'say hi')
+
+    def test_plugins(self):
+        path = os.path.join(os.path.dirname(__file__), '..', 'plugins')
+        manifest = delbert.loader.Manifest(path)
+
+        eager = [f for f in manifest.files() if manifest.get(f) is None]
+        self.assertEqual(eager, ['source.py'])
+
+
+def main():
+    unittest.main()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,160 @@
+import unittest
+
+from twisted.internet import defer, task
+from twisted.test import proto_helpers
+from twisted.web.test import requesthelper
+
+import base
+
+import delbert.bot
+import delbert.metrics
+import delbert.plugin
+
+
+class TimedPlugin(delbert.plugin.Plugin):
+    def __init__(self, config=None):
+        super(TimedPlugin, self).__init__('timed')
+        self.pending = defer.Deferred()
+
+    @delbert.plugin.irc_command('wait for pending', deferred=True)
+    def wait(self, user, channel, args):
+        return self.pending
+
+    @delbert.plugin.irc_command('fail', deferred=True)
+    def fail(self, user, channel, args):
+        raise ValueError('failed')
+
+
+class TestFactory(delbert.bot.BotFactory):
+    def _load_plugins(self, path='plugins'):
+        return [TimedPlugin()]
+
+
+class RegistryTester(unittest.TestCase):
+    def setUp(self):
+        self._registry = delbert.metrics.Registry()
+
+    def test_counter(self):
+        counter = self._registry.counter('calls', 'Calls.', ('name',))
+        counter.inc('a')
+        counter.inc('a', amount=2)
+        counter.inc('b"c')
+
+        self.assertEqual(counter.value('a'), 3)
+        self.assertEqual(
+            self._registry.render().splitlines(),
+            [
+                '# HELP calls Calls.',
+                '# TYPE calls counter',
+                'calls{name="a"} 3.0',
+                'calls{name="b\\"c"} 1.0',
+            ])
+
+        # The same metric is returned for the same name.
+        self.assertIs(
+            self._registry.counter('calls', 'Calls.', ('name',)), counter)
+        with self.assertRaises(ValueError):
+            self._registry.gauge('calls', 'Calls.')
+        with self.assertRaises(ValueError):
+            counter.inc()
+
+    def test_gauge(self):
+        queue = []
+        gauge = self._registry.gauge('queue', 'Queue length.')
+        gauge.set_function(lambda: len(queue))
+        queue.extend([1, 2])
+        self.assertEqual(gauge.value(), 2)
+        self.assertIn('queue 2.0', self._registry.render().splitlines())
+
+    def test_histogram(self):
+        histogram = self._registry.histogram(
+            'latency', 'Latency.', buckets=(0.1, 1))
+        for value in (0.05, 0.1, 0.5, 5):
+            histogram.observe(value)
+
+        self.assertEqual(
+            self._registry.render().splitlines()[2:],
+            [
+                'latency_bucket{le="0.1"} 2',
+                'latency_bucket{le="1.0"} 3',
+                'latency_bucket{le="+Inf"} 4',
+                'latency_sum 5.65',
+                'latency_count 4',
+            ])
+
+    def test_resource(self):
+        self._registry.counter('calls', 'Calls.').inc()
+        request = requesthelper.DummyRequest([''])
+        body = delbert.metrics.MetricsResource(self._registry).render_GET(
+            request)
+
+        self.assertIn('calls 1.0', body.splitlines())
+        self.assertTrue(
+            request.responseHeaders.getRawHeaders('content-type')[0]
+            .startswith('text/plain'))
+
+
+class HandlerMetricsTester(unittest.TestCase):
+    def setUp(self):
+        self._clock = task.Clock()
+        self._registry = delbert.metrics.Registry()
+        self._factory = TestFactory(
+            {
+                'nick': base.TEST_NICK,
+                'pass': 'pw',
+                'dbdir': '/tmp',
+                'channels': {'#a': None},
+                'flood': {'rate': 1, 'burst': 1},
+                'sasl': False,
+            },
+            self._clock,
+            registry=self._registry)
+
+        self._proto = self._factory.buildProtocol(None)
+        self._proto.makeConnection(proto_helpers.StringTransport())
+        self._proto.irc_RPL_WELCOME('server', [base.TEST_NICK, 'Welcome'])
+        self._proto.irc_RPL_ENDOFMOTD('server', [base.TEST_NICK, 'End'])
+
+    def metric(self, name, kind='counter'):
+        return getattr(self._registry, kind)(name, '', ('kind', 'handler'))
+
+    def test_handlers(self):
+        self._proto.privmsg('user!u@host', '#a', '!wait')
+        self._proto.privmsg('user!u@host', '#a', '!fail')
+
+        calls = self.metric('delbert_handler_calls_total')
+        errors = self.metric('delbert_handler_errors_total')
+        run = self.metric('delbert_handler_run_seconds', 'histogram')
+        self.assertEqual(calls.value('command', 'wait'), 1)
+        self.assertEqual(calls.value('command', 'fail'), 1)
+        self.assertEqual(errors.value('command', 'fail'), 1)
+        self.assertEqual(run.count('command', 'wait'), 0)
+
+        self._factory.plugins[0].pending.callback(None)
+        self.assertEqual(run.count('command', 'wait'), 1)
+        self.assertEqual(errors.value('command', 'wait'), 0)
+
+    def test_outbound(self):
+        queue = self._registry.gauge(
+            'delbert_outbound_queue_lines', '', ('network',))
+        delay = self._registry.histogram(
+            'delbert_outbound_delay_seconds', '', ('network',))
+        network = self._factory.name
+
+        self._clock.pump([1] * 5)
+        before = delay.count(network)
+        for line in ('one', 'two', 'three'):
+            self._proto.send_msg('#a', line)
+        self.assertTrue(queue.value(network) > 0)
+
+        self._clock.pump([1] * 5)
+        self.assertEqual(queue.value(network), 0)
+        self.assertEqual(delay.count(network), before + 3)
+
+
+def main():
+    unittest.main()
+
+
+if __name__ == '__main__':
+    main()
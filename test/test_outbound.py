@@ -0,0 +1,261 @@
+import threading
+import unittest
+
+from twisted.internet import task
+from twisted.python import context, log, threadable
+from twisted.test import proto_helpers
+
+import base
+
+import delbert.bot
+import delbert.outbound
+
+
+class SchedulerTester(unittest.TestCase):
+    def setUp(self):
+        self._clock = task.Clock()
+        self._sent = []
+        self._scheduler = delbert.outbound.OutboundScheduler(
+            rate=2, burst=3, clock=self._clock)
+        self._scheduler.start(self._sent.append)
+
+    def test_burst(self):
+        for i in range(5):
+            self._scheduler.push(str(i), '#a')
+
+        self.assertEqual(self._sent, ['0', '1', '2'])
+        self.assertEqual(2, len(self._scheduler))
+
+        self._clock.advance(0.5)
+        self.assertEqual(self._sent, ['0', '1', '2', '3'])
+        self._clock.advance(0.5)
+        self.assertEqual(self._sent, ['0', '1', '2', '3', '4'])
+        self.assertEqual(0, len(self._scheduler))
+        self.assertFalse(self._clock.getDelayedCalls())
+
+    def test_refill(self):
+        for i in range(3):
+            self._scheduler.push(str(i), '#a')
+        self._clock.advance(10)
+
+        for i in range(4):
+            self._scheduler.push(str(i), '#a')
+        self.assertEqual(6, len(self._sent))
+
+    def test_round_robin(self):
+        for i in range(3):
+            self._scheduler.push('a%d' % (i,), '#a')
+        for i in range(4):
+            self._scheduler.push('a%d' % (i + 3,), '#a')
+            self._scheduler.push('b%d' % (i,), '#b')
+        self._scheduler.push('c0', 'c')
+
+        self._clock.pump([0.5] * 9)
+        self.assertEqual(
+                self._sent,
+                ['a0', 'a1', 'a2', 'a3', 'b0', 'c0', 'a4', 'b1', 'a5', 'b2',
+                 'a6', 'b3'])
+
+    def test_priority(self):
+        for i in range(3):
+            self._scheduler.push('x', '#a')
+        self._scheduler.push('passive', '#a', delbert.outbound.PASSIVE)
+        self._scheduler.push('default', '#b')
+        self._scheduler.push('command', '#b', delbert.outbound.COMMAND)
+        self._scheduler.push('PONG', None, delbert.outbound.CONTROL)
+
+        self._clock.pump([0.5] * 4)
+        self.assertEqual(
+                self._sent[3:],
+                ['PONG', 'command', 'default', 'passive'])
+
+    def test_stop(self):
+        for i in range(5):
+            self._scheduler.push(str(i), '#a')
+        self._scheduler.stop()
+        self._clock.advance(10)
+        self.assertEqual(3, len(self._sent))
+        self.assertFalse(self._clock.getDelayedCalls())
+
+        sent = []
+        self._scheduler.start(sent.append)
+        self.assertEqual(sent, ['3', '4'])
+
+    def test_stop_while_writing(self):
+        # The connection is lost while the second line is written.
+        self._scheduler.stop()
+
+        def write(line):
+            self._sent.append(line)
+            if len(self._sent) == 2:
+                self._scheduler.stop()
+
+        for i in range(5):
+            self._scheduler.push(str(i), '#a')
+        self._scheduler.start(write)
+        self.assertEqual(self._sent, ['0', '1'])
+        self.assertEqual(3, len(self._scheduler))
+        self.assertFalse(self._clock.getDelayedCalls())
+
+
+class ProtocolTester(unittest.TestCase):
+    def setUp(self):
+        self._clock = task.Clock()
+        scheduler = delbert.outbound.OutboundScheduler(
+            rate=1, burst=2, clock=self._clock)
+        self._proto = delbert.bot.BotProtocol(
+            base.TEST_NICK, 'pw', {}, scheduler)
+        self._transport = proto_helpers.StringTransport()
+        self._proto.makeConnection(self._transport)
+        self._proto.irc_RPL_WELCOME('server', [base.TEST_NICK, 'Welcome'])
+        self._proto.irc_RPL_ENDOFMOTD('server', [base.TEST_NICK, 'End'])
+        self._clock.advance(10)
+        self._transport.clear()
+
+    def lines(self):
+        return self._transport.value().splitlines()
+
+    def test_priority(self):
+        self._proto.send_msg('#a', 'one')
+        self._proto.send_msg('#a', 'two')
+        context.call(
+            {delbert.outbound.PRIORITY: delbert.outbound.PASSIVE},
+            self._proto.send_msg, '#a', 'passive')
+        context.call(
+            {delbert.outbound.PRIORITY: delbert.outbound.COMMAND},
+            self._proto.send_notice, '#b', 'command')
+        self._proto.join('#c')
+
+        self._clock.pump([1] * 3)
+        self.assertEqual(
+                self.lines(),
+                [
+                    'PRIVMSG #a :one',
+                    'PRIVMSG #a :two',
+                    'JOIN #c',
+                    'NOTICE #b :command',
+                    'PRIVMSG #a :passive',
+                ])
+
+    def test_disconnect(self):
+        for i in range(3):
+            self._proto.send_msg('#a', str(i))
+        self._proto.connectionLost(None)
+        self.assertFalse(self._clock.getDelayedCalls())
+
+
+class FakeReactor(object):
+    def __init__(self):
+        self.wakeups = []
+
+    def callFromThread(self, f, *args, **kwds):
+        self.wakeups.append((f, args, kwds))
+
+    def run(self):
+        wakeups, self.wakeups = self.wakeups, []
+        for f, args, kwds in wakeups:
+            f(*args, **kwds)
+
+
+class HandoffTester(unittest.TestCase):
+    def setUp(self):
+        # Pretend the reactor is running in this thread.
+        self._io_thread = threadable.ioThread
+        threadable.ioThread = threadable.getThreadID()
+        self._reactor = FakeReactor()
+        self._handoff = delbert.outbound.Handoff(self._reactor)
+        self._called = []
+
+    def tearDown(self):
+        threadable.ioThread = self._io_thread
+
+    def in_thread(self, f, *args):
+        worker = threading.Thread(target=f, args=args)
+        worker.start()
+        worker.join()
+
+    def call(self, value):
+        self._called.append(
+            (value, context.get(delbert.outbound.PRIORITY)))
+
+    def test_batch(self):
+        def send():
+            for i in range(3):
+                context.call(
+                    {delbert.outbound.PRIORITY: i},
+                    self._handoff.call, self.call, i)
+
+        self.in_thread(send)
+        self.assertEqual(self._called, [])
+        self.assertEqual(len(self._handoff), 3)
+        self.assertEqual(len(self._reactor.wakeups), 1)
+
+        self._reactor.run()
+        self.assertEqual(self._called, [(0, 0), (1, 1), (2, 2)])
+        self.assertEqual(self._handoff.calls, 3)
+
+        # The next batch wakes the reactor up again.
+        self.in_thread(self._handoff.call, self.call, 3)
+        self.assertEqual(len(self._reactor.wakeups), 1)
+        self._reactor.run()
+        self.assertEqual(self._called[-1], (3, None))
+        self.assertEqual(self._handoff.wakeups, 2)
+
+    def test_protocol(self):
+        clock = task.Clock()
+        scheduler = delbert.outbound.OutboundScheduler(
+            rate=1, burst=5, clock=clock)
+        proto = delbert.bot.BotProtocol(
+            base.TEST_NICK, 'pw', {}, scheduler, self._handoff)
+        transport = proto_helpers.StringTransport()
+        proto.makeConnection(transport)
+        proto.irc_RPL_WELCOME('server', [base.TEST_NICK, 'Welcome'])
+        proto.irc_RPL_ENDOFMOTD('server', [base.TEST_NICK, 'End'])
+        clock.advance(10)
+        transport.clear()
+
+        def handler():
+            proto.send_msg('#a', 'one')
+            proto.send_lines('#a', iter(['two', 'three']), notice=True)
+
+        self.in_thread(
+            context.call,
+            {delbert.outbound.PRIORITY: delbert.outbound.PASSIVE},
+            handler)
+        self.assertEqual(transport.value(), '')
+        self.assertEqual(len(self._reactor.wakeups), 1)
+
+        self._reactor.run()
+        self.assertEqual(
+            transport.value().splitlines(),
+            ['PRIVMSG #a :one', 'NOTICE #a :two | three'])
+
+    def test_reactor_thread(self):
+        self._handoff.call(self.call, 0)
+        self.assertEqual(self._called, [(0, None)])
+        self.assertEqual(self._reactor.wakeups, [])
+
+    def test_error(self):
+        def fail():
+            raise ValueError('failed')
+
+        errors = []
+        log.addObserver(errors.append)
+        try:
+            self.in_thread(self._handoff.call, fail)
+            self.in_thread(self._handoff.call, self.call, 0)
+            self._reactor.run()
+        finally:
+            log.removeObserver(errors.append)
+
+        # A failing call does not stop the rest of the batch.
+        self.assertEqual(self._called, [(0, None)])
+        self.assertEqual([e['isError'] for e in errors], [1])
+
+
+def main():
+    unittest.main()
+
+
+if __name__ == '__main__':
+    main()
@@ -1,9 +1,13 @@
 import os
 import sys
+import threading
 import unittest
 
+from twisted.internet import defer
+
 import base
 
+import delbert.bot
 import delbert.plugin
 
 
@@ -50,6 +54,66 @@ class ConfigPlugin(delbert.plugin.Plugin):
     def cmd2(self, user, channel, args):
         self._proto.send_msg(channel, 'cmd2')
 
+class TriggerPlugin(delbert.plugin.Plugin):
+    def __init__(self):
+        super(TriggerPlugin, self).__init__('trigger-plugin')
+        self.set_triggers('configured', keywords=['later'])
+
+    @delbert.plugin.irc_passive('substring passive', substrings=['++'])
+    def plus(self, user, channel, msg):
+        self._proto.send_msg(channel, 'plus')
+
+    @delbert.plugin.irc_passive('keyword passive', keywords=['bang'])
+    def bang(self, user, channel, msg):
+        self._proto.send_msg(channel, 'bang')
+
+    @delbert.plugin.irc_passive('regex passive', regex='[0-9]{3}')
+    def digits(self, user, channel, msg):
+        self._proto.send_msg(channel, 'digits')
+
+    @delbert.plugin.irc_passive('configured passive', keywords=['sooner'])
+    def configured(self, user, channel, msg):
+        self._proto.send_msg(channel, 'configured')
+
+
+class FailPlugin(delbert.plugin.Plugin):
+    def __init__(self):
+        super(FailPlugin, self).__init__('fail-plugin')
+
+    @delbert.plugin.irc_passive('failing passive', keywords=['bang'])
+    def fail(self, user, channel, msg):
+        raise ValueError(msg)
+
+
+class AsyncPlugin(delbert.plugin.Plugin):
+    def __init__(self):
+        super(AsyncPlugin, self).__init__('async-plugin')
+        self.threads = []
+
+    @delbert.plugin.irc_command('generator command')
+    def gen(self, user, channel, args):
+        self.threads.append(threading.current_thread())
+        msg = yield defer.succeed('gen %s' % (args,))
+        self._proto.send_msg(channel, msg)
+        defer.returnValue(msg)
+
+    @delbert.plugin.irc_command('deferred command', deferred=True)
+    def later(self, user, channel, args):
+        self.threads.append(threading.current_thread())
+        d = defer.succeed('later')
+        d.addCallback(lambda msg: self._proto.send_msg(channel, msg))
+        return d
+
+    @delbert.plugin.irc_passive('inline callbacks passive', keywords=['boom'])
+    @defer.inlineCallbacks
+    def boom(self, user, channel, msg):
+        msg = yield defer.succeed('boom')
+        self._proto.send_msg(channel, msg)
+
+    @delbert.plugin.irc_user_join('threaded user join')
+    def threaded(self, user, channel):
+        pass
+
 
 class PluginTester(unittest.TestCase):
     def setUp(self):
@@ -82,23 +146,24 @@ class PluginTester(unittest.TestCase):
 
     def test_help(self):
         self._proto.privmsg('tester', base.TEST_CHANNEL, '!help')
-        self.assertEqual(4, len(self._proto.msgs))
+        self.assertEqual(1, len(self._proto.msgs))
         self.assertEqual(
                 self._proto.msgs,
                 [
-                    ('notice', base.TEST_CHANNEL, 'cmd1:  cmd1 help'),
-                    ('notice', base.TEST_CHANNEL, 'notice_f:  notice_f help'),
-                    ('notice', base.TEST_CHANNEL, 'say_f:  say_f help'),
-                    ('notice', base.TEST_CHANNEL, 'say_g:  say_g help'),
+                    ('notice', base.TEST_CHANNEL, ' | '.join([
+                        'cmd1:  cmd1 help',
+                        'notice_f:  notice_f help',
+                        'say_f:  say_f help',
+                        'say_g:  say_g help'])),
                 ],)
 
     def test_help2(self):
         self._proto.privmsg('tester', base.TEST_CHANNEL, '!help say')
-        self.assertEqual(2, len(self._proto.msgs))
+        self.assertEqual(1, len(self._proto.msgs))
         self.assertEqual(self._proto.msgs,
                 [
-                    ('notice', base.TEST_CHANNEL, 'say_f:  say_f help'),
-                    ('notice', base.TEST_CHANNEL, 'say_g:  say_g help'),
+                    ('notice', base.TEST_CHANNEL,
+                        'say_f:  say_f help | say_g:  say_g help'),
                 ],)
 
     def test_help_passives(self):
@@ -135,6 +200,149 @@ class PluginTester(unittest.TestCase):
         self.assertEqual(self._proto.msgs[0], ('msg', 'tester', 'secret f'))
 
 
+class TriggerTester(unittest.TestCase):
+    def setUp(self):
+        self._proto = base.TestProto([TriggerPlugin(), TestPlugin()])
+
+    def test_no_match(self):
+        channel = self._proto._channels[base.TEST_CHANNEL]
+        self.assertEqual(
+                [name for name, _ in channel.match_passives('nothing here')],
+                ['hammer'])
+
+    def test_substring(self):
+        self._proto.privmsg('tester', base.TEST_CHANNEL, 'me++')
+        self.assertEqual(self._proto.msgs, [('msg', base.TEST_CHANNEL, 'plus')])
+
+    def test_keyword(self):
+        self._proto.privmsg('tester', base.TEST_CHANNEL, 'bangers')
+        self.assertEqual(0, len(self._proto.msgs))
+
+        self._proto.privmsg('tester', base.TEST_CHANNEL, 'big bang')
+        self.assertEqual(self._proto.msgs, [('msg', base.TEST_CHANNEL, 'bang')])
+
+    def test_regex(self):
+        self._proto.privmsg('tester', base.TEST_CHANNEL, 'room 12')
+        self.assertEqual(0, len(self._proto.msgs))
+
+        self._proto.privmsg('tester', base.TEST_CHANNEL, 'room 123')
+        self.assertEqual(self._proto.msgs, [('msg', base.TEST_CHANNEL, 'digits')])
+
+    def test_set_triggers(self):
+        self._proto.privmsg('tester', base.TEST_CHANNEL, 'sooner')
+        self.assertEqual(0, len(self._proto.msgs))
+
+        self._proto.privmsg('tester', base.TEST_CHANNEL, 'sooner or later')
+        self.assertEqual(self._proto.msgs, [('msg', base.TEST_CHANNEL, 'configured')])
+
+    def test_multiple(self):
+        self._proto.privmsg('tester', base.TEST_CHANNEL, 'bang++ 999 stop')
+        self.assertEqual(
+                self._proto.msgs,
+                [
+                    ('msg', base.TEST_CHANNEL, 'bang'),
+                    ('msg', base.TEST_CHANNEL, 'digits'),
+                    ('msg', base.TEST_CHANNEL, 'hammertime'),
+                    ('msg', base.TEST_CHANNEL, 'plus'),
+                ],)
+
+
+class BatchTester(unittest.TestCase):
+    def setUp(self):
+        self._proto = base.TestProto([FailPlugin(), TriggerPlugin()])
+        self._batches = []
+        self._errors = []
+
+        run_passives = self._proto._run_passives
+
+        def record_batch(*args):
+            self._batches.append([name for name, _ in args[-1]])
+            run_passives(*args)
+
+        def record_error(msg, result, system):
+            self._errors.append((msg.split(' after ')[0], result.type))
+
+        self._proto._run_passives = record_batch
+        self._proto._log_callback = record_error
+
+    def test_single(self):
+        self._proto.privmsg('tester', base.TEST_CHANNEL, 'me++')
+        self.assertEqual(self._batches, [])
+        self.assertEqual(self._proto.msgs, [('msg', base.TEST_CHANNEL, 'plus')])
+
+    def test_batch(self):
+        self._proto.privmsg('tester', base.TEST_CHANNEL, 'bang++ 999')
+        self.assertEqual(self._batches, [['bang', 'digits', 'fail', 'plus']])
+        self.assertEqual(
+                self._proto.msgs,
+                [
+                    ('msg', base.TEST_CHANNEL, 'bang'),
+                    ('msg', base.TEST_CHANNEL, 'digits'),
+                    ('msg', base.TEST_CHANNEL, 'plus'),
+                ],)
+        self.assertEqual(self._errors, [('passive fail failed', ValueError)])
+
+    def test_unbatched(self):
+        self._proto.batch_passives = False
+        self._proto.privmsg('tester', base.TEST_CHANNEL, 'me++ 999')
+        self.assertEqual(self._batches, [])
+        self.assertEqual(
+                self._proto.msgs,
+                [
+                    ('msg', base.TEST_CHANNEL, 'digits'),
+                    ('msg', base.TEST_CHANNEL, 'plus'),
+                ],)
+
+
+class AsyncTester(unittest.TestCase):
+    def setUp(self):
+        self._plugin = AsyncPlugin()
+        self._proto = base.TestProto([self._plugin, TriggerPlugin()])
+
+    def test_detect(self):
+        self.assertTrue(self._plugin.commands['gen'].is_deferred)
+        self.assertTrue(self._plugin.commands['later'].is_deferred)
+        self.assertTrue(self._plugin.passives['boom'].is_deferred)
+        self.assertFalse(self._plugin.user_joins['threaded'].is_deferred)
+
+    def test_reactor_call(self):
+        results = []
+        d = delbert.bot.BotProtocol._call(
+            self._proto,
+            self._plugin.commands['gen'],
+            'tester',
+            base.TEST_CHANNEL,
+            'x',
+            cb=results.append)
+
+        self.assertTrue(d.called)
+        self.assertEqual(results, ['gen x'])
+        self.assertEqual(self._plugin.threads, [threading.current_thread()])
+        self.assertEqual(self._proto.msgs, [('msg', base.TEST_CHANNEL, 'gen x')])
+
+    def test_deferred_cmd(self):
+        self._proto.privmsg('tester', base.TEST_CHANNEL, '!later')
+        self.assertEqual(self._proto.msgs, [('msg', base.TEST_CHANNEL, 'later')])
+
+    def test_not_batched(self):
+        batches = []
+        self._proto._run_passives = lambda *args: batches.append(args[-1])
+
+        self._proto.privmsg('tester', base.TEST_CHANNEL, 'boom bang')
+        self.assertEqual(batches, [])
+        self.assertEqual(
+                self._proto.msgs,
+                [
+                    ('msg', base.TEST_CHANNEL, 'bang'),
+                    ('msg', base.TEST_CHANNEL, 'boom'),
+                ],)
+
+        self._proto.clear()
+        self._proto.privmsg('tester', base.TEST_CHANNEL, 'boom bang 999')
+        self.assertEqual([[n for n, _ in b] for b in batches], [['bang', 'digits']])
+        self.assertEqual(self._proto.msgs, [('msg', base.TEST_CHANNEL, 'boom')])
+
+
 def main():
     unittest.main()
 
@@ -0,0 +1,214 @@
+import os
+import Queue
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+from twisted.internet import defer, task
+from twisted.test import proto_helpers
+
+import base
+
+import delbert.bot
+import delbert.plugin
+import delbert.profiler
+
+
+class ThreadClock(task.Clock):
+    """
+    Clock taking the calls handed back from the sampling thread, run by
+    flush().
+    """
+    def __init__(self):
+        task.Clock.__init__(self)
+        self._calls = Queue.Queue()
+
+    def callFromThread(self, f, *args, **kwds):
+        self._calls.put((f, args, kwds))
+
+    def flush(self):
+        f, args, kwds = self._calls.get(timeout=5)
+        f(*args, **kwds)
+
+
+def spin(stop):
+    while not stop.is_set():
+        sum(range(100))
+
+
+class NoopPlugin(delbert.plugin.Plugin):
+    def __init__(self, config=None):
+        super(NoopPlugin, self).__init__('noop')
+
+    @delbert.plugin.irc_command('do nothing', deferred=True)
+    def noop(self, user, channel, args):
+        return defer.succeed(None)
+
+
+class TestFactory(delbert.bot.BotFactory):
+    def _load_plugins(self, path='plugins'):
+        return [NoopPlugin()]
+
+
+class ProfilerTester(unittest.TestCase):
+    def setUp(self):
+        self._dir = tempfile.mkdtemp()
+        self._clock = ThreadClock()
+        self._profiler = delbert.profiler.SamplingProfiler(
+            self._dir,
+            interval=0.001,
+            max_duration=60,
+            clock=self._clock)
+
+    def tearDown(self):
+        if self._profiler.stop() is not None:
+            self._clock.flush()
+        shutil.rmtree(self._dir)
+
+    def test_duration(self):
+        stop = threading.Event()
+        worker = threading.Thread(target=spin, args=(stop,))
+        worker.start()
+        try:
+            lines = []
+            self._profiler.start(duration=5).addCallback(lines.extend)
+            time.sleep(0.1)
+            self.assertTrue(self._profiler.running)
+
+            self._clock.advance(5)
+            self._clock.flush()
+            self.assertFalse(self._profiler.running)
+        finally:
+            stop.set()
+            worker.join()
+
+        self.assertTrue(lines[0].startswith('Profiled'))
+        self.assertTrue(any(
+            'spin (test_profiler.py' in line for line in lines[1:]))
+
+        path = lines[0].split(': ')[-1]
+        self.assertEqual(os.path.dirname(path), self._dir)
+        with open(path) as f:
+            stacks = f.read().splitlines()
+        self.assertTrue(any(
+            s.startswith('worker;') and ';spin (test_profiler.py' in s
+            for s in stacks))
+
+    def test_calls(self):
+        lines = []
+        self._profiler.start(calls=2).addCallback(lines.extend)
+        self._profiler.handled()
+        self.assertTrue(self._profiler.running)
+        self._profiler.handled()
+
+        # Calls finishing while the profile is written are not counted.
+        self._profiler.handled()
+        self.assertEqual(lines, [])
+        self._clock.flush()
+        self.assertFalse(self._profiler.running)
+        self.assertIn('2 handler calls', lines[0])
+
+    def test_stop(self):
+        # The reactor does not wait for the sampling thread.
+        writing = threading.Event()
+        write = self._profiler._write
+
+        def blocked():
+            writing.wait()
+            return write()
+
+        lines = []
+        self._profiler._write = blocked
+        self._profiler.start().addCallback(lines.extend)
+        self._profiler.stop()
+        self.assertTrue(self._profiler.running)
+        self.assertEqual(lines, [])
+
+        writing.set()
+        self._clock.flush()
+        self.assertFalse(self._profiler.running)
+        self.assertTrue(lines[0].startswith('Profiled'))
+
+    def test_max_duration(self):
+        self._profiler.start(duration=1000)
+        self._clock.advance(60)
+        self._clock.flush()
+        self.assertFalse(self._profiler.running)
+
+    def test_command(self):
+        lines = []
+        d = self._profiler.command('admin!a@host', '10')
+        d.addCallback(lines.extend)
+
+        self.assertEqual(
+            self._profiler.command('admin!a@host', ''),
+            ['Already profiling'])
+        self.assertEqual(self._profiler.command('admin!a@host', 'stop'), [])
+        self._clock.flush()
+        self.assertEqual(len(lines), 1)
+        self.assertEqual(
+            self._profiler.command('admin!a@host', 'stop'),
+            ['Not profiling'])
+        self.assertEqual(
+            self._profiler.command('admin!a@host', 'a b c'),
+            ['Usage: profile [SECONDS | N calls | stop]'])
+
+
+class BotProfilerTester(unittest.TestCase):
+    def setUp(self):
+        self._dir = tempfile.mkdtemp()
+        self._clock = ThreadClock()
+        self._factory = TestFactory(
+            {
+                'nick': base.TEST_NICK,
+                'pass': 'pw',
+                'dbdir': self._dir,
+                'channels': {'#a': None},
+                'flood': {'rate': 100, 'burst': 100},
+                'sasl': False,
+                'admins': ['admin!*@trusted.host'],
+            },
+            self._clock)
+
+        profiler = delbert.profiler.SamplingProfiler(
+            self._dir,
+            clock=self._clock)
+        self._factory.profiler = profiler
+        self._factory.admin_commands['profile'] = profiler.command
+
+        self._proto = self._factory.buildProtocol(None)
+        self._transport = proto_helpers.StringTransport()
+        self._proto.makeConnection(self._transport)
+        self._proto.irc_RPL_WELCOME('server', [base.TEST_NICK, 'Welcome'])
+        self._proto.irc_RPL_ENDOFMOTD('server', [base.TEST_NICK, 'End'])
+        self._clock.advance(1)
+        self._transport.clear()
+
+    def tearDown(self):
+        if self._factory.profiler.stop() is not None:
+            self._clock.flush()
+        shutil.rmtree(self._dir)
+
+    def test_profile(self):
+        self._proto.privmsg(
+            'admin!a@trusted.host', base.TEST_NICK, '!profile 2 calls')
+        self._proto.privmsg('user!u@host', '#a', '!noop')
+        self.assertTrue(self._factory.profiler.running)
+        self._proto.privmsg('user!u@host', '#a', '!noop')
+        self._clock.flush()
+        self.assertFalse(self._factory.profiler.running)
+
+        self._clock.advance(1)
+        lines = self._transport.value().splitlines()
+        self.assertTrue(lines[0].startswith('NOTICE admin :Profiled'))
+        self.assertIn('2 handler calls', lines[0])
+
+
+def main():
+    unittest.main()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,224 @@
+import os
+import shutil
+import tempfile
+import textwrap
+import unittest
+
+from twisted.internet import defer, task
+
+import base
+
+import delbert.channels
+import delbert.reloader
+
+
+ECHO = textwrap.dedent("""
+    from twisted.internet import defer
+
+    import delbert.plugin
+
+    VERSION = %(version)d
+    CALLS = []
+    SHUTDOWN = []
+
+
+    class Echo(delbert.plugin.Plugin):
+        def __init__(self, config={}):
+            super(Echo, self).__init__('echo')
+
+        @delbert.plugin.irc_command('echo version %(version)d')
+        def echo(self, user, channel, args):
+            return VERSION
+
+        @delbert.plugin.irc_command('wait for a while', deferred=True)
+        def wait(self, user, channel, args):
+            d = defer.Deferred()
+            CALLS.append(d)
+            return d
+
+        @delbert.plugin.irc_passive('version %(version)d', ['v%(version)d'])
+        def passive(self, user, channel, msg):
+            pass
+
+        def shutdown(self):
+            SHUTDOWN.append(self)
+""")
+
+
+class ReloaderTester(unittest.TestCase):
+    def setUp(self):
+        self._dir = tempfile.mkdtemp()
+        self._clock = task.Clock()
+        self.write('echo.py', 1)
+
+        self._reloader = delbert.reloader.Reloader(
+            {},
+            self._dir,
+            lazy=False,
+            clock=self._clock)
+        self._plugins = self._reloader.load()
+
+        self._channel = delbert.channels.Channel('#a', {})
+        self._channel.set_plugins(self._plugins)
+        self._reloader.attach([self._channel], base.TEST_NICK, None)
+
+    def tearDown(self):
+        self._reloader.stop()
+        shutil.rmtree(self._dir)
+
+    def write(self, name, version, source=ECHO):
+        path = os.path.join(self._dir, name)
+        with open(path, 'w') as f:
+            f.write(source % {'version': version})
+
+        # Make the change visible even within the resolution of mtime.
+        os.utime(path, (version, version))
+
+    def reload(self, pfiles=None):
+        result = []
+        self._reloader.reload(pfiles).addCallback(result.extend)
+        return result
+
+    def test_reload(self):
+        old = self._plugins[0]
+        self.assertEqual(self._channel.commands['echo']('u', '#a', ''), 1)
+
+        self.write('echo.py', 2)
+        self.assertEqual(self._reloader.changed(), ['echo.py'])
+        self.assertEqual(self.reload(), ['echo.py'])
+        self.assertEqual(self._reloader.changed(), [])
+
+        self.assertEqual(self._channel.commands['echo']('u', '#a', ''), 2)
+        self.assertEqual(self._channel.commands['echo'].help, 'echo version 2')
+        self.assertEqual(
+            [name for name, _ in self._channel.match_passives('v2')],
+            ['passive'])
+        self.assertEqual(self._channel.match_passives('v1'), [])
+
+        # The list shared with the factories is updated in place.
+        self.assertEqual(len(self._plugins), 1)
+        self.assertIsNot(self._plugins[0], old)
+        self.assertEqual(self._plugins[0].nickname, base.TEST_NICK)
+        self.assertEqual(self._channel.plugins, self._plugins)
+
+        # The old plugin keeps its module.
+        self.assertEqual(old.commands['echo']('u', '#a', ''), 1)
+
+    def test_drain(self):
+        old = self._plugins[0]
+        module = __import__(type(old).__module__)
+        self._channel.commands['wait']('u', '#a', '')
+        self.assertEqual(len(module.CALLS), 1)
+
+        self.write('echo.py', 2)
+        reloaded = self.reload()
+        self.assertEqual(reloaded, [])
+        self.assertEqual(module.SHUTDOWN, [])
+
+        # The old plugin is shut down once its running handlers finish.
+        module.CALLS[0].callback(None)
+        self.assertEqual(reloaded, ['echo.py'])
+        self.assertEqual(module.SHUTDOWN, [old])
+
+    def test_failed_reload(self):
+        self.write('echo.py', 2, 'this is not python %(version)d')
+        self.assertEqual(self.reload(), [])
+
+        self.assertEqual(self._channel.commands['echo']('u', '#a', ''), 1)
+        self.assertEqual(self._reloader.changed(), [])
+
+    def test_added_and_removed(self):
+        self.write('other.py', 3, ECHO.replace("'echo'", "'other'"))
+        self.assertEqual(self.reload(), ['other.py'])
+        self.assertEqual(
+            sorted(p.name for p in self._plugins), ['echo', 'other'])
+
+        os.unlink(os.path.join(self._dir, 'echo.py'))
+        self.assertEqual(self.reload(), ['echo.py'])
+        self.assertEqual([p.name for p in self._plugins], ['other'])
+        self.assertEqual(self._channel.commands['echo']('u', '#a', ''), 3)
+
+    def test_command(self):
+        lines = []
+        d = self._reloader.command('admin!a@host', '')
+        d.addCallback(lines.extend)
+        self.assertEqual(lines, ['Nothing to reload'])
+
+        lines = []
+        d = self._reloader.command('admin!a@host', 'echo')
+        d.addCallback(lines.extend)
+        self.assertEqual(lines, ['Reloaded echo.py'])
+
+    def test_watch(self):
+        self._reloader.watch(2)
+        self.write('echo.py', 2)
+        self._clock.advance(2)
+        self.assertEqual(self._channel.commands['echo']('u', '#a', ''), 2)
+
+
+class DrainTester(unittest.TestCase):
+    def test_drain(self):
+        import delbert.plugin
+
+        class Slow(delbert.plugin.Plugin):
+            def __init__(self):
+                super(Slow, self).__init__('slow')
+                self.calls = []
+
+            @delbert.plugin.irc_command('slow', deferred=True)
+            def slow(self, user, channel, args):
+                d = defer.Deferred()
+                self.calls.append(d)
+                return d
+
+            @delbert.plugin.irc_command('fail')
+            def fail(self, user, channel, args):
+                raise ValueError('failed')
+
+        p = Slow()
+        drained = []
+        p.drain().addCallback(drained.append)
+        self.assertEqual(len(drained), 1)
+
+        p.slow('u', '#a', '')
+        p.slow('u', '#a', '')
+        self.assertRaises(ValueError, p.fail, 'u', '#a', '')
+
+        drained = []
+        p.drain().addCallback(drained.append)
+        p.calls[0].callback(None)
+        self.assertEqual(drained, [])
+        p.calls[1].callback(None)
+        self.assertEqual(len(drained), 1)
+
+    def test_queued(self):
+        import delbert.plugin
+
+        class Queued(delbert.plugin.Plugin):
+            def __init__(self):
+                super(Queued, self).__init__('queued')
+
+            @delbert.plugin.irc_command('queued')
+            def queued_command(self, user, channel, args):
+                pass
+
+        p = Queued()
+        self.assertIs(
+            delbert.plugin.owner(p.commands['queued_command']), p)
+        self.assertIsNone(delbert.plugin.owner(lambda: None))
+
+        # A job waiting for a thread holds up the drain.
+        leave = p.queued()
+        drained = []
+        p.drain().addCallback(drained.append)
+        self.assertEqual(drained, [])
+        self.assertEqual(leave('result'), 'result')
+        self.assertEqual(len(drained), 1)
+
+
+def main():
+    unittest.main()
+
+
+if __name__ == '__main__':
+    main()
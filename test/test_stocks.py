@@ -13,7 +13,7 @@ class StocksTester(unittest.TestCase):
 
     @base.net_test
     def test_quote(self):
-        m = self._stocks.get_quote('AAPL')
+        m = base.result_of(self._stocks.get_quote('AAPL'))
         self.assertIn('Status', m)
         self.assertEqual(m['Status'], 'SUCCESS')
 
@@ -23,7 +23,7 @@ class StocksTester(unittest.TestCase):
             self.assertIn(k, m)
 
         with self.assertRaises(self._exc['InvalidSymbolError']):
-            m = self._stocks.get_quote('BLAH')
+            m = base.result_of(self._stocks.get_quote('BLAH'))
 
     @responses.activate
     def test_msg(self):
@@ -49,6 +49,14 @@ class StocksTester(unittest.TestCase):
         self.assertEqual(1, len(self._proto.msgs))
         self.assertEqual(self._proto.msgs[0][2], u'Apple Inc [AAPL], 124.31, -2.83(-2.23%)')
 
+    @responses.activate
+    def test_invalid(self):
+        base.create_json_response('.*markitondemand.com.*', {
+            'Message': 'No symbol matches found for BLAH'})
+
+        self._proto.privmsg('tester', base.TEST_CHANNEL, '!quote BLAH')
+        self.assertEqual(self._proto.msgs, [('msg', base.TEST_CHANNEL, 'Invalid Symbol BLAH')])
+
 def main():
     unittest.main()
 
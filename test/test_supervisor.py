@@ -0,0 +1,147 @@
+import unittest
+
+from twisted.internet import error, task
+from twisted.python import failure
+
+import base  # noqa: F401, puts the repository on sys.path
+
+import delbert.supervisor
+
+
+class FakeProcess(object):
+    def __init__(self, proto, args):
+        self.proto = proto
+        self.args = args
+        self.signals = []
+
+    def signalProcess(self, signal):
+        self.signals.append(signal)
+
+    def end(self):
+        self.proto.processEnded(failure.Failure(error.ProcessTerminated(1)))
+
+
+class ShardTester(unittest.TestCase):
+    def setUp(self):
+        self._config = {
+            'networks': [
+                {
+                    'nick': 'bot',
+                    'channels': dict(
+                        ('#channel-%d' % (i,), None) for i in range(50)),
+                    'github': {
+                        'listen_port': 8080,
+                        'repos': {'me/repo': {'#channel-7': ['push']}},
+                    },
+                },
+            ],
+        }
+
+    def test_shard_of(self):
+        for channel in self._config['networks'][0]['channels']:
+            shard = delbert.supervisor.shard_of(channel, 4)
+            self.assertTrue(0 <= shard < 4)
+            self.assertEqual(shard, delbert.supervisor.shard_of(channel, 4))
+            self.assertEqual(
+                shard,
+                delbert.supervisor.shard_of(channel.upper(), 4))
+
+    def test_shard_config(self):
+        configs = [
+            delbert.supervisor.shard_config(self._config, i, 3)
+            for i in range(3)]
+
+        channels = [set(c['networks'][0]['channels']) for c in configs]
+        self.assertEqual(
+            set.union(*channels),
+            set(self._config['networks'][0]['channels']))
+        self.assertEqual(sum(len(c) for c in channels), 50)
+        self.assertTrue(all(len(c) for c in channels))
+
+        nicks = [c['networks'][0]['nick'] for c in configs]
+        self.assertEqual(nicks, ['bot', 'bot-1', 'bot-2'])
+        self.assertTrue(
+            all(c['networks'][0]['account'] == 'bot' for c in configs))
+
+    def test_github_pinned(self):
+        configs = [
+            delbert.supervisor.shard_config(self._config, i, 3)
+            for i in range(3)]
+
+        self.assertIn('#channel-7', configs[0]['networks'][0]['channels'])
+        self.assertEqual(
+            configs[0]['networks'][0]['github']['listen_port'], 8080)
+        for config in configs[1:]:
+            self.assertNotIn('listen_port', config['networks'][0]['github'])
+
+        # The original is left alone.
+        self.assertEqual(len(self._config['networks'][0]['channels']), 50)
+
+
+class SupervisorTester(unittest.TestCase):
+    def setUp(self):
+        self._clock = task.Clock()
+        self._processes = []
+        self._supervisor = delbert.supervisor.Supervisor(
+            ['python', 'delbert'], 2,
+            max_delay=8,
+            clock=self._clock,
+            spawn=self.spawn)
+
+    def spawn(self, proto, executable, args, **kwds):
+        process = FakeProcess(proto, args)
+        self._processes.append(process)
+        return process
+
+    def test_start(self):
+        self._supervisor.start()
+        self.assertEqual(
+                [p.args for p in self._processes],
+                [
+                    ['python', 'delbert', '--shard', '0/2'],
+                    ['python', 'delbert', '--shard', '1/2'],
+                ])
+
+    def test_restart(self):
+        self._supervisor.start()
+
+        for delay in (1, 2, 4, 8, 8):
+            process = self._supervisor.workers[1]
+            process.end()
+            self.assertNotIn(1, self._supervisor.workers)
+
+            self._clock.advance(delay - 0.1)
+            self.assertNotIn(1, self._supervisor.workers)
+            self._clock.advance(0.1)
+            self.assertEqual(
+                self._supervisor.workers[1].args[-1], '1/2')
+
+        # A worker that ran for a while is restarted straight away.
+        self._clock.advance(60)
+        self._supervisor.workers[1].end()
+        self._clock.advance(1)
+        self.assertIn(1, self._supervisor.workers)
+
+    def test_stop(self):
+        self._supervisor.start()
+        d = self._supervisor.stop()
+
+        self.assertEqual([p.signals for p in self._processes], [['TERM']] * 2)
+
+        stopped = []
+        d.addCallback(stopped.append)
+        for process in self._processes:
+            process.end()
+
+        self.assertEqual(len(stopped), 1)
+        self.assertEqual(self._supervisor.workers, {})
+        self._clock.advance(60)
+        self.assertEqual(len(self._processes), 2)
+
+
+def main():
+    unittest.main()
+
+
+if __name__ == '__main__':
+    main()
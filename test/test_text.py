@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+
+import unittest
+
+from twisted.internet import task
+from twisted.test import proto_helpers
+
+import base
+
+import delbert.bot
+import delbert.outbound
+import delbert.text
+
+
+class SplitTester(unittest.TestCase):
+    def test_short(self):
+        self.assertEqual(delbert.text.split_message('hello', 10), ['hello'])
+        self.assertEqual(delbert.text.split_message(u'hello', 10), ['hello'])
+
+    def test_newlines(self):
+        self.assertEqual(
+                delbert.text.split_message('one\r\ntwo\nthree', 10),
+                ['one', 'two', 'three'])
+
+    def test_blank(self):
+        self.assertEqual(
+                delbert.text.split_message('one\n\n  \ntwo\n', 10),
+                ['one', 'two'])
+        self.assertEqual(delbert.text.split_message('', 10), [])
+        self.assertEqual(delbert.text.split_message(' ' * 25, 10), [])
+
+    def test_spaces(self):
+        self.assertEqual(
+                delbert.text.split_message('aaaa bbbb cccc', 10),
+                ['aaaa bbbb', 'cccc'])
+
+    def test_no_spaces(self):
+        self.assertEqual(
+                delbert.text.split_message('a' * 25, 10),
+                ['a' * 10, 'a' * 10, 'a' * 5])
+
+    def test_multibyte(self):
+        msg = u'é' * 7
+        lines = delbert.text.split_message(msg, 5)
+
+        self.assertTrue(all(len(line) <= 5 for line in lines))
+        self.assertEqual(
+                u''.join(line.decode('utf-8') for line in lines),
+                msg)
+
+
+class PackTester(unittest.TestCase):
+    def test_pack(self):
+        self.assertEqual(
+                delbert.text.pack_lines(['a', 'b', 'c'], 10),
+                ['a | b | c'])
+
+    def test_limit(self):
+        self.assertEqual(
+                delbert.text.pack_lines(['aaaa', 'bbbb', 'cccc'], 11),
+                ['aaaa | bbbb', 'cccc'])
+
+    def test_long_line(self):
+        self.assertEqual(
+                delbert.text.pack_lines(['a', 'b' * 12, 'c'], 10),
+                ['a', 'b' * 10, 'bb | c'])
+
+    def test_utf8_length(self):
+        lines = delbert.text.pack_lines([u'éé', u'éé'], 8)
+        self.assertEqual(len(lines), 2)
+
+    def test_empty(self):
+        self.assertEqual(delbert.text.pack_lines([], 10), [])
+        self.assertEqual(delbert.text.pack_lines(['', '  '], 10), [])
+
+
+class ProtocolTester(unittest.TestCase):
+    def setUp(self):
+        self._clock = task.Clock()
+        scheduler = delbert.outbound.OutboundScheduler(
+            rate=100, burst=100, clock=self._clock)
+        self._proto = delbert.bot.BotProtocol(
+            base.TEST_NICK, 'pw', {}, scheduler)
+        self._transport = proto_helpers.StringTransport()
+        self._proto.makeConnection(self._transport)
+        self._proto.irc_RPL_WELCOME('server', [base.TEST_NICK, 'Welcome'])
+        self._proto.irc_RPL_ENDOFMOTD('server', [base.TEST_NICK, 'End'])
+        self._clock.advance(10)
+        self._transport.clear()
+
+    def lines(self):
+        return self._transport.value().splitlines()
+
+    def test_send_lines(self):
+        self._proto.send_lines('#a', ['one', 'two', 'three'])
+        self._proto.send_lines('#a', ['four', 'five'], notice=True)
+        self.assertEqual(
+                self.lines(),
+                [
+                    'PRIVMSG #a :one | two | three',
+                    'NOTICE #a :four | five',
+                ])
+
+    def test_line_length(self):
+        self._proto.send_lines('#a', [u'é' * 40] * 40)
+        self._proto.send_notice('#a', u'é' * 400)
+
+        lines = self.lines()
+        self.assertTrue(len(lines) > 2)
+        for line in lines:
+            self.assertTrue(len(line) + 2 <= 512)
+            line.decode('utf-8')
+
+
+def main():
+    unittest.main()
+
+
+if __name__ == '__main__':
+    main()
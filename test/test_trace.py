@@ -0,0 +1,181 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from twisted.internet import defer, task
+from twisted.test import proto_helpers
+
+import base
+
+import delbert.bot
+import delbert.plugin
+import delbert.trace
+
+
+class EchoPlugin(delbert.plugin.Plugin):
+    def __init__(self, config=None):
+        super(EchoPlugin, self).__init__('echo')
+
+    @delbert.plugin.irc_command('echo the arguments', deferred=True)
+    def echo(self, user, channel, args):
+        self._proto.send_msg(channel, args)
+        return defer.succeed(None)
+
+
+class TestFactory(delbert.bot.BotFactory):
+    def _load_plugins(self, path='plugins'):
+        return [EchoPlugin()]
+
+
+def read_events(path):
+    with open(path) as f:
+        text = f.read()
+
+    # The array is left open so events can be appended.
+    assert text.startswith('[\n')
+    return json.loads(text.rstrip().rstrip(',') + ']')
+
+
+class TracerTester(unittest.TestCase):
+    def setUp(self):
+        self._dir = tempfile.mkdtemp()
+        self._path = os.path.join(self._dir, 'trace.json')
+
+    def tearDown(self):
+        shutil.rmtree(self._dir)
+
+    def test_sample(self):
+        values = iter([0.5, 0.05, 0.2])
+        tracer = delbert.trace.Tracer(
+            self._path,
+            sample=0.1,
+            rand=lambda: next(values))
+
+        self.assertIsNone(tracer.start('privmsg'))
+        traced = tracer.start('privmsg', channel='#a')
+        self.assertIsNotNone(traced)
+        self.assertIsNone(tracer.start('privmsg'))
+        tracer.close()
+
+        events = read_events(self._path)
+        self.assertEqual(len(events), 1)
+        self.assertEqual(events[0]['name'], 'privmsg')
+        self.assertEqual(events[0]['tid'], traced)
+        self.assertEqual(events[0]['args'], {'channel': '#a'})
+
+    def test_wrap(self):
+        tracer = delbert.trace.Tracer(self._path, sample=1)
+        traced = tracer.start('privmsg')
+        seen = []
+
+        def handler(value):
+            seen.append(delbert.trace.current())
+            return value
+
+        handler.help = 'help'
+        wrapped = tracer.wrap(handler, traced, 'command echo')
+        self.assertEqual(wrapped.help, 'help')
+        self.assertEqual(wrapped(1), 1)
+        self.assertEqual(seen, [traced])
+        self.assertIsNone(delbert.trace.current())
+
+        # Handlers of messages that are not traced are left alone.
+        self.assertIs(tracer.wrap(handler, None, 'command echo'), handler)
+        tracer.close()
+
+        events = read_events(self._path)
+        self.assertEqual(
+            [(e['name'], e['ph']) for e in events],
+            [
+                ('privmsg', 'i'),
+                ('queued command echo', 'X'),
+                ('command echo', 'X'),
+            ])
+
+    def test_deferred(self):
+        tracer = delbert.trace.Tracer(self._path, sample=1)
+        d = defer.Deferred()
+        wrapped = tracer.wrap(lambda: d, 1, 'command wait')
+        wrapped()
+        self.assertEqual(len(read_events(self._path)), 1)
+
+        d.callback(None)
+        tracer.close()
+        self.assertEqual(read_events(self._path)[-1]['name'], 'command wait')
+
+    def test_rotate(self):
+        tracer = delbert.trace.Tracer(
+            self._path,
+            sample=1,
+            rotate_length=200)
+        for i in range(10):
+            tracer.instant(1, 'event %d' % (i,))
+        tracer.close()
+
+        # Every file is a trace on its own.
+        self.assertTrue(os.path.exists(self._path + '.1'))
+        for name in os.listdir(self._dir):
+            read_events(os.path.join(self._dir, name))
+
+
+class BotTraceTester(unittest.TestCase):
+    def setUp(self):
+        self._dir = tempfile.mkdtemp()
+        self._path = os.path.join(self._dir, 'trace.json')
+        self._clock = task.Clock()
+        self._tracer = delbert.trace.Tracer(self._path, sample=1)
+        self._factory = TestFactory(
+            {
+                'nick': base.TEST_NICK,
+                'pass': 'pw',
+                'dbdir': self._dir,
+                'channels': {'#a': None},
+                'sasl': False,
+            },
+            self._clock,
+            tracer=self._tracer)
+
+        self._transport = proto_helpers.StringTransport()
+        self._proto = self._factory.buildProtocol(None)
+        self._proto.makeConnection(self._transport)
+        self._proto.irc_RPL_WELCOME('server', [base.TEST_NICK, 'Welcome'])
+        self._proto.irc_RPL_ENDOFMOTD('server', [base.TEST_NICK, 'End'])
+
+    def tearDown(self):
+        self._tracer.close()
+        shutil.rmtree(self._dir)
+
+    def test_privmsg(self):
+        self._proto.privmsg('user!u@host', '#a', '!echo hello')
+        self._clock.pump([1] * 5)
+        self.assertIn('PRIVMSG #a :hello', self._transport.value())
+
+        events = read_events(self._path)
+        traced = events[0]['tid']
+        self.assertEqual(events[0]['name'], 'privmsg')
+        self.assertTrue(all(e['tid'] == traced for e in events))
+        self.assertEqual(
+            [e['name'] for e in events],
+            [
+                'privmsg',
+                'queued command echo',
+                'send_msg',
+                'outbound PRIVMSG',
+                'command echo',
+            ])
+
+    def test_untraced(self):
+        self._proto.send_msg('#a', 'hello')
+        self._clock.pump([1] * 5)
+        self.assertFalse(os.path.exists(self._path) and os.path.getsize(
+            self._path))
+
+
+def main():
+    unittest.main()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,147 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from cStringIO import StringIO
+
+from twisted.internet import defer, task
+from twisted.web.test import requesthelper
+
+import base  # noqa: F401, puts the repository on sys.path
+
+import delbert.httpclient
+
+import upstream
+
+
+def make_request(uri, method='GET', body=''):
+    request = requesthelper.DummyRequest(uri.split('?')[0].split('/')[1:])
+    request.method = method
+    request.uri = uri
+    request.path = uri.split('?')[0]
+    request.content = StringIO(body)
+    return request
+
+
+class FakeHTTPClient(object):
+    def __init__(self):
+        self.requests = []
+
+    def request(self, method, url, data=None):
+        self.requests.append((method, url, data))
+        return defer.succeed(delbert.httpclient.Response(
+            url,
+            200,
+            {'content-type': 'application/json'},
+            json.dumps({'answer': 'no'})))
+
+
+class FixturesTester(unittest.TestCase):
+    def setUp(self):
+        self._fixtures = upstream.Fixtures(
+            upstream.DEFAULT_FIXTURES)
+
+    def test_find(self):
+        status, headers, body = self._fixtures.find(
+            'markitondemand', 'GET', '/Api/v2/Quote/json', 'symbol=AAPL')
+        self.assertEqual(status, 200)
+        self.assertEqual(headers['content-type'], 'application/json')
+        self.assertEqual(json.loads(body)['Symbol'], 'AAPL')
+
+        # Unknown symbols fall back to the pattern.
+        _, _, body = self._fixtures.find(
+            'markitondemand', 'GET', '/Api/v2/Quote/json', 'symbol=BLAH')
+        self.assertIn('Message', json.loads(body))
+
+        status, _, _ = self._fixtures.find(
+            'wunderground', 'GET', '/api/key/conditions/q/MA/Boston.json')
+        self.assertEqual(status, 200)
+
+        self.assertIsNone(self._fixtures.find('yesno', 'GET', '/other'))
+        self.assertIsNone(self._fixtures.find('unknown', 'GET', '/'))
+
+    def test_services(self):
+        # Every shipped fixture belongs to a known service.
+        for name in os.listdir(upstream.DEFAULT_FIXTURES):
+            self.assertIn(
+                os.path.splitext(name)[0],
+                upstream.SERVICES)
+
+
+class UpstreamTester(unittest.TestCase):
+    def setUp(self):
+        self._dir = tempfile.mkdtemp()
+        self._clock = task.Clock()
+        self._random = [0.5]
+        self._http = FakeHTTPClient()
+        shutil.copy(
+            os.path.join(upstream.DEFAULT_FIXTURES, 'yesno.json'),
+            self._dir)
+
+    def tearDown(self):
+        shutil.rmtree(self._dir)
+
+    def upstream(self, faults=None, record=False):
+        return upstream.UpstreamResource(
+            upstream.Fixtures(self._dir),
+            faults,
+            self._http if record else None,
+            self._clock,
+            lambda: self._random[0])
+
+    def test_latency(self):
+        server = self.upstream({'*': {'latency': 1, 'jitter': 1}})
+        request = make_request('/yesno/api')
+        server.render(request)
+
+        self._clock.advance(1)
+        self.assertEqual(request.finished, 0)
+        self._clock.advance(0.5)
+        self.assertEqual(request.finished, 1)
+        self.assertEqual(json.loads(''.join(request.written))['answer'], 'yes')
+
+    def test_errors(self):
+        server = self.upstream({'yesno': {'error_rate': 0.6}})
+        request = make_request('/yesno/api')
+        server.render(request)
+        self._clock.advance(0)
+        self.assertEqual(request.responseCode, 503)
+
+        request = make_request('/yesno/api')
+        self.upstream({'yesno': {'timeout_rate': 0.6}}).render(request)
+        self._clock.advance(100)
+        self.assertEqual(request.finished, 0)
+
+    def test_missing(self):
+        server = self.upstream()
+        request = make_request('/yesno/other')
+        server.render(request)
+        self._clock.advance(0)
+        self.assertEqual(request.responseCode, 404)
+        self.assertEqual(server.stats['missing'], 1)
+
+    def test_record(self):
+        server = self.upstream(record=True)
+        request = make_request('/yesno/other?q=1')
+        server.render(request)
+        self._clock.advance(0)
+
+        self.assertEqual(
+            self._http.requests, [('GET', 'http://yesno.wtf/other?q=1', None)])
+        self.assertEqual(
+            json.loads(''.join(request.written)), {'answer': 'no'})
+
+        # The response is saved and served from then on.
+        fixtures = upstream.Fixtures(self._dir)
+        self.assertIsNotNone(fixtures.find('yesno', 'GET', '/other', 'q=1'))
+        self.assertIsNotNone(fixtures.find('yesno', 'GET', '/api'))
+
+
+def main():
+    unittest.main()
+
+
+if __name__ == '__main__':
+    main()
@@ -12,7 +12,7 @@ class UDTester(unittest.TestCase):
 
     @base.net_test
     def test_query_real(self):
-        m = self._plugin.query('test')
+        m = base.result_of(self._plugin.query('test'))
         self.assertEqual('A process for testing things', m)
 
     @responses.activate
@@ -20,7 +20,7 @@ class UDTester(unittest.TestCase):
         ret = {'definition': 'test response'}
         base.create_json_response('.*urbandictionary.*', {'list': [ret]})
 
-        m = self._plugin.query('test')
+        m = base.result_of(self._plugin.query('test'))
         self.assertEqual('test response', m)
 
     @responses.activate
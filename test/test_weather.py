@@ -323,9 +323,19 @@ class WeatherTester(unittest.TestCase):
         base.create_json_response('.*api\.wunderground.*', {'forecast': FAKE_FORECAST})
 
         self._proto.privmsg('tester', base.TEST_CHANNEL, '!forecast boston')
-        for i, txt in enumerate(FAKE_FORECAST['txt_forecast']['forecastday']):
-            self.assertEqual(self._proto.msgs[i][0], 'notice')
-            self.assertTrue(self._proto.msgs[i][2].endswith(txt['fcttext']))
+        self.assertTrue(all(m[0] == 'notice' for m in self._proto.msgs))
+        self.assertTrue(all(len(m[2]) <= 512 for m in self._proto.msgs))
+
+        # Days are packed together in order, each in one piece.
+        sent = ' | '.join(m[2] for m in self._proto.msgs)
+        last = -1
+        for txt in FAKE_FORECAST['txt_forecast']['forecastday']:
+            self.assertIn(txt['fcttext'], sent)
+            self.assertTrue(sent.index(txt['fcttext']) > last)
+            last = sent.index(txt['fcttext'])
+        self.assertTrue(
+            len(self._proto.msgs) <
+            len(FAKE_FORECAST['txt_forecast']['forecastday']))
 
 
 def main():
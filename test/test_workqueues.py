@@ -0,0 +1,209 @@
+import unittest
+
+from twisted.internet import defer, task
+from twisted.python import log
+from twisted.test import proto_helpers
+
+import base
+
+import delbert.bot
+import delbert.plugin
+import delbert.workqueues
+
+
+class WorkQueuesTester(unittest.TestCase):
+    def setUp(self):
+        self._clock = task.Clock()
+        self._shed = []
+        self._queues = delbert.workqueues.WorkQueues(
+            {'passive': 2, 'user_join': 1},
+            10,
+            self._clock,
+            lambda *args: self._shed.append(args))
+
+    def test_limit(self):
+        first = self._queues.admit('passive')
+        self.assertIsNotNone(first)
+        self.assertIsNotNone(self._queues.admit('passive'))
+        self.assertIsNone(self._queues.admit('passive'))
+        self.assertEqual(self._queues.pending('passive'), 2)
+        self.assertEqual(self._shed, [('passive', 'dropped')])
+
+        self.assertEqual(first('result'), 'result')
+        self.assertIsNotNone(self._queues.admit('passive'))
+
+    def test_commands(self):
+        for i in range(10):
+            self.assertIsNotNone(self._queues.admit('command'))
+        self.assertEqual(self._queues.pending('command'), 10)
+        self.assertEqual(self._shed, [])
+
+    def test_coalesce(self):
+        queues = delbert.workqueues.WorkQueues(clock=self._clock)
+        release = queues.admit('user_join', ('sup', '#a', 'user'))
+        self.assertIsNone(queues.admit('user_join', ('sup', '#a', 'user')))
+        self.assertIsNotNone(queues.admit('user_join', ('sup', '#b', 'user')))
+        self.assertEqual(queues.stats[('user_join', 'coalesced')], 1)
+
+        release(None)
+        self.assertIsNotNone(queues.admit('user_join', ('sup', '#a', 'user')))
+
+    def test_report(self):
+        messages = []
+
+        def observer(event):
+            messages.append(' '.join(event['message']))
+
+        log.addObserver(observer)
+        try:
+            self._queues.admit('user_join')
+            for i in range(3):
+                self._queues.admit('user_join')
+            self.assertEqual(len(messages), 1)
+
+            self._clock.advance(10)
+            self.assertEqual(
+                messages[1], 'Dropped 3 user_join jobs in the last 10s')
+            self.assertFalse(self._clock.getDelayedCalls())
+
+            # Coalescing is not overload.
+            del messages[:]
+            queues = delbert.workqueues.WorkQueues(clock=self._clock)
+            queues.admit('user_join', 'key')
+            queues.admit('user_join', 'key')
+            self.assertEqual(messages, [])
+            self.assertFalse(self._clock.getDelayedCalls())
+        finally:
+            log.removeObserver(observer)
+
+
+class SlowPlugin(delbert.plugin.Plugin):
+    """
+    Handlers running on the reactor wait on Deferreds.  The reactor is not
+    running, so threaded handlers stay queued in its thread pool.
+    """
+    def __init__(self, config=None):
+        super(SlowPlugin, self).__init__('slow')
+        self.pending = []
+
+    def _wait(self):
+        d = defer.Deferred()
+        self.pending.append(d)
+        return d
+
+    @delbert.plugin.irc_passive('wait', keywords=['wait'], deferred=True)
+    def wait(self, user, channel, msg):
+        return self._wait()
+
+    @delbert.plugin.irc_passive('block', keywords=['block'])
+    def block(self, user, channel, msg):
+        pass
+
+    @delbert.plugin.irc_user_join('greet')
+    def greet(self, user, channel):
+        pass
+
+    @delbert.plugin.irc_command('reply', deferred=True)
+    def reply(self, user, channel, args):
+        self._proto.send_msg(channel, args)
+        return self._wait()
+
+
+class TestFactory(delbert.bot.BotFactory):
+    def _load_plugins(self, path='plugins'):
+        return []
+
+
+class ProtocolTester(unittest.TestCase):
+    def setUp(self):
+        self._clock = task.Clock()
+        self._plugin = SlowPlugin()
+        factory = TestFactory(
+            {
+                'nick': base.TEST_NICK,
+                'pass': 'pw',
+                'dbdir': '/tmp',
+                'channels': {'#a': None},
+                'flood': {'rate': 100, 'burst': 100},
+                'sasl': False,
+                'queues': {'passive': 2, 'user_join': 2},
+            },
+            self._clock,
+            plugins=[self._plugin])
+        self._queues = factory.queues
+
+        self._proto = factory.buildProtocol(None)
+        self._transport = proto_helpers.StringTransport()
+        self._proto.makeConnection(self._transport)
+        self._proto.irc_RPL_WELCOME('server', [base.TEST_NICK, 'Welcome'])
+        self._proto.irc_RPL_ENDOFMOTD('server', [base.TEST_NICK, 'End'])
+        self._clock.advance(1)
+        self._transport.clear()
+
+    def test_shed(self):
+        for i in range(5):
+            self._proto.privmsg('user!u@host', '#a', 'block %d' % (i,))
+        self.assertEqual(self._queues.pending('passive'), 2)
+        self.assertEqual(self._queues.stats[('passive', 'dropped')], 3)
+
+    def test_reactor_handlers(self):
+        # Handlers running on the reactor are not bounded.
+        for i in range(5):
+            self._proto.privmsg('user!u@host', '#a', 'wait %d' % (i,))
+        for i in range(3):
+            self._proto.privmsg('user!u@host', '#a', '!reply %d' % (i,))
+        self.assertEqual(len(self._plugin.pending), 8)
+        self.assertEqual(self._queues.pending('passive'), 0)
+        self.assertEqual(self._queues.pending('command'), 0)
+        self.assertFalse(self._queues.stats)
+
+        for d in self._plugin.pending:
+            d.callback(None)
+        self._clock.advance(1)
+        self.assertEqual(
+            self._transport.value().splitlines(),
+            ['PRIVMSG #a :0', 'PRIVMSG #a :1', 'PRIVMSG #a :2'])
+
+    def test_wrapped(self):
+        # Only admitted jobs get their metrics and spans recorded.
+        wrapped = []
+        timed = self._proto._timed
+
+        def record(f, kind, name, traced=None):
+            wrapped.append(name)
+            return timed(f, kind, name, traced)
+
+        self._proto._timed = record
+        for i in range(5):
+            self._proto.privmsg('user!u@host', '#a', 'block %d' % (i,))
+        self.assertEqual(wrapped, ['block', 'block'])
+
+    def test_drain(self):
+        # Jobs still waiting for a thread keep the plugin from draining.
+        self._proto.privmsg('user!u@host', '#a', 'block')
+        drained = []
+        self._plugin.drain().addCallback(drained.append)
+        self.assertEqual(drained, [])
+
+        # Shed jobs are not waited for.
+        for i in range(5):
+            self._proto.privmsg('user!u@host', '#a', 'block %d' % (i,))
+        self.assertEqual(self._plugin._running, 2)
+
+    def test_rejoin(self):
+        for i in range(3):
+            self._proto.userJoined('user!u@host', '#a')
+        self._proto.userJoined('other!u@host', '#a')
+        self._proto.userJoined('third!u@host', '#a')
+
+        self.assertEqual(self._queues.pending('user_join'), 2)
+        self.assertEqual(self._queues.stats[('user_join', 'coalesced')], 2)
+        self.assertEqual(self._queues.stats[('user_join', 'dropped')], 1)
+
+
+def main():
+    unittest.main()
+
+
+if __name__ == '__main__':
+    main()
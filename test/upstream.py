@@ -0,0 +1,343 @@
+import fnmatch
+import getopt
+import glob
+import json
+import os
+import random
+import sys
+import urlparse
+
+from twisted.internet import reactor, task
+from twisted.python import log
+from twisted.web import resource, server
+
+sys.path.insert(
+    0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import delbert.httpclient  # noqa: E402
+
+# Base urls of the services used by the plugins, requests for a service are
+# forwarded to them when recording.
+SERVICES = {
+    'excuses': 'http://developerexcuses.com/',
+    'github-status': 'https://status.github.com/',
+    'gitio': 'http://git.io/',
+    'humanid': 'https://uz83qtfqh2.execute-api.us-east-1.amazonaws.com/',
+    'isitdown': 'http://downforeveryoneorjustme.com/',
+    'markitondemand': 'http://dev.markitondemand.com/',
+    'startup': 'http://itsthisforthat.com/',
+    'telize': 'http://www.telize.com/',
+    'twitter': 'https://api.twitter.com/',
+    'urbandictionary': 'http://api.urbandictionary.com/',
+    'worldcup': 'http://worldcup.sfg.io/',
+    'wunderground': 'http://api.wunderground.com/',
+    'wunderground-autocomplete': 'http://autocomplete.wunderground.com/',
+    'yesno': 'http://yesno.wtf/',
+}
+
+DEFAULT_FIXTURES = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), 'fixtures', 'upstream')
+
+
+class Fixtures(object):
+    """
+    Recorded responses of upstream services, one json file per service
+    mapping requests to responses:
+
+        {
+            "GET /v0/define?term=test": {
+                "status": 200,
+                "headers": {"content-type": "application/json"},
+                "json": {"list": [{"definition": "..."}]}
+            },
+            "GET /api/*/conditions*": {"status": 200, "body": "..."}
+        }
+
+    A request is answered by the response recorded for its path and query,
+    then for its path alone, then by the longest pattern containing '*'.
+    Responses have either a json or a plain text body.
+    """
+    def __init__(self, path):
+        """
+        @param path - directory of the fixtures.
+        """
+        self._path = path
+        self._services = {}
+        for fixture in glob.glob(os.path.join(path, '*.json')):
+            name = os.path.splitext(os.path.basename(fixture))[0]
+            with open(fixture) as f:
+                self._services[name] = json.load(f)
+
+    def find(self, service, method, path, query=''):
+        """
+        Find the response to a request.
+
+        @param service  - name of the service.
+        @param method   - HTTP method.
+        @param path     - path of the request within the service.
+        @param query    - query string of the request.
+        @return         - (status, headers, body) or None.
+        """
+        recorded = self._services.get(service, {})
+        keys = ['%s %s' % (method, path)]
+        if query:
+            keys.insert(0, '%s %s?%s' % (method, path, query))
+
+        for key in keys:
+            if key in recorded:
+                return self._response(recorded[key])
+
+        patterns = sorted(
+            (k for k in recorded if '*' in k),
+            key=len,
+            reverse=True)
+        for pattern in patterns:
+            if fnmatch.fnmatchcase(keys[0], pattern):
+                return self._response(recorded[pattern])
+
+    @staticmethod
+    def _response(recorded):
+        headers = dict(recorded.get('headers', {}))
+        if 'json' in recorded:
+            body = json.dumps(recorded['json'])
+            headers.setdefault('content-type', 'application/json')
+        else:
+            body = recorded.get('body', '')
+            if isinstance(body, unicode):
+                body = body.encode('utf-8')
+        return recorded.get('status', 200), headers, body
+
+    def record(self, service, method, path, query, status, headers, body):
+        """
+        Record a response and save the fixtures of its service.
+        """
+        key = '%s %s' % (method, path)
+        if query:
+            key = '%s?%s' % (key, query)
+
+        recorded = {'status': status}
+        if 'content-type' in headers:
+            recorded['headers'] = {'content-type': headers['content-type']}
+        if 'location' in headers:
+            recorded.setdefault('headers', {})['location'] = headers[
+                'location']
+        try:
+            recorded['json'] = json.loads(body)
+        except ValueError:
+            recorded['body'] = body.decode('utf-8', 'replace')
+
+        fixtures = self._services.setdefault(service, {})
+        fixtures[key] = recorded
+
+        if not os.path.isdir(self._path):
+            os.makedirs(self._path)
+        path = os.path.join(self._path, '%s.json' % (service,))
+        with open(path + '.tmp', 'w') as f:
+            json.dump(fixtures, f, indent=2, sort_keys=True)
+        os.rename(path + '.tmp', path)
+
+
+class UpstreamResource(resource.Resource):
+    """
+    Stand-in for the upstream services, serving the recorded response of
+    each request after a delay.  Requests are made to /<service>/<path>, so
+    the base url of a plugin is pointed at http://host:port/<service>/.
+
+    Faults are injected per service to exercise the http client:
+        latency:        seconds before responding.
+        jitter:         up to that many seconds added to the latency.
+        error_rate:     fraction of requests answered with error_status.
+        error_status:   status of injected errors, 503 by default.
+        timeout_rate:   fraction of requests never answered.
+    """
+    isLeaf = True
+
+    def __init__(self, fixtures, faults=None, record=None, clock=None,
+                 rand=None):
+        """
+        @param fixtures - Fixtures to serve.
+        @param faults   - mapping of service names to their faults, the
+                          faults of '*' apply to every service.
+        @param record   - delbert.httpclient.HTTPClient forwarding requests
+                          missing from the fixtures to the real service and
+                          recording the response, None to answer them with
+                          404.
+        @param clock    - reactor used for delays.
+        @param rand     - function returning random numbers in [0, 1).
+        """
+        resource.Resource.__init__(self)
+        self._fixtures = fixtures
+        self._faults = faults if faults is not None else {}
+        self._record = record
+        self._clock = clock if clock is not None else reactor
+        self._rand = rand if rand is not None else random.random
+        self.stats = {
+            'requests': 0,
+            'errors': 0,
+            'timeouts': 0,
+            'missing': 0,
+            'recorded': 0,
+        }
+
+    def _faults_for(self, service):
+        faults = dict(self._faults.get('*', {}))
+        faults.update(self._faults.get(service, {}))
+        return faults
+
+    def render(self, request):
+        self.stats['requests'] += 1
+        service, _, path = request.path.lstrip('/').partition('/')
+        query = urlparse.urlsplit(request.uri).query
+        body = request.content.read() if request.content is not None else ''
+        faults = self._faults_for(service)
+
+        finished = []
+        request.notifyFinish().addBoth(finished.append)
+
+        if self._rand() < faults.get('timeout_rate', 0):
+            self.stats['timeouts'] += 1
+            return server.NOT_DONE_YET
+
+        delay = faults.get('latency', 0) + self._rand() * faults.get(
+            'jitter', 0)
+        d = task.deferLater(
+            self._clock,
+            delay,
+            self._respond,
+            request,
+            service,
+            '/' + path,
+            query,
+            body,
+            faults)
+        d.addCallback(self._write, request, finished)
+        d.addErrback(log.err, 'Failed to answer %s' % (request.uri,))
+        return server.NOT_DONE_YET
+
+    def _respond(self, request, service, path, query, body, faults):
+        if self._rand() < faults.get('error_rate', 0):
+            self.stats['errors'] += 1
+            return faults.get('error_status', 503), {}, 'Injected error'
+
+        method = request.method
+        found = self._fixtures.find(service, method, path, query)
+        if found is not None:
+            return found
+
+        if self._record is None or service not in SERVICES:
+            self.stats['missing'] += 1
+            return 404, {}, 'No fixture for %s %s' % (method, request.uri)
+
+        url = SERVICES[service] + path.lstrip('/')
+        if query:
+            url = '%s?%s' % (url, query)
+        d = self._record.request(method, url, data=body or None)
+        d.addCallback(self._recorded, service, method, path, query)
+        return d
+
+    def _recorded(self, resp, service, method, path, query):
+        self.stats['recorded'] += 1
+        self._fixtures.record(
+            service, method, path, query,
+            resp.status_code, resp.headers, resp.content)
+        return self._fixtures.find(service, method, path, query)
+
+    @staticmethod
+    def _write(response, request, finished):
+        if finished:
+            # The client gave up waiting.
+            return
+
+        status, headers, body = response
+        request.setResponseCode(status)
+        for name, value in headers.items():
+            request.setHeader(name, value)
+        request.write(body)
+        request.finish()
+
+
+def listen(upstream, port, interface='127.0.0.1'):
+    """
+    Serve the stand-in over http.
+
+    @param upstream     - UpstreamResource to serve.
+    @param port         - port to listen on.
+    @param interface    - address to listen on, local only by default.
+    @return             - the listening port.
+    """
+    return reactor.listenTCP(
+        port,
+        server.Site(upstream),
+        interface=interface)
+
+
+def usage():
+    print """%s [ARGUMENTS]
+
+Serve recorded responses of the upstream services used by the plugins.
+
+ARGUMENTS:
+    -h, --help              This screen
+    -f, --fixtures [DIR]    Directory of the fixtures [%s]
+    -p, --port [PORT]       Port to listen on [8089]
+    -l, --latency [SECONDS] Delay before every response [0]
+    -j, --jitter [SECONDS]  Random delay added to the latency [0]
+    -e, --errors [RATE]     Fraction of requests failing with a 503 [0]
+    -t, --timeouts [RATE]   Fraction of requests never answered [0]
+    -r, --record            Forward requests without a fixture to the real
+                            service and record its response
+""" % (sys.argv[0], DEFAULT_FIXTURES)
+
+
+def main():
+    try:
+        opts, args = getopt.getopt(
+            sys.argv[1:],
+            'hf:p:l:j:e:t:r',
+            [
+                'help',
+                'fixtures=',
+                'port=',
+                'latency=',
+                'jitter=',
+                'errors=',
+                'timeouts=',
+                'record',
+            ],
+        )
+    except getopt.GetoptError, e:
+        print (str(e))
+        sys.exit(1)
+
+    path = DEFAULT_FIXTURES
+    port = 8089
+    faults = {}
+    record = None
+
+    for o, a in opts:
+        if o in ('-h', '--help'):
+            usage()
+            sys.exit(0)
+        elif o in ('-f', '--fixtures'):
+            path = a
+        elif o in ('-p', '--port'):
+            port = int(a)
+        elif o in ('-l', '--latency'):
+            faults['latency'] = float(a)
+        elif o in ('-j', '--jitter'):
+            faults['jitter'] = float(a)
+        elif o in ('-e', '--errors'):
+            faults['error_rate'] = float(a)
+        elif o in ('-t', '--timeouts'):
+            faults['timeout_rate'] = float(a)
+        elif o in ('-r', '--record'):
+            record = delbert.httpclient.HTTPClient()
+
+    log.startLogging(sys.stdout)
+    upstream = UpstreamResource(Fixtures(path), {'*': faults}, record)
+    listen(upstream, port)
+    reactor.run()
+
+
+if __name__ == '__main__':
+    main()